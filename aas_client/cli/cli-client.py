@@ -14,6 +14,7 @@ import sys
 
 from aas_client.common import (
     AnnotationHelperClientProtocol,
+    DecisionTreeWalker,
     format_tree
     )
 
@@ -29,11 +30,16 @@ class UserAction(Enum):
     exit = 6
     process_request = 7
     forest_request = 8
+    id_request = 9
+    batch_request = 10
+    next = 11
 
 ARGUMENT_OBLIGATORY_ACTIONS = (
     UserAction.save,
     UserAction.process_request,
-    UserAction.forest_request
+    UserAction.forest_request,
+    UserAction.id_request,
+    UserAction.batch_request
     )
 
 def perform_yes(question):
@@ -119,6 +125,49 @@ def perform_forest_request(forest_filename, default_format='conll09'):
         'forest_format': forest_format
         }
 
+def perform_id_request(sentence_id):
+    '''
+    Return a use_stored_forest AaSP message requesting the forest stored on
+    the server under the given sentence id.
+    '''
+    return {
+        'type': 'request',
+        'use_stored_forest': sentence_id
+        }
+
+def perform_batch_request(sentences_filename, default_target='conll09',
+        default_source='raw'):
+    '''
+    Ask the user for source and target format and return a process_batch
+    AaSP message containing the sentences in the given file (one sentence
+    per line).
+    '''
+    prompt = "What format have you provided? (Default: {}) "
+    user_provided = input(prompt.format(default_source))
+    source_format = user_provided or default_source
+    prompt = "What format do you want? (Default: {}) "
+    user_provided = input(prompt.format(default_target))
+    target_format = user_provided or default_target
+    sentences = [
+        line.strip()
+        for line in open(sentences_filename)
+        if line.strip()
+        ]
+    return {
+        'type': 'request',
+        'process_batch': sentences,
+        'source_format': source_format,
+        'target_format': target_format
+        }
+
+def perform_next():
+    '''
+    Return a next AaSP message.
+    '''
+    return {
+        'type': 'next'
+        }
+
 def perform_user_action(user_action, argument=None, **message_properties):
     '''
     Given a UserAction object and an argument, perform the UserAction
@@ -138,6 +187,12 @@ def perform_user_action(user_action, argument=None, **message_properties):
         return perform_process_request(argument)
     elif user_action is UserAction.forest_request:
         return perform_forest_request(argument)
+    elif user_action is UserAction.id_request:
+        return perform_id_request(argument)
+    elif user_action is UserAction.batch_request:
+        return perform_batch_request(argument)
+    elif user_action is UserAction.next:
+        return perform_next()
     elif user_action is UserAction.exit:
         return perform_exit()
     else:
@@ -163,6 +218,15 @@ def format_user_action_hint(user_action):
     elif user_action is UserAction.forest_request:
         description = 'send use_forest request'
         argument = ' forest_file'
+    elif user_action is UserAction.id_request:
+        description = 'send use_stored_forest request'
+        argument = ' sentence_id'
+    elif user_action is UserAction.batch_request:
+        description = 'send process_batch request'
+        argument = ' sentences_file'
+    elif user_action is UserAction.next:
+        description = 'continue with next sentence of the batch'
+        argument = ''
     else:
         description = user_action.name
         argument = ''
@@ -212,11 +276,12 @@ def handle_solution(self, solution):
     '''
     display_solution(solution['tree'])
 
-    action, argument = prompt_for_user_action(
-        UserAction.undo,
-        UserAction.save,
-        UserAction.exit
-        )
+    user_actions = [UserAction.undo, UserAction.save, UserAction.exit]
+    if solution.get('batch_index', 0) + 1 < solution.get('batch_size', 0):
+        print('Sentence {} of {}.'.format(
+            solution['batch_index'] + 1, solution['batch_size']))
+        user_actions.insert(0, UserAction.next)
+    action, argument = prompt_for_user_action(*user_actions)
     response = perform_user_action(
         action,
         argument,
@@ -239,11 +304,19 @@ def display_question(question):
     s = s.format(head=qo['head'], relation=qo['relation'],
         dependent=qo['dependent'])
     print(s)
+    if 'expected_questions' in question:
+        print('About {:.0f} questions left.'.format(question['expected_questions']))
 
 def handle_question(self, question):
     '''
     Put a question to the user and collect their response.
     '''
+    if 'decision_tree' in question:
+        self.walker = DecisionTreeWalker(question)
+        # The root lies beyond the compiled region if the tree is empty.
+        if self.walker.message() is not None:
+            return walk_decision_tree(self)
+
     display_question(question)
 
     action, argument = prompt_for_user_action(
@@ -266,6 +339,59 @@ def handle_question(self, question):
     else:
         self.end_conversation()
 
+def walk_decision_tree(self):
+    '''
+    Put the questions of a decision tree to the user without contacting
+    the server until the user leaves the compiled region of the tree.
+    Return the messages to send to the server then.
+    '''
+    walker = self.walker
+    message = walker.message()
+    while message is not None:
+        if message['type'] == 'question':
+            display_question(message)
+            user_actions = [UserAction.yes, UserAction.no, UserAction.undo,
+                UserAction.abort, UserAction.save, UserAction.exit]
+            tree = message['best_tree']
+        else:
+            display_solution(message['tree'])
+            user_actions = [UserAction.undo, UserAction.save, UserAction.exit]
+            if message.get('batch_index', 0) + 1 < message.get('batch_size', 0):
+                print('Sentence {} of {}.'.format(
+                    message['batch_index'] + 1, message['batch_size']))
+                user_actions.insert(0, UserAction.next)
+            tree = message['tree']
+        action, argument = prompt_for_user_action(*user_actions)
+
+        if action in (UserAction.yes, UserAction.no):
+            walker.answer(action is UserAction.yes)
+        elif action is UserAction.undo:
+            remaining = walker.undo(int((argument or '1').split()[0]))
+            if remaining:
+                return leave_decision_tree(self,
+                    [perform_undo(str(remaining))])
+        elif action is UserAction.abort:
+            return leave_decision_tree(self,
+                walker.answer_messages() + [perform_abort()])
+        elif action is UserAction.next:
+            return leave_decision_tree(self, [perform_next()])
+        else:
+            perform_user_action(action, argument, tree=tree)
+            self.end_conversation()
+            return None
+        message = walker.message()
+
+    return leave_decision_tree(self, walker.answer_messages())
+
+def leave_decision_tree(self, messages):
+    '''
+    Stop walking the decision tree and return the messages to send to the
+    server. The last message asks for a new decision tree.
+    '''
+    self.walker = None
+    messages[-1]['decision_tree'] = self.request.get('decision_tree', {})
+    return messages
+
 def display_error(error):
     '''
     Display an error to the user.
@@ -281,9 +407,11 @@ def handle_error(self, error):
     display_error(error)
     sys.exit(1)
 
-def create_request(forest_file=None):
+def create_request(forest_file=None, decision_tree=False):
     '''
-    Generate a request either from a given file or by asking the user.
+    Generate a request either from a given file or by asking the user. If
+    decision_tree is True, the request asks for a decision tree, so most
+    answers can be handled without contacting the server.
     '''
     if forest_file:
         request = perform_forest_request(forest_file)
@@ -291,9 +419,13 @@ def create_request(forest_file=None):
         action, argument = prompt_for_user_action(
             UserAction.forest_request,
             UserAction.process_request,
+            UserAction.id_request,
+            UserAction.batch_request,
             UserAction.exit
             )
         request = perform_user_action(action, argument)
+    if decision_tree:
+        request['decision_tree'] = {}
     return request
 
 def main():
@@ -312,6 +444,15 @@ def main():
         help='Unix socket file to use instead of host and port.')
     parser.add_argument('-f', '--conll_file', required=False, default=None,
         help='Path of a file containing a forest.')
+    parser.add_argument('-d', '--decision_tree', action='store_true',
+        help='Download the questions as a decision tree and only contact'
+        ' the server when leaving it.')
+    parser.add_argument('-e', '--encodings', nargs='+', required=False,
+        help='Encodings to offer to the server in order of preference,'
+        ' e.g. msgpack cbor (default: json).')
+    parser.add_argument('-z', '--compressions', nargs='+', required=False,
+        help='Compressions to offer to the server in order of preference,'
+        ' e.g. zstd zlib (default: none).')
 
     args = parser.parse_args()
 
@@ -323,7 +464,8 @@ def main():
         socket_to_server.connect((args.host, args.port))
 
     loop = asyncio.get_event_loop()
-    request_creator = lambda : create_request(args.conll_file)
+    request_creator = lambda : create_request(args.conll_file,
+        args.decision_tree)
     coro = loop.create_connection(
         lambda : AnnotationHelperClientProtocol(
             loop,
@@ -332,7 +474,9 @@ def main():
             inform=lambda self, message: 0,
             handle_question=handle_question,
             handle_error=handle_error,
-            handle_solution=handle_solution
+            handle_solution=handle_solution,
+            encodings=args.encodings,
+            compressions=args.compressions
             ),
         sock=socket_to_server
         )
@@ -4,6 +4,14 @@ import asyncio
 import json
 import types
 
+from aas_server.framing import (
+    DEFAULT_MAX_MESSAGE_SIZE,
+    FramingError,
+    MessageBuffer,
+    pack_message
+    )
+from aas_server.message_codec import COMPRESSIONS, ENCODINGS, MessageCodec
+
 def encode_message(message):
     '''
     Prepare a message for being sent. This includes converting to json.
@@ -16,13 +24,6 @@ def decode_message(bytestring):
     '''
     return json.loads(bytestring.decode())
 
-def pack_message(bytestring):
-    '''
-    Prefix a bytestring by its length and a null byte. This prefix is
-    used after sending to extract the message at the receiving side.
-    '''
-    return str(len(bytestring)).encode() + b'\0' + bytestring
-
 def inform(self, message):
     '''
     Inform the user of what is happening.
@@ -57,6 +58,8 @@ def handle_default(self, server_data):
 def find_response(self, server_data):
     '''
     Generate a response from any server message and return it or return None.
+    The response may also be a list of messages, which are sent at once
+    without waiting for the responses to the first messages.
     '''
     response = None
     if server_data['type'] == 'question':
@@ -80,7 +83,10 @@ class AnnotationHelperClientProtocol(asyncio.Protocol):
             handle_solution=handle_solution,
             handle_error=handle_error,
             handle_default=handle_default,
-            find_response=find_response
+            find_response=find_response,
+            max_message_size=DEFAULT_MAX_MESSAGE_SIZE,
+            encodings=None,
+            compressions=None
             ):
         self.loop = loop
         self.request = request_creator()
@@ -91,58 +97,117 @@ class AnnotationHelperClientProtocol(asyncio.Protocol):
         self.handle_default = types.MethodType(handle_default, self)
         self.find_response = types.MethodType(find_response, self)
         self.inform('Initiated protocol instance.')
-        self.message_buffer = b''
-
-    def get_message(self):
-        '''
-        Read a complete binary message from a message buffer. The
-        message is stripped of its length indicator and only the 'payload'
-        is returned.
-        '''
-        try:
-            separator_index = self.message_buffer.index(0)
-        except ValueError as e:
-            # No null byte in message. Wait for more data in buffer.
-            # Meanwhile, we cannot return a message.
-            return None
-
-        message_length_part = self.message_buffer[0:separator_index]
-
-        try:
-            message_length = int(message_length_part.decode())
-        except ValueError as e:
-            logging.warning('Invalid message length: %s', message_length_part)
-            return None
-
-        if len(self.message_buffer) > message_length + separator_index:
-            # Entire message is in buffer and ready to be read.
-            inclusive_start = separator_index + 1
-            exclusive_end = separator_index + 1 + message_length
-            binary_message = self.message_buffer[inclusive_start:exclusive_end]
-            self.message_buffer = self.message_buffer[exclusive_end:]
-            return binary_message
-        else:
-            # Message is not ready to be read. We cannot return a message.
-            return None
+        self.message_buffer = MessageBuffer(max_message_size)
+        # A handshake offers the supported encodings and compressions to
+        # the server before the request is sent, so the request is already
+        # encoded with the ones the server chooses.
+        self.handshake = None
+        if encodings or compressions:
+            self.handshake = {'type': 'handshake'}
+            if encodings:
+                self.handshake['encodings'] = [
+                    name for name in encodings if name in ENCODINGS]
+            if compressions:
+                self.handshake['compressions'] = [
+                    name for name in compressions if name in COMPRESSIONS]
+        self.max_message_size = max_message_size
+        self.codec = MessageCodec(max_message_size=max_message_size)
+        self.next_id = 1
+        # Ids of the sent messages whose responses have not arrived yet.
+        self.unanswered_ids = []
 
     def connection_made(self, transport):
         self.transport = transport
         self.peername = self.transport.get_extra_info('peername')
         self.inform('Connected to {}'.format(self.peername))
-        self.transport.write(pack_message(encode_message(self.request)))
+        if self.handshake is not None:
+            self.send_messages(self.handshake)
+            self.inform('Sent handshake {}'.format(self.handshake))
+        else:
+            self.send_request()
+
+    def send_request(self):
+        '''
+        Send the request starting the conversation.
+        '''
+        self.send_messages(self.request)
         self.inform('Sent request {}'.format(self.request))
 
+    def finish_handshake(self, message):
+        '''
+        Switch to the encoding and compression named in the response to the
+        handshake and send the request. If the server answered with an
+        error, e.g. because it does not support handshakes, the messages
+        stay JSON.
+        '''
+        self.unanswered_ids.remove(message['id'])
+        self.handshake = None
+        if message['type'] == 'handshake':
+            self.codec = MessageCodec(message['encoding'],
+                message.get('compression'), self.max_message_size)
+        else:
+            self.inform('Handshake failed: {}'.format(
+                message.get('error_message')))
+        self.send_request()
+
+    def send_messages(self, messages):
+        '''
+        Send a message or a list of messages to the server. Every message is
+        tagged with a new id, so the responses can be assigned to them.
+        '''
+        if isinstance(messages, dict):
+            messages = [messages]
+        for message in messages:
+            message['id'] = self.next_id
+            self.unanswered_ids.append(self.next_id)
+            self.next_id += 1
+            self.transport.write(pack_message(self.codec.encode(message)))
+
+    def is_final_response(self, message):
+        '''
+        Check whether a server message answers the last message sent to the
+        server. Responses to earlier messages of a pipeline are not handed
+        to find_response unless they are errors.
+        '''
+        if message.get('id') in self.unanswered_ids:
+            self.unanswered_ids.remove(message['id'])
+        elif 'id' not in message and self.unanswered_ids:
+            # The server does not support ids, so responses come in order.
+            self.unanswered_ids.pop(0)
+        return not self.unanswered_ids
+
     def data_received(self, data):
-        self.message_buffer += data
-        binary_message = self.get_message()
-        if binary_message is not None:
-            message = decode_message(binary_message)
+        try:
+            binary_messages = self.message_buffer.feed(data)
+        except FramingError as e:
+            self.inform('Cannot read server response: {}'.format(e))
+            self.end_conversation()
+            return
+        for binary_message in binary_messages:
+            try:
+                message = self.codec.decode(binary_message)
+            except ValueError as e:
+                self.inform('Cannot decode server response: {}'.format(e))
+                self.end_conversation()
+                return
             self.inform('Received message {}'.format(message))
-            binary_response = encode_message(self.find_response(message))
-            if binary_response is not None:
-                self.transport.write(pack_message(binary_response))
+            if (self.handshake is not None
+                    and message.get('id') == self.handshake['id']):
+                self.finish_handshake(message)
+            elif message['type'] == 'queued':
+                # The server will send the actual response later.
+                self.inform('Request is waiting for processing'
+                    ' (position {} in queue).'.format(message['position']))
+            elif (not self.is_final_response(message)
+                    and message['type'] != 'error'):
+                self.inform('Skipped response to a pipelined message.')
             else:
-                self.end_conversation()
+                response = self.find_response(message)
+                if response is not None:
+                    self.send_messages(response)
+                else:
+                    self.end_conversation()
+                    return
 
     def connection_lost(self, exc):
         self.inform('The connection was closed.')
@@ -153,6 +218,107 @@ class AnnotationHelperClientProtocol(asyncio.Protocol):
         self.inform('Closed connection to {}'.format(self.peername))
         self.loop.stop()
 
+class DecisionTreeWalker(object):
+    '''
+    Walk the decision tree sent by the server in a question message (see
+    the decision_tree pair in the AaSP specification), so that answers and
+    undos can be handled without contacting the server. The server does
+    not know about the answers given locally; answer_messages returns the
+    messages that bring it to the current state.
+    '''
+
+    def __init__(self, question):
+        '''
+        Start walking at the root of the decision tree in a question
+        message.
+        '''
+        self.question = question
+        self.trees = question['decision_tree']['trees']
+        self.nodes = question['decision_tree']['nodes']
+        self.path = [0]
+        self.answers = []
+
+    def node(self):
+        '''
+        Return the current node of the decision tree.
+        '''
+        return self.nodes[self.path[-1]]
+
+    def tree(self, index):
+        '''
+        Return the tree with the given index as a tree object. The tree
+        object has no overlays, so all overlay lists are empty.
+        '''
+        first_nodes = self.trees[0]['nodes']
+        nodes = [
+            node if node is not None else first_node
+            for node, first_node in zip(self.trees[index]['nodes'], first_nodes)
+            ]
+        return {
+            'tree_format': self.trees[index]['tree_format'],
+            'nodes': nodes,
+            'overlays': {
+                'treated': [[] for node in nodes],
+                'fixed': [[] for node in nodes]
+                }
+            }
+
+    def message(self):
+        '''
+        Return the question or solution message the server would send in
+        the current state or None if the current node lies beyond the
+        compiled region of the decision tree.
+        '''
+        node = self.node()
+        if 'question' in node:
+            message = {
+                'type': 'question',
+                'question': node['question'],
+                'remaining_trees': node['remaining_trees'],
+                'best_tree': self.tree(node['best_tree'])
+                }
+        elif 'solution' in node:
+            message = {
+                'type': 'solution',
+                'remaining_trees': node['remaining_trees'],
+                'tree': self.tree(node['solution'])
+                }
+        else:
+            return None
+        for key in ('batch_index', 'batch_size'):
+            if key in self.question:
+                message[key] = self.question[key]
+        return message
+
+    def answer(self, answer):
+        '''
+        Answer the question of the current node.
+        '''
+        node = self.node()
+        self.answers.append((node['question'], answer))
+        self.path.append(node['yes' if answer else 'no'])
+
+    def undo(self, n=1):
+        '''
+        Revoke the last n answers and return the number of answers that
+        could not be revoked locally, because they were given before the
+        decision tree was received.
+        '''
+        n_local = min(n, len(self.answers))
+        if n_local:
+            del self.answers[-n_local:]
+            del self.path[-n_local:]
+        return n - n_local
+
+    def answer_messages(self):
+        '''
+        Return the answer messages for the answers given locally.
+        '''
+        return [
+            {'type': 'answer', 'question': question, 'answer': answer}
+            for question, answer in self.answers
+            ]
+
 def format_tree(tree):
     '''
     Format a tree object as described in the AaSP specification.
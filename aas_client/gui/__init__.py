@@ -15,14 +15,16 @@ import sys
 import os
 import argparse
 import socket
+from collections import deque
 from random import shuffle
 import json
 
 from aas_client.common import (
-    encode_message,
-    decode_message,
+    DecisionTreeWalker,
     pack_message
     )
+from aas_server.framing import MessageBuffer
+from aas_server.message_codec import COMPRESSIONS, ENCODINGS, MessageCodec
 from aas_client.generate_dot_tree import generate_dot_tree
 from helper import generate_sentence, get_subcatframe, save_result
 
@@ -38,6 +40,15 @@ UPLOAD_FOLDER = 'loadedFiles'
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 # define socket to send data
 socket_to_server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+# received bytes and messages that have not been handled yet
+message_buffer = MessageBuffer()
+received_messages = deque()
+# decision tree of the current sentence (too large for the session cookie)
+decision_walker = None
+# codec of the messages; a handshake before the first message offers the
+# configured encodings
+codec = MessageCodec()
+first_message = True
 
 
 # taken from server.py
@@ -252,8 +263,9 @@ def annotate():
 
 
 
-    socket_to_server.send(pack_message(encode_message(requests)))
-    received_message = decode_message(receive_message(socket_to_server))
+    received_message, messages = walk_decision_tree(requests)
+    if received_message is None:
+        received_message = send_messages(messages)
     sentence_visual = visualise(received_message)
 
     if sentence_visual == 'Parser was not found.':
@@ -416,55 +428,111 @@ def allowed_file(filename):
             filename.split('.')[-1].lower() in  ALLOWED_EXTENSIONS
 
 
-def inspect_message_buffer(message_buffer):
+def receive_message(socket, buffersize=65536):
     """
-    Check if a message buffer contains a complete prefix indicating
-    the length of the message. If so, return the index of the null byte
-    separating the length indication from the payload and return the
-    indicated length of the message.
+    Read data from the given socket until a full message is received.
+    Return the message as a bytestring.
+    If more than one message has been received, the others are kept in the
+    global received_messages.
     """
-    try:
-        separator_index = message_buffer.index(0)
-    except ValueError as e:
-        # No null byte in message. Wait for more data in buffer.
-        return None, None
+    while not received_messages:
+        data = socket.recv(buffersize)
+        if not data:
+            raise ConnectionError('The server closed the connection.')
+        received_messages.extend(message_buffer.feed(data))
+    return received_messages.popleft()
 
-    message_length_part = message_buffer[0:separator_index]
+def walk_decision_tree(requests):
+    """ Handle a request locally using the decision tree, if possible.
 
-    try:
-        message_length = int(message_length_part.decode())
-    except ValueError as e:
-        # Message length cannot be converted to int.
-        raise ValueError('Message buffer does not start with a message length.')
+    Arguments:
+        requests: the message that would be sent to the server
+    Returns a pair of the message the server would respond with (or None if
+    the server has to be contacted) and the list of messages to send to the
+    server otherwise.
+    """
+    global decision_walker
+    walker = decision_walker
+    if walker is None:
+        return None, [requests]
+    if requests['type'] == 'answer' and 'question' in walker.node():
+        walker.answer(requests['answer'])
+        message = walker.message()
+        if message is not None:
+            return message, []
+        messages = walker.answer_messages()
+    elif requests['type'] == 'undo':
+        remaining = walker.undo(requests['answers'])
+        if not remaining:
+            return walker.message(), []
+        messages = [dict(requests, answers=remaining)]
+    elif requests['type'] in ('answer', 'abort'):
+        messages = walker.answer_messages() + [requests]
+    else:
+        messages = [requests]
+    decision_walker = None
+    return None, messages
 
-    return separator_index, message_length
+def send_messages(messages):
+    """ Send messages to the server at once and return the response to the last one.
 
-def receive_message(socket, buffersize=1024):
+    If decision trees are enabled in the config, the last message asks for a
+    new decision tree. Responses to the other messages are skipped; if one of
+    them is an error, the first error is returned instead.
     """
-    Read data from the given socket until a full message is received.
-    Return the message as a bytestring.
-    If there is more than one message in the message buffer the global
-    message_buffer will hold the rest.
+    global decision_walker, first_message
+    if config.get('decision_tree'):
+        messages[-1]['decision_tree'] = {}
+    if first_message:
+        first_message = False
+        send_handshake()
+    socket_to_server.send(b''.join(
+        pack_message(codec.encode(message)) for message in messages))
+    # Every response has to be read, even after an error, so that the next
+    # request does not receive a stale response.
+    error = None
+    for _ in messages:
+        received_message = receive_response(socket_to_server)
+        if received_message['type'] == 'error' and error is None:
+            error = received_message
+    if error is not None:
+        return error
+    if 'decision_tree' in received_message:
+        decision_walker = DecisionTreeWalker(received_message)
+        if decision_walker.message() is None:
+            decision_walker = None
+    return received_message
+
+def send_handshake():
     """
-    global message_buffer
-    if 'message_buffer' not in globals():
-        message_buffer = b''
-
-    binary_message = b''
-    while not binary_message:
-        # Loop until a full message is in the message buffer.
-        separator_index, message_length = inspect_message_buffer(message_buffer)
-        if (separator_index is not None
-            and len(message_buffer) > message_length + separator_index):
-            # Entire message is in buffer and ready to be read.
-            inclusive_start = separator_index + 1
-            exclusive_end = separator_index + 1 + message_length
-            binary_message = message_buffer[inclusive_start:exclusive_end]
-            message_buffer = message_buffer[exclusive_end:]
-        else:
-            message_buffer += socket.recv(buffersize)
-
-    return binary_message
+    Offer the configured encodings and compressions to the server and use
+    the ones it chooses for all following messages. Nothing is sent if the
+    config does not offer any.
+    """
+    global codec
+    handshake = {'type': 'handshake'}
+    if config.get('encodings'):
+        handshake['encodings'] = [
+            name for name in config['encodings'] if name in ENCODINGS]
+    if config.get('compressions'):
+        handshake['compressions'] = [
+            name for name in config['compressions'] if name in COMPRESSIONS]
+    if len(handshake) == 1:
+        return
+    socket_to_server.send(pack_message(codec.encode(handshake)))
+    response = receive_response(socket_to_server)
+    if response['type'] == 'handshake':
+        codec = MessageCodec(response['encoding'], response.get('compression'))
+
+def receive_response(socket):
+    """
+    Receive messages from the given socket until a message that is not of
+    type queued arrives. Return that message as a json object.
+    """
+    message = codec.decode(receive_message(socket))
+    while message['type'] == 'queued':
+        message = codec.decode(receive_message(socket))
+    return message
 
 #----------------------get and handle answer for subcatframe checking-----------------------------
 @app.route('/get_answer_subcat', methods = ['GET', 'POST'])
@@ -675,6 +743,9 @@ if __name__ == '__main__':
         'conll09': 'conll09_predicted'
     },
 
+        'decision_tree': False,
+        'encodings': [],
+        'compressions': [],
         'configfile' : 'config.json'
     }
     config_from_file = read_configfile(
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+
+"""
+This module manages daemon processors. Unlike ordinary processors, which
+are started anew for every request, a daemon processor is started once
+together with the server and kept running, so that models only have to be
+loaded once.
+
+A daemon reads requests from its stdin and writes responses to its stdout.
+Both are framed like AaSP messages: the length of the payload, a null byte
+and the payload. The payload of a request is the input of the processor
+and the payload of the response is its output. A daemon has to answer a
+request with an empty payload by an empty response; the server uses such
+requests to check that the daemon is healthy.
+"""
+
+import asyncio
+import logging
+import os
+import signal
+
+from framing import pack_message
+
+
+class ProcessorDaemon(object):
+    """
+    A processor that is kept running and is sent one request at a time.
+    A daemon that has died is restarted on the next request.
+    """
+
+    def __init__(self, processor, timeout=None):
+        """
+        Initialize the daemon for a processor dict from the config. The
+        daemon is not started until start is called or a request is sent.
+        Responses taking longer than timeout seconds are considered a
+        failure of the daemon.
+        """
+        self.processor = processor
+        self.name = processor['name']
+        self.timeout = timeout
+        self.subprocess = None
+        self.killed = False
+        self.lock = asyncio.Lock()
+        self.restarts = 0
+
+    def running(self):
+        """
+        Return True if the daemon process is running.
+        """
+        return (self.subprocess is not None
+            and self.subprocess.returncode is None
+            and not self.killed)
+
+    async def start(self):
+        """
+        Start the daemon process unless it is running already.
+        """
+        if self.running():
+            return
+        if self.subprocess is not None:
+            await self.reap()
+            self.restarts += 1
+            logging.warning(
+                'Restarting daemon %s (exit code %s).',
+                self.name, self.subprocess.returncode)
+        self.killed = False
+        self.subprocess = await asyncio.create_subprocess_exec(
+            *self.processor['command'],
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            start_new_session=True
+            )
+        logging.info('Started daemon %s (pid %d).', self.name, self.subprocess.pid)
+
+    def kill(self):
+        """
+        Kill the daemon process and all processes it started.
+        """
+        if self.running():
+            try:
+                os.killpg(self.subprocess.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            self.killed = True
+
+    async def reap(self):
+        """
+        Close the stdin of the daemon process and wait until it has exited.
+        """
+        self.subprocess.stdin.close()
+        await self.subprocess.wait()
+
+    async def stop(self):
+        """
+        Stop the daemon by closing its stdin and kill it if it does not
+        terminate within a few seconds.
+        """
+        if self.subprocess is None:
+            return
+        if not self.running():
+            # Reap a daemon that has died or was killed.
+            await self.reap()
+            return
+        self.subprocess.stdin.close()
+        try:
+            await asyncio.wait_for(self.subprocess.wait(), 5)
+        except asyncio.TimeoutError:
+            self.kill()
+            await self.subprocess.wait()
+        logging.info('Stopped daemon %s.', self.name)
+
+    async def request(self, payload):
+        """
+        Send payload (a bytestring) to the daemon and return its response.
+        Raises a ValueError if the daemon fails to respond. The daemon is
+        killed in this case, because its stdout may contain a partial
+        response, and restarted on the next request.
+        """
+        async with self.lock:
+            try:
+                await self.start()
+            except OSError as e:
+                msg = 'Cannot start daemon {}. ({})'
+                raise ValueError(msg.format(self.name, e)) from e
+            try:
+                return await asyncio.wait_for(
+                    self.exchange(payload), self.timeout)
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                    asyncio.TimeoutError, ConnectionError, ValueError) as e:
+                self.kill()
+                msg = 'Daemon {} failed to respond. ({!r})'
+                raise ValueError(msg.format(self.name, e)) from e
+            except asyncio.CancelledError:
+                self.kill()
+                raise
+
+    async def exchange(self, payload):
+        """
+        Write a framed request to the daemon and read the framed response.
+        """
+        self.subprocess.stdin.write(pack_message(payload))
+        await self.subprocess.stdin.drain()
+        length = await self.subprocess.stdout.readuntil(b'\0')
+        return await self.subprocess.stdout.readexactly(int(length[:-1]))
+
+    async def check_health(self):
+        """
+        Send an empty request to the daemon and return True if it responds.
+        """
+        try:
+            await self.request(b'')
+        except ValueError as e:
+            logging.warning('Health check of daemon %s failed: %s', self.name, e)
+            return False
+        return True
+
+
+class DaemonManager(object):
+    """
+    Holds the daemons of all daemon processors in the config and checks
+    their health periodically.
+    """
+
+    def __init__(self, processors, interval=60, timeout=None):
+        """
+        Create a daemon for every processor with a true 'daemon' value.
+        The health of the daemons is checked every interval seconds.
+        """
+        self.daemons = {
+            processor['name']: ProcessorDaemon(processor, timeout)
+            for processor in processors
+            if processor.get('daemon')
+            }
+        self.interval = interval
+        self.health_task = None
+
+    def __len__(self):
+        return len(self.daemons)
+
+    def __getitem__(self, name):
+        return self.daemons[name]
+
+    async def start(self):
+        """
+        Start all daemons and the periodic health check.
+        """
+        for daemon in self.daemons.values():
+            try:
+                await daemon.start()
+            except OSError as e:
+                logging.error('Cannot start daemon %s: %s', daemon.name, e)
+        if self.daemons and self.interval:
+            self.health_task = asyncio.ensure_future(self.check_periodically())
+
+    async def check_periodically(self):
+        """
+        Check the health of all daemons every interval seconds. Unhealthy
+        daemons are killed and restarted. A daemon that cannot be restarted
+        is tried again at the next check.
+        """
+        while True:
+            await asyncio.sleep(self.interval)
+            for daemon in self.daemons.values():
+                if await daemon.check_health():
+                    continue
+                try:
+                    await daemon.start()
+                except OSError as e:
+                    logging.error(
+                        'Cannot restart daemon %s: %s', daemon.name, e)
+
+    async def stop(self):
+        """
+        Stop the health check and all daemons.
+        """
+        if self.health_task is not None:
+            self.health_task.cancel()
+        for daemon in self.daemons.values():
+            await daemon.stop()
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+"""
+This module provides a cache of parsed forests, so that a forest that is
+requested again (e.g. after an annotator restarted the annotation or by
+several annotators annotating the same sentence) is not parsed again.
+"""
+
+from collections import OrderedDict
+import hashlib
+import logging
+
+
+def cache_key(forest_string, format_name):
+    """
+    Return the key under which a forest created from forest_string in the
+    format format_name is cached.
+    """
+    digest = hashlib.sha1(forest_string.encode()).hexdigest()
+    return (digest, format_name)
+
+
+class ForestCache(object):
+    """
+    A least recently used cache of pristine forests. The cache only hands
+    out copies of its forests (see tree.Forest.copy), so every connection
+    can filter and undo without affecting the cached forest.
+
+    The size of a forest is measured by the length of the string it was
+    created from. If the total size exceeds max_size, the least recently
+    used forests are evicted.
+    """
+
+    def __init__(self, max_size):
+        """
+        Initialize an empty cache holding forests up to a total size of
+        max_size.
+        """
+        self.max_size = max_size
+        self.size = 0
+        self.forests = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.forests)
+
+    def get(self, key):
+        """
+        Return a copy of the forest cached under key or None if there is no
+        such forest.
+        """
+        try:
+            forest, size = self.forests[key]
+        except KeyError:
+            self.misses += 1
+            self.log('miss')
+            return None
+        self.forests.move_to_end(key)
+        self.hits += 1
+        self.log('hit')
+        return forest.copy()
+
+    def put(self, key, forest, size):
+        """
+        Cache a copy of forest under key and evict forests until the total
+        size does not exceed the maximal size any more.
+        """
+        if size > self.max_size:
+            return
+        if key in self.forests:
+            self.size -= self.forests.pop(key)[1]
+        self.forests[key] = (forest.copy(), size)
+        self.size += size
+        while self.size > self.max_size:
+            _, (_, evicted_size) = self.forests.popitem(last=False)
+            self.size -= evicted_size
+
+    def log(self, event):
+        """
+        Log a cache event together with the cache statistics.
+        """
+        logging.info(
+            'Forest cache %s (%d hits, %d misses, %d forests, %d bytes).',
+            event, self.hits, self.misses, len(self.forests), self.size)
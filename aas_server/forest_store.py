@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+This module provides a compact binary store for pre-parsed forests. An
+indexer converts a directory of CoNLL n-best files into a single store file
+and the server memory-maps that file, so that opening a forest referenced
+by its sentence id requires neither uploading nor parsing the CoNLL text.
+
+All strings of the corpus are interned into one string table. For every
+sentence, the store contains the token table (all columns of the first
+tree) and the head and relation columns of all trees as arrays of string
+ids. An index maps the sentence ids to the offsets of their records.
+
+Layout (integers in the byte order of the machine that built the store):
+
+    header:   magic, version, byte order, format name id, number of
+              strings, number of sentences and the offsets of the string
+              offsets, the string data and the index
+    records:  number of tokens, number of columns, number of trees,
+              head column, relation column, token table, heads, relations,
+              padding to eight bytes and the scores of the trees (64 bit
+              floats, NaN if unknown)
+    strings:  offsets (n + 1) and utf-8 encoded data
+    index:    (sentence id, record offset) pairs
+"""
+
+import argparse
+from array import array
+import json
+import logging
+import math
+import mmap
+import os
+import struct
+import sys
+import tempfile
+
+from tree import Forest, ForestReader, SharedTokenTree, TokenTable, Tree
+
+MAGIC = b'AASF'
+VERSION = 3
+BYTE_ORDERS = {'little': 0, 'big': 1}
+HEADER = struct.Struct('<4sIIIIIQQQ')
+RECORD = struct.Struct('IIIII')
+INDEX_ENTRY = struct.Struct('IQ')
+
+
+def _pad(length):
+    """
+    Return the number of bytes needed to align length to four bytes.
+    """
+    return -length % 4
+
+
+class StoreBuilder(object):
+    """
+    Collects forests and writes them to a store file.
+    """
+
+    def __init__(self, format_info):
+        """
+        Initialize the builder for forests in the given format.
+        """
+        self.format_info = format_info
+        self.strings = dict()
+        self.records = []
+        self.index = []
+        self.size = 0
+        self.string_id(format_info['name'])
+
+    def string_id(self, string):
+        """
+        Return the id of string in the string table, adding it if needed.
+        """
+        return self.strings.setdefault(string, len(self.strings))
+
+    def add(self, sentence_id, lines):
+        """
+        Add the forest contained in an iterable of conll lines under the
+        given sentence id. Raises a ValueError if the rows of the forest
+        differ in their number of columns or its trees differ in columns
+        other than head and relation.
+        """
+        head = self.format_info['head']
+        rel = self.format_info['relation']
+        reader = ForestReader(share_tokens=True, format_info=self.format_info)
+        trees = []
+        for line in lines:
+            tree = reader.feed(line)
+            if tree is not None:
+                trees.append(tree)
+        tree = reader.close()
+        if tree is not None:
+            trees.append(tree)
+        if not trees:
+            raise ValueError('Forest {} contains no trees.'.format(sentence_id))
+        rows = trees[0].nodes
+        columns = len(rows[0])
+        if any(len(row) != columns for row in rows):
+            msg = 'Rows of forest {} have different numbers of columns.'
+            raise ValueError(msg.format(sentence_id))
+        if not all(isinstance(tree, SharedTokenTree) for tree in trees[1:]):
+            msg = 'Trees of forest {} differ in other columns than head and relation.'
+            raise ValueError(msg.format(sentence_id))
+
+        data = array('I', RECORD.pack(len(rows), columns, len(trees), head, rel))
+        data.extend(self.string_id(field) for row in rows for field in row)
+        data.extend(self.string_id(row[head]) for row in rows)
+        for tree in trees[1:]:
+            data.extend(self.string_id(value) for value in tree.heads)
+        data.extend(self.string_id(row[rel]) for row in rows)
+        for tree in trees[1:]:
+            data.extend(self.string_id(value) for value in tree.rels)
+        if len(data) % 2:
+            # Align the scores to eight bytes.
+            data.append(0)
+        scores = array('d', (
+            math.nan if tree.score is None else tree.score for tree in trees
+            ))
+        data.frombytes(scores.tobytes())
+
+        self.index.append((self.string_id(sentence_id), self.size))
+        self.records.append(data)
+        self.size += len(data) * data.itemsize
+
+    def write(self, filename):
+        """
+        Write the store to filename. The file is replaced atomically.
+        """
+        strings = [string.encode() for string in self.strings]
+        offsets = array('I', [0])
+        for string in strings:
+            offsets.append(offsets[-1] + len(string))
+        string_data = b''.join(strings)
+
+        records_offset = HEADER.size
+        offsets_offset = records_offset + self.size
+        data_offset = offsets_offset + len(offsets) * offsets.itemsize
+        index_offset = data_offset + len(string_data) + _pad(len(string_data))
+
+        directory = os.path.dirname(os.path.abspath(filename))
+        fd, tmp_name = tempfile.mkstemp(dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as store_file:
+                store_file.write(HEADER.pack(
+                    MAGIC, VERSION, BYTE_ORDERS[sys.byteorder],
+                    self.strings[self.format_info['name']],
+                    len(strings), len(self.index),
+                    offsets_offset, data_offset, index_offset))
+                for record in self.records:
+                    record.tofile(store_file)
+                offsets.tofile(store_file)
+                store_file.write(string_data)
+                store_file.write(b'\0' * _pad(len(string_data)))
+                for sentence, offset in self.index:
+                    store_file.write(
+                        INDEX_ENTRY.pack(sentence, records_offset + offset))
+            os.chmod(tmp_name, 0o644)
+            os.replace(tmp_name, filename)
+        except BaseException:
+            os.unlink(tmp_name)
+            raise
+
+
+class ForestStore(object):
+    """
+    A memory-mapped forest store. Forests are created from the store by
+    their sentence id.
+    """
+
+    def __init__(self, filename):
+        """
+        Open and memory-map the store file and read its index.
+        """
+        self.filename = filename
+        with open(filename, 'rb') as store_file:
+            self.mmap = mmap.mmap(store_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.mmap)
+        (magic, version, byte_order, format_id, n_strings, n_sentences,
+            offsets_offset, data_offset, index_offset) = HEADER.unpack_from(self.view)
+        if magic != MAGIC:
+            raise ValueError('{} is not a forest store.'.format(filename))
+        if version != VERSION:
+            msg = 'Forest store {} has version {} instead of {}. Rebuild it.'
+            raise ValueError(msg.format(filename, version, VERSION))
+        if byte_order != BYTE_ORDERS[sys.byteorder]:
+            msg = 'Forest store {} was built with a different byte order.'
+            raise ValueError(msg.format(filename))
+
+        self.string_offsets = self.view[
+            offsets_offset:offsets_offset + 4 * (n_strings + 1)].cast('I')
+        self.data_offset = data_offset
+        self.strings = dict()
+        self.format_name = self.string(format_id)
+        self.index = {
+            self.string(sentence): offset
+            for sentence, offset
+            in INDEX_ENTRY.iter_unpack(
+                self.view[index_offset:index_offset + INDEX_ENTRY.size * n_sentences])
+            }
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, sentence_id):
+        return sentence_id in self.index
+
+    def string(self, string_id):
+        """
+        Return the string with the given id from the string table.
+        """
+        try:
+            return self.strings[string_id]
+        except KeyError:
+            start = self.data_offset + self.string_offsets[string_id]
+            end = self.data_offset + self.string_offsets[string_id + 1]
+            string = str(self.view[start:end], 'utf-8')
+            self.strings[string_id] = string
+            return string
+
+    def load(self, sentence_id, format_info, forest_class=Forest,
+            **prune_options):
+        """
+        Create a forest of the given class from the record of sentence_id.
+        Raises a KeyError if the store does not contain the sentence. For
+        the prune_options deduplicate and max_trees see tree.prune_trees.
+        """
+        offset = self.index[sentence_id]
+        n_tokens, columns, n_trees, head, rel = RECORD.unpack_from(self.view, offset)
+        if head != format_info['head'] or rel != format_info['relation']:
+            msg = 'Forest store {} does not contain forests in format {}.'
+            raise ValueError(msg.format(self.filename, format_info['name']))
+        start = offset + RECORD.size
+        table_size = n_tokens * columns
+        column_size = n_tokens * n_trees
+        ids_end = start + 4 * (table_size + 2 * column_size)
+        ids = self.view[start:ids_end].cast('I')
+        scores_start = ids_end + (ids_end - offset) % 8
+        scores = self.view[scores_start:scores_start + 8 * n_trees].cast('d')
+        string = self.string
+
+        lines = [
+            '\t'.join(string(i) for i in ids[k * columns:(k + 1) * columns])
+            for k in range(n_tokens)
+            ]
+        table = TokenTable(Tree.from_lines(lines, format_info=format_info))
+        heads = ids[table_size:table_size + column_size]
+        rels = ids[table_size + column_size:]
+        # The first tree is a SharedTokenTree as well, so the forest can
+        # tell that all its trees share the same table.
+        trees = (
+            SharedTokenTree(
+                table,
+                tuple(string(i) for i in heads[t * n_tokens:(t + 1) * n_tokens]),
+                tuple(string(i) for i in rels[t * n_tokens:(t + 1) * n_tokens])
+                )
+            for t in range(n_trees)
+            )
+        return forest_class.from_trees(_set_scores(trees, scores), **prune_options)
+
+    def close(self):
+        """
+        Release the memory map.
+        """
+        self.string_offsets.release()
+        self.view.release()
+        self.mmap.close()
+
+
+def _set_scores(trees, scores):
+    """
+    Generate the trees of an iterable of trees after setting their scores
+    to the stored scores.
+    """
+    for tree, score in zip(trees, scores):
+        if not math.isnan(score):
+            tree.score = score
+        yield tree
+
+
+def build_store(forest_dir, filename, format_info):
+    """
+    Convert every file in forest_dir into a record of a new store written
+    to filename. The sentence id of a forest is the name of its file. Files
+    that cannot be converted are skipped and logged.
+
+    Returns the number of forests in the store.
+    """
+    builder = StoreBuilder(format_info)
+    for name in sorted(os.listdir(forest_dir)):
+        path = os.path.join(forest_dir, name)
+        if not os.path.isfile(path) or name.startswith('.'):
+            continue
+        try:
+            with open(path, 'rb') as lines:
+                builder.add(name, lines)
+        except (ValueError, IndexError, KeyError, UnicodeDecodeError) as e:
+            logging.warning('Skipping forest %s: %s', path, e)
+    builder.write(filename)
+    return len(builder.index)
+
+
+def main():
+    desc = 'Build a forest store from a directory of CoNLL forest files.'
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument(
+        'forest_dir',
+        type=str,
+        help='Directory containing one forest file per sentence.')
+    parser.add_argument(
+        'store',
+        type=str,
+        help='Name of the store file to write.')
+    parser.add_argument(
+        '-f',
+        '--format',
+        required=True,
+        type=str,
+        help='Format of the forests as named in the config file.')
+    parser.add_argument(
+        '-c',
+        '--configfile',
+        required=False,
+        type=str,
+        default=os.path.join(os.environ['HOME'], '.aas-server.json'),
+        help='Name of the config file.')
+    args = parser.parse_args()
+
+    config = json.load(open(args.configfile))
+    aliases = config.get('format_aliases', {})
+    format_name = aliases.get(args.format, args.format)
+    try:
+        format_info = config['formats'][format_name]
+    except KeyError:
+        sys.exit('Format {} not found in {}.'.format(args.format, args.configfile))
+
+    logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.INFO)
+    count = build_store(args.forest_dir, args.store, format_info)
+    logging.info('Wrote %d forests to %s.', count, args.store)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+"""
+This module implements the framing of AaSP messages, which is shared by the
+server and the clients: every message is prefixed by its length in bytes,
+written as decimal digits, and a null byte.
+
+A MessageBuffer collects the bytes received on a connection and returns all
+messages completed by them. The received bytes are appended to a single
+bytearray, the length prefix of a message is parsed only once and consumed
+bytes are only discarded once they make up most of the buffer, so receiving
+a large message in many small chunks takes time linear in its size.
+"""
+
+# Default maximal size of a message in bytes.
+DEFAULT_MAX_MESSAGE_SIZE = 64 * 1024 * 1024
+
+# Maximal number of digits of a length prefix.
+MAX_PREFIX_LENGTH = 20
+
+
+class FramingError(ValueError):
+    """
+    Raised if the received bytes cannot be split into messages, e.g.
+    because a length prefix is invalid or a message is too large. The
+    connection cannot be used any more after this error.
+    """
+
+
+def pack_message(bytestring):
+    """
+    Prefix a bytestring by its length and a null byte. This prefix is
+    used after sending to extract the message at the receiving side.
+    """
+    return str(len(bytestring)).encode() + b'\0' + bytestring
+
+
+class MessageBuffer(object):
+    """
+    Splits the bytes received on a connection into messages.
+    """
+
+    def __init__(self, max_message_size=DEFAULT_MAX_MESSAGE_SIZE):
+        """
+        Initialize an empty buffer accepting messages of up to
+        max_message_size bytes (None for no limit).
+        """
+        self.max_message_size = max_message_size
+        self.buffer = bytearray()
+        # Offset of the first byte that has not been consumed yet.
+        self.start = 0
+        # Length of the message whose prefix has been consumed or None.
+        self.expected = None
+
+    def __len__(self):
+        """
+        Return the number of received bytes that do not belong to a
+        returned message yet.
+        """
+        return len(self.buffer) - self.start
+
+    def feed(self, data):
+        """
+        Append received data (a bytes-like object) to the buffer and return
+        a list of all messages completed by it, without their prefixes.
+        Raises a FramingError if the data is not a valid sequence of
+        messages.
+        """
+        self.buffer += data
+        messages = []
+        while True:
+            if self.expected is None:
+                self.expected = self._read_prefix()
+                if self.expected is None:
+                    break
+            end = self.start + self.expected
+            if len(self.buffer) < end:
+                break
+            with memoryview(self.buffer) as view:
+                messages.append(bytes(view[self.start:end]))
+            self.start = end
+            self.expected = None
+        self._compact()
+        return messages
+
+    def _read_prefix(self):
+        """
+        Consume the length prefix at the start of the buffer and return the
+        length it specifies. If the prefix has not been received completely
+        yet, None is returned.
+        """
+        separator = self.buffer.find(0, self.start)
+        if separator < 0:
+            if len(self.buffer) - self.start > MAX_PREFIX_LENGTH:
+                raise FramingError('Message does not start with a length.')
+            return None
+        prefix = bytes(self.buffer[self.start:separator])
+        if not prefix.isdigit() or len(prefix) > MAX_PREFIX_LENGTH:
+            raise FramingError('Invalid message length: {!r}'.format(prefix[:50]))
+        length = int(prefix)
+        if self.max_message_size is not None and length > self.max_message_size:
+            msg = 'Message of {} bytes exceeds the maximal size of {} bytes.'
+            raise FramingError(msg.format(length, self.max_message_size))
+        self.start = separator + 1
+        return length
+
+    def _compact(self):
+        """
+        Discard the consumed bytes if they make up at least half of the
+        buffer, so every byte is moved at most once on average.
+        """
+        if self.start and 2 * self.start >= len(self.buffer):
+            del self.buffer[:self.start]
+            self.start = 0
@@ -6,12 +6,26 @@ and the forest the server uses. It primarily provides functions for
 creating and interpreting AaSP messages.
 """
 
+import asyncio
 import logging
 from enum import Enum
-from subprocess import call
+import io
+import os
+import signal
 import tempfile
 
-from tree import Forest
+from forest_cache import cache_key
+from nbest_convert import forest_from_nbest, split_sentences
+from routing import RoutingTable
+from tree import (Forest, BitsetForest, ArrayForest, QUESTION_STRATEGIES,
+    split_forests)
+
+
+FOREST_BACKENDS = {
+    'plain': Forest,
+    'bitset': BitsetForest,
+    'numpy': ArrayForest
+    }
 
 
 def get_format_from_config(config, format_name):
@@ -65,6 +79,47 @@ def get_format_from_config(config, format_name):
         raise ValueError('Format {} not supported.'.format(format_name))
 
 
+def get_forest_class(config):
+    """
+    Return the Forest class selected by the 'forest_backend' key of the
+    config. If the key is missing, the plain Forest class is used.
+
+    @:param config: The configuration dict.
+
+    @:return: A subclass of tree.Forest.
+    """
+    backend = config.get('forest_backend', 'plain')
+    try:
+        return FOREST_BACKENDS[backend]
+    except KeyError as e:
+        msg = 'Forest backend {} not supported.'.format(backend)
+        raise ValueError(msg) from e
+
+
+def set_question_strategy(forest, config):
+    """
+    Set the strategy for choosing questions given by the
+    'question_strategy' key of the config (default: 'halve') on a forest,
+    together with the number of questions to look ahead ('lookahead_depth',
+    default: 0, i.e. choose questions greedily) and the time the lookahead
+    may take per question ('lookahead_budget', in milliseconds, default:
+    20).
+
+    @:param forest: A Forest object.
+    @:param config: The configuration dict.
+
+    @:return: The forest.
+    """
+    strategy = config.get('question_strategy', 'halve')
+    if strategy not in QUESTION_STRATEGIES:
+        msg = 'Question strategy {} not supported.'.format(strategy)
+        raise ValueError(msg)
+    forest.strategy = strategy
+    forest.lookahead_depth = config.get('lookahead_depth', 0)
+    forest.lookahead_budget = config.get('lookahead_budget', 20) / 1000
+    return forest
+
+
 class Recommendation(Enum):
 
     """
@@ -91,6 +146,40 @@ class SolutionType(Enum):
     best = 3
 
 
+def create_queued(position):
+    """
+    Format a message of type queued telling the client that its request
+    waits for processing.
+
+    @:param position: The (1-based) position of the request in the queue.
+
+    @:return: queued message
+    """
+    queued = {
+        'type': 'queued',
+        'position': position
+        }
+    return queued
+
+
+def create_handshake(encoding, compression):
+    """
+    Format a message of type handshake telling the client which encoding
+    and compression the following messages use.
+
+    @:param encoding: The name of the chosen encoding.
+    @:param compression: The name of the chosen compression or None.
+
+    @:return: handshake message
+    """
+    handshake = {
+        'type': 'handshake',
+        'encoding': encoding,
+        'compression': compression
+        }
+    return handshake
+
+
 def create_error(error_message, recommendation=Recommendation.abort):
     """
     Format a message of type error.
@@ -112,8 +201,8 @@ def create_error(error_message, recommendation=Recommendation.abort):
 def find_tree(forest):
 
     """
-    Find the best tree in the given forest and format it as a tree
-    object (assuming the best tree is the first tree).
+    Find the best tree in the given forest (see tree.Forest.get_best_tree)
+    and format it as a tree object.
 
 
     @:param forest: A Forest object that may or may not be solved.
@@ -121,9 +210,10 @@ def find_tree(forest):
     @:return: tree object
     @:rtype: json
     """
+    best_tree = forest.get_best_tree()
     return {
-        'tree_format': forest.trees[0].format,
-        'nodes': forest.trees[0].nodes,
+        'tree_format': best_tree.format,
+        'nodes': best_tree.nodes,
         'overlays': {
             'treated': forest.get_treated_fields(),
             'fixed': forest.get_fixed_fields()
@@ -144,6 +234,8 @@ def create_question(forest):
         'question': forest.question(),
         'best_tree': find_tree(forest)
         }
+    if forest.expected_questions is not None:
+        question['expected_questions'] = round(forest.expected_questions, 2)
     return question
 
 
@@ -177,13 +269,151 @@ def create_question_or_solution(forest):
         return create_question(forest)
 
 
-def create_forest(request, config):
+def create_decision_tree(forest, max_depth=8, max_nodes=255):
+    """
+    Compile the questions the server would ask about a forest into a
+    decision tree, so that a client can walk it without contacting the
+    server. The questions are found by filtering a copy of the forest by
+    both answers recursively, up to max_depth answers deep and until the
+    tree has max_nodes nodes.
+
+    The decision tree is an object with two pairs: 'trees', a list of tree
+    objects without overlays in which every node that equals the node of
+    the first tree is replaced by null, and 'nodes', a list of nodes whose first
+    element is the root. Every node contains 'remaining_trees' and either
+    'question', 'best_tree' (an index into 'trees'), 'yes' and 'no' (the
+    indices of the nodes following the answers), or 'solution' (an index
+    into 'trees') if one tree remains, or only 'best_tree' if the node
+    lies beyond the compiled region.
+
+    @:param forest: A Forest object. The forest itself is not changed.
+    @:param max_depth: Maximal number of answers from the root to a node.
+    @:param max_nodes: Maximal number of nodes.
+
+    @:return: decision tree object
+    """
+    forest = forest.copy()
+    nodes = []
+    trees = []
+    tree_indices = {}
+
+    def tree_index(tree):
+        key = tuple(tuple(node) for node in tree.nodes)
+        if key not in tree_indices:
+            tree_indices[key] = len(trees)
+            tree_nodes = tree.nodes
+            if trees:
+                tree_nodes = [
+                    None if node == first_node else node
+                    for node, first_node in zip(tree_nodes, trees[0]['nodes'])
+                    ]
+            trees.append({'tree_format': tree.format, 'nodes': tree_nodes})
+        return tree_indices[key]
+
+    def compile_node(depth, budget):
+        index = len(nodes)
+        node = {'remaining_trees': len(forest.trees)}
+        nodes.append(node)
+        if node['remaining_trees'] == 0:
+            return index
+        if forest.solved():
+            node['solution'] = tree_index(forest.get_best_tree())
+            return index
+        node['best_tree'] = tree_index(forest.get_best_tree())
+        if depth >= max_depth or budget < 3:
+            return index
+        question = forest.question()
+        node['question'] = question
+        # The yes branch may use half of the budget, the no branch the rest.
+        budget -= 1
+        for key, answer in (('yes', True), ('no', False)):
+            before = len(nodes)
+            forest.filter(question, answer)
+            node[key] = compile_node(depth + 1, budget // 2 if answer else budget)
+            forest.undo(1)
+            budget -= len(nodes) - before
+        return index
+
+    compile_node(0, max_nodes)
+    return {'trees': trees, 'nodes': nodes}
+
+
+def get_prune_options(config):
+    """
+    Return the options for pruning forests at load time given in the config
+    (see tree.prune_trees).
+    """
+    return {
+        'deduplicate': config.get('deduplicate_trees', False),
+        'max_trees': config.get('max_trees', 0)
+        }
+
+
+def forest_from_string(forest_string, format_info, config):
+    """
+    Create a Forest object from a conll string using the forest backend and
+    loader options given in the config. Forests in a format with the reader
+    'anna_nbest' are read as n-best parser output (see nbest_convert).
+
+    @:param forest_string: The conll string containing the forest.
+    @:param format_info: The format dict of the forest.
+    @:param config: The configuration dict.
+
+    @:return: a forest object
+    """
+    forest_class = get_forest_class(config)
+    if format_info.get('reader') == 'anna_nbest':
+        forest = forest_from_nbest(io.StringIO(forest_string), format_info,
+            forest_class, **get_prune_options(config))
+    else:
+        forest = forest_class.from_string(
+            forest_string,
+            share_tokens=config.get('share_tokens', False),
+            format_info=format_info,
+            **get_prune_options(config)
+            )
+    return set_question_strategy(forest, config)
+
+
+def forest_from_lines(lines, format_info, config):
+    """
+    Create a Forest object from an iterable of conll lines (e.g. an open
+    file) using the forest backend and loader options given in the config.
+    The lines are parsed one by one without reading the whole forest into
+    memory first. Forests in a format with the reader 'anna_nbest' are read
+    as n-best parser output (see nbest_convert).
+
+    @:param lines: An iterable of conll lines.
+    @:param format_info: The format dict of the forest.
+    @:param config: The configuration dict.
+
+    @:return: a forest object
+    """
+    forest_class = get_forest_class(config)
+    if format_info.get('reader') == 'anna_nbest':
+        forest = forest_from_nbest(lines, format_info, forest_class,
+            **get_prune_options(config))
+    else:
+        forest = forest_class.from_lines(
+            lines,
+            share_tokens=config.get('share_tokens', False),
+            format_info=format_info,
+            **get_prune_options(config)
+            )
+    return set_question_strategy(forest, config)
+
+
+def create_forest(request, config, forest_store=None, forest_cache=None):
     """
     Create a Forest object from a client request.
 
 
     @:param request: A message of type request (json)
     @:param config: The configuration dict needed for preprocessing instructions
+    @:param forest_store: A forest_store.ForestStore used for requests
+        referring to a stored forest by its sentence id.
+    @:param forest_cache: A forest_cache.ForestCache used for looking up
+        forests that have already been parsed.
 
     @:return:
         a forest object created from the conll string in the request
@@ -206,84 +436,197 @@ def create_forest(request, config):
             msg = 'Format not supported: %s'
             logging.warning(msg, format_)
             raise ValueError(msg % format_) from e
-        return Forest.from_string(request['use_forest'], format_info=info)
-                                 #request['use_forest']: conll string e.g."1\tMit\tmit\t_\tADP\tAPPR\t_\t_\t3\t_\t..."
-                                 #info: format dict
-
-
-
-#-----------------ignore for now, come back later------------------------------------------
-    elif 'process' in request:
+        #request['use_forest']: conll string e.g."1\tMit\tmit\t_\tADP\tAPPR\t_\t_\t3\t_\t..."
+        #info: format dict
+        if forest_cache is None:
+            return forest_from_string(request['use_forest'], info, config)
+        key = cache_key(request['use_forest'], info['name'])
+        forest = forest_cache.get(key)
+        if forest is None:
+            forest = forest_from_string(request['use_forest'], info, config)
+            forest_cache.put(key, forest, len(request['use_forest']))
+        return forest
+
+    elif 'use_stored_forest' in request:
 
         # {
-        #     "type": "request",
-        #     "process": "Mit Bedacht badet heute ein Lurch in einem See.",
-        #     "source_format": "raw",
-        #     "target_format": "conll09"
+        #    "type": "request",
+        #    "use_stored_forest": "4711"
         # }
 
+        if forest_store is None:
+            raise ValueError('This server does not provide stored forests.')
+        format_ = request.get('forest_format', forest_store.format_name)
+        info = get_format_from_config(config, format_)
+        sentence_id = str(request['use_stored_forest'])
         try:
-            forest_string = process(request, config)
-        except ValueError as e:
-            msg = 'Cannot convert from source_format %s to target_format %s.'
-            logging.warning(msg,
-                request['source_format'], request['target_format'])
-            raise ValueError(msg % (request['source_format'],
-                request['target_format'])) from e
-        try:
-            info = get_format_from_config(config, request['target_format'])
+            forest = forest_store.load(sentence_id, info,
+                get_forest_class(config), **get_prune_options(config))
         except KeyError as e:
-            msg = 'target_format %s not supported.'
-            logging.warning(msg, request['target_format'])
-            raise ValueError(msg % (request['target_format'])) from e
-        return Forest.from_string(forest_string, format_info=info)
+            msg = 'No stored forest for sentence {}.'.format(sentence_id)
+            raise ValueError(msg) from e
+        return set_question_strategy(forest, config)
+
+    elif 'process' in request:
+        msg = 'Process requests are handled by create_processed_forest.'
+        raise ValueError(msg)
 
 
-def choose_processors(available_processors, source_format, target_format):
+async def create_processed_forest(request, config, worker_pool=None,
+        on_queued=None, daemons=None, routing_table=None, result_cache=None):
     """
-    Choose a list of processors that can transduce text in a
-    source_format into the target_format.
+    Create a Forest object from a client request asking to process a
+    sentence. The processors run as subprocesses without blocking the
+    event loop.
 
-    Args:
-        available_processors: A list or tuple of dicts containing at least
-        the keys 'source_format' and 'target_format'. They should also contain
-        the keys 'name' and 'command'.
-
-        source_format: A string specifying the source format.
-        target_format: A string specifying the target format.
-    """
-    # TODO: This can be made more efficient by saving the possible conversions
-    # in the config. The way it is now, we have to iterate over the processor
-    # list over and over again.
-    # Modifying the config, however, also means that we have to use a lock
-    # when accessing the config for writing. Alternatively, all possible
-    # conversion could be calculated when the server is started.
-    #
-    # Also, tree recursion is really cumbersome in Python:
-    for p in available_processors:
-        if (p['source_format'] == source_format
-                and p['target_format'] == target_format):
-            return (p,)
+    @:param request: A message of type request (json) containing 'process'
+    @:param config: The configuration dict needed for preprocessing instructions
+    @:param worker_pool: A WorkerPool limiting the number of pipelines
+        running at the same time or None
+    @:param on_queued: Called with the position in the queue of the pool if
+        the request has to wait for a free worker
+    @:param daemons: A daemons.DaemonManager holding the running daemon
+        processors or None
+    @:param routing_table: The routing.RoutingTable of the processors or
+        None to compute it from the config
+    @:param result_cache: A result_cache.ResultCache holding the outputs
+        of the processors or None
+
+    @:return: a forest object created from the output of the processors
+    """
+
+    # {
+    #     "type": "request",
+    #     "process": "Mit Bedacht badet heute ein Lurch in einem See.",
+    #     "source_format": "raw",
+    #     "target_format": "conll09"
+    # }
+
+    output, info = await run_processors(request, config, worker_pool,
+        on_queued, daemons, routing_table, result_cache)
+    return forest_from_lines(io.BytesIO(output), info, config)
+
+
+async def create_processed_batch(request, config, worker_pool=None,
+        on_queued=None, daemons=None, routing_table=None, result_cache=None):
+    """
+    Process all sentences of a batch request with a single run of the
+    processors and split the output into one forest per sentence.
+
+    @:param request: A message of type request (json) containing
+        'process_batch', either a list of sentences or a document
+    @:param config: The configuration dict needed for preprocessing instructions
+    @:param worker_pool: A WorkerPool limiting the number of pipelines
+        running at the same time or None
+    @:param on_queued: Called with the position in the queue of the pool if
+        the request has to wait for a free worker
+    @:param daemons: A daemons.DaemonManager holding the running daemon
+        processors or None
+    @:param routing_table: The routing.RoutingTable of the processors or
+        None to compute it from the config
+    @:param result_cache: A result_cache.ResultCache holding the outputs
+        of the processors or None
+
+    @:return: a list of forest strings and the format dict of the forests
+    """
+
+    # {
+    #     "type": "request",
+    #     "process_batch": [
+    #         "Mit Bedacht badet heute ein Lurch in einem See.",
+    #         "Der Lurch badet gern."
+    #     ],
+    #     "source_format": "raw",
+    #     "target_format": "conll09"
+    # }
+
+    batch = request['process_batch']
+    if isinstance(batch, list):
+        # One sentence per line.
+        batch = '\n'.join(sentence.strip() for sentence in batch) + '\n'
+    batch_request = dict(request, process=batch)
+    output, info = await run_processors(batch_request, config, worker_pool,
+        on_queued, daemons, routing_table, result_cache)
+    if info.get('reader') == 'anna_nbest':
+        forests = list(split_sentences(io.BytesIO(output)))
     else:
-        for p_i, p in enumerate(available_processors):
-            if source_format != p['source_format']:
-                continue
-            remaining_processors = [
-                available_processors[i]
-                for i in range(len(available_processors))
-                if i != p_i
-                ]
-            additional_processors = choose_processors(remaining_processors,
-                p['target_format'], target_format)
-            if additional_processors is None:
-                return None
-            else:
-                return (p,) + additional_processors
+        forests = [
+            ''.join(lines)
+            for lines in split_forests(io.BytesIO(output))
+            ]
+    if not forests:
+        raise ValueError('Processing the batch did not yield any forests.')
+    return forests, info
+
+
+async def run_processors(request, config, worker_pool=None, on_queued=None,
+        daemons=None, routing_table=None, result_cache=None):
+    """
+    Run the processors for a request containing 'process' (see process),
+    using the worker pool if given.
 
+    @:return: the output of the processors and the format dict of the
+        target format
+    """
+    target_format = request.get('target_format', config.get('default_format'))
+    try:
+        if worker_pool is None:
+            output = await process(
+                request, config, daemons, routing_table, result_cache)
+        else:
+            output = await worker_pool.run(process(
+                request, config, daemons, routing_table, result_cache),
+                on_queued)
+    except asyncio.TimeoutError as e:
+        if worker_pool is None:
+            msg = 'Processing timed out.'
+            logging.warning(msg)
+            raise ValueError(msg) from e
+        msg = 'Processing took longer than %s seconds.'
+        logging.warning(msg, worker_pool.timeout)
+        raise ValueError(msg % worker_pool.timeout) from e
+    except ValueError as e:
+        # Keep the reason, e.g. a missing route or a failing processor.
+        msg = 'Cannot convert from source_format %s to target_format %s: %s'
+        logging.warning(msg, request['source_format'], target_format, e)
+        raise ValueError(
+            msg % (request['source_format'], target_format, e)) from e
+    try:
+        info = get_format_from_config(config, target_format)
+    except (KeyError, ValueError) as e:
+        msg = 'target_format %s not supported.'
+        logging.warning(msg, target_format)
+        raise ValueError(msg % (target_format)) from e
+    return output, info
 
-def call_processor(processor, infile):
+
+def kill_process_group(subprocess):
+    """
+    Kill a subprocess started in a new session and all processes it started
+    (e.g. the JVM started by a processor script).
+    """
+    try:
+        os.killpg(subprocess.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def check_returncode(processor, returncode):
+    """
+    Raise a ValueError if a processor exited with a nonzero exit code.
+    """
+    if returncode != 0:
+        msg = 'Processor {} exited with code {}.'
+        raise ValueError(msg.format(processor.get('name'), returncode))
+
+
+async def call_processor(processor, infile, directory=None):
     """
     Call a processor that processes the infile and writes to an outfile.
+    The processor runs as an asyncio subprocess, so the server can handle
+    other connections while waiting for it. If the calling task is
+    cancelled (e.g. on a timeout), the subprocess and all processes it
+    started are killed.
 
     Args:
         processor: A dict containing the key 'command' with an args list
@@ -291,29 +634,142 @@ def call_processor(processor, infile):
             'source_format' and 'target_format'.
         infile: A filename that is to be used as the input to the processor
             command.
+        directory: The directory the outfile is created in.
 
     Returns:
         outfile: The name of the file the output of the processor is written to.
     """
-    # XXX: The whole server process is waiting for the subprocess to return.
-    # This kind of defeats the purpose of using asyncio. The subprocess has
-    # to be executed asynchronously.
-    outfile = tempfile.mktemp()
+    outfile = tempfile.mktemp(dir=directory)
     cmd_args = [
         arg.format(infile=infile, outfile=outfile)
         for arg in processor['command']
         ]
-    call(cmd_args)
+    # The processor gets its own process group, so that killing it also
+    # kills the programs started by processor scripts (e.g. a JVM).
+    subprocess = await asyncio.create_subprocess_exec(
+        *cmd_args, start_new_session=True)
+    try:
+        returncode = await subprocess.wait()
+    except asyncio.CancelledError:
+        kill_process_group(subprocess)
+        # Reap the killed subprocess before the event loop can be closed.
+        await subprocess.wait()
+        raise
+    check_returncode(processor, returncode)
     return outfile
 
 
-def process(request, config):
+async def call_piped_processors(processors, data=None, infile=None):
     """
-    Process a sentence using the processors described in the config.
+    Call processors reading from stdin and writing to stdout. The stdout of
+    every processor is connected to the stdin of the next one by an OS
+    pipe, so all processors run at the same time and every processor
+    starts reading while its predecessor is still writing.
+
+    Args:
+        processors: A list of processor dicts with the value 'pipe' for
+            the key 'io'.
+        data: A bytestring that is written to the stdin of the first
+            processor.
+        infile: A filename that is used as the stdin of the first processor
+            if data is None.
+
+    Returns:
+        The stdout of the last processor as a bytestring.
+    """
+    subprocesses = []
+    # The read end of the pipe to the next processor.
+    pipe_fd = None
+    try:
+        for i, processor in enumerate(processors):
+            if i > 0:
+                stdin, pipe_fd = pipe_fd, None
+            elif data is None:
+                stdin = open(infile, 'rb')
+            else:
+                stdin = asyncio.subprocess.PIPE
+            if i + 1 < len(processors):
+                pipe_fd, stdout = os.pipe()
+            else:
+                stdout = asyncio.subprocess.PIPE
+            try:
+                subprocesses.append(await asyncio.create_subprocess_exec(
+                    *processor['command'],
+                    stdin=stdin,
+                    stdout=stdout,
+                    start_new_session=True
+                    ))
+            finally:
+                # The subprocess has its own copies of its stdin and stdout.
+                if i > 0:
+                    os.close(stdin)
+                elif data is None:
+                    stdin.close()
+                if pipe_fd is not None:
+                    os.close(stdout)
+
+        async def feed():
+            if data is not None:
+                subprocesses[0].stdin.write(data)
+                try:
+                    await subprocesses[0].stdin.drain()
+                except ConnectionError:
+                    # The processor exited without reading all input.
+                    pass
+                subprocesses[0].stdin.close()
+
+        _, output = await asyncio.gather(
+            feed(), subprocesses[-1].stdout.read())
+        returncodes = [await subprocess.wait() for subprocess in subprocesses]
+    except BaseException:
+        if pipe_fd is not None:
+            os.close(pipe_fd)
+        for subprocess in subprocesses:
+            kill_process_group(subprocess)
+        for subprocess in subprocesses:
+            await subprocess.wait()
+        raise
+    for processor, returncode in zip(processors, returncodes):
+        check_returncode(processor, returncode)
+    return output
+
+
+async def call_daemon(processor, data, daemons):
+    """
+    Send data (a bytestring) to the daemon of a daemon processor and return
+    its output.
+
+    Args:
+        processor: A processor dict with a true value for the key 'daemon'.
+        data: The input of the processor.
+        daemons: A daemons.DaemonManager holding the running daemon
+            processors or None.
+    """
+    if daemons is None:
+        msg = 'Daemon processor {} is not running.'
+        raise ValueError(msg.format(processor.get('name')))
+    return await daemons[processor['name']].request(data)
+
+
+async def process(request, config, daemons=None, routing_table=None,
+        result_cache=None):
+    """
+    Process a sentence using the processors described in the config (see
+    run_pipeline). If a result cache is given, the output is taken from the
+    cache if possible.
 
     Args:
         request: A message of type request requesting to process a sentence.
         config: The configuration dict needed for preprocessing instructions.
+        daemons: A daemons.DaemonManager holding the running daemon
+            processors or None.
+        routing_table: The routing.RoutingTable of the processors or None
+            to compute it from the config.
+        result_cache: A result_cache.ResultCache holding the outputs of
+            the processors or None.
+
+    Returns:
+        The output of the last processor as a bytestring.
     """
     try:
         target_format = (
@@ -326,18 +782,78 @@ def process(request, config):
         msg += ' Specify a default_format in the configuration file.'
         raise ValueError(msg)
 
-    processors = choose_processors(
-        config['processors'],
-        request['source_format'],
-        target_format
-        )
-
-    infile = tempfile.mktemp()
-    open(infile, 'w').write(request['process'])
-    for processor in processors:
-        infile = call_processor(processor, infile)
-    outfile = infile
-
-    forest_string = open(outfile).read()
-    return forest_string
-#------------------------------------------------------------------------------------------------------
+    if routing_table is None:
+        routing_table = RoutingTable(
+            config.get('processors', []), config.get('format_aliases'))
+    processors = routing_table.lookup(request['source_format'], target_format)
+    if processors is None:
+        msg = 'No processors for converting {} into {}.'
+        raise ValueError(msg.format(request['source_format'], target_format))
+
+    data = request['process'].encode()
+    if result_cache is not None:
+        key = result_cache.key(data, processors)
+        output = result_cache.get(key)
+        if output is not None:
+            return output
+        output = await run_pipeline(processors, data, daemons)
+        result_cache.put(key, output)
+        return output
+    return await run_pipeline(processors, data, daemons)
+
+
+async def run_pipeline(processors, data, daemons=None):
+    """
+    Process data (a bytestring) with a sequence of processors.
+
+    Consecutive processors reading from stdin and writing to stdout ('io'
+    set to 'pipe') are connected by OS pipes. Other processors read from
+    and write to files in a temporary directory, which is removed
+    afterwards.
+
+    Args:
+        processors: A sequence of processor dicts.
+        data: The input of the first processor.
+        daemons: A daemons.DaemonManager holding the running daemon
+            processors or None.
+
+    Returns:
+        The output of the last processor as a bytestring.
+    """
+    # The data is either in memory (data) or in a file (infile).
+    infile = None
+    with tempfile.TemporaryDirectory(prefix='aas-') as directory:
+        i = 0
+        while i < len(processors):
+            processor = processors[i]
+            if processor.get('daemon'):
+                if infile is not None:
+                    with open(infile, 'rb') as input_file:
+                        data = input_file.read()
+                    infile = None
+                data = await call_daemon(processor, data, daemons)
+                i += 1
+            elif processor.get('io') == 'pipe':
+                j = i + 1
+                while (j < len(processors)
+                        and processors[j].get('io') == 'pipe'
+                        and not processors[j].get('daemon')):
+                    j += 1
+                data = await call_piped_processors(
+                    processors[i:j],
+                    data if infile is None else None,
+                    infile
+                    )
+                infile = None
+                i = j
+            else:
+                if infile is None:
+                    infile = tempfile.mktemp(dir=directory)
+                    with open(infile, 'wb') as input_file:
+                        input_file.write(data)
+                infile = await call_processor(processor, infile, directory)
+                i += 1
+        if infile is not None:
+            with open(infile, 'rb') as output_file:
+                data = output_file.read()
+    return data
@@ -0,0 +1,361 @@
+# -*- coding: utf-8 -*-
+
+"""
+This module implements the encodings and compressions of AaSP messages that
+a client and the server can agree on instead of plain JSON.
+
+The client offers encodings and compressions in the pairs 'encodings' and
+'compressions' of a handshake message, which it sends as its first message
+encoded as JSON. The server chooses the first offered encoding and
+compression it supports and names them in the pairs 'encoding' and
+'compression' of a handshake message in response, which is still encoded as
+JSON. All following messages in both directions use the chosen encoding, so
+the first request, which usually carries the largest data, is already
+encoded and compressed with it. If a compression has been chosen, every message starts
+with a byte that is 1 if the rest of the message is compressed and 0
+otherwise; only messages of at least COMPRESSION_THRESHOLD bytes are
+compressed.
+
+The encoding 'msgpack' is always supported: if the msgpack package is not
+installed, a pure-Python implementation of the format is used. 'cbor' and
+the compression 'zstd' are only supported if the packages cbor2 and
+zstandard are installed. 'zlib' is always supported.
+"""
+
+import json
+import struct
+import zlib
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Minimal size in bytes of an encoded message that is compressed.
+COMPRESSION_THRESHOLD = 1024
+
+
+def _pack_msgpack(obj, parts):
+    """
+    Append the msgpack encoding of a JSON-like object to the list parts.
+    """
+    if obj is None:
+        parts.append(b'\xc0')
+    elif obj is True:
+        parts.append(b'\xc3')
+    elif obj is False:
+        parts.append(b'\xc2')
+    elif isinstance(obj, int):
+        if 0 <= obj < 0x80:
+            parts.append(struct.pack('B', obj))
+        elif -0x20 <= obj < 0:
+            parts.append(struct.pack('b', obj))
+        else:
+            for type_byte, fmt, low, high in _MSGPACK_INTS:
+                if low <= obj < high:
+                    parts.append(struct.pack(fmt, type_byte, obj))
+                    break
+            else:
+                raise ValueError('Integer {} is too large for msgpack.'.format(obj))
+    elif isinstance(obj, float):
+        parts.append(struct.pack('>Bd', 0xcb, obj))
+    elif isinstance(obj, str):
+        data = obj.encode()
+        _pack_msgpack_header(len(data), 0xa0, 32, 0xd9, parts)
+        parts.append(data)
+    elif isinstance(obj, (bytes, bytearray)):
+        _pack_msgpack_header(len(obj), None, 0, 0xc4, parts)
+        parts.append(bytes(obj))
+    elif isinstance(obj, (list, tuple)):
+        _pack_msgpack_header(len(obj), 0x90, 16, 0xdc, parts)
+        for item in obj:
+            _pack_msgpack(item, parts)
+    elif isinstance(obj, dict):
+        _pack_msgpack_header(len(obj), 0x80, 16, 0xde, parts)
+        for key, value in obj.items():
+            _pack_msgpack(key, parts)
+            _pack_msgpack(value, parts)
+    else:
+        raise ValueError('Cannot encode {!r} with msgpack.'.format(obj))
+
+
+# (type byte, struct format, lower bound, upper bound) of the integer types.
+_MSGPACK_INTS = (
+    (0xcc, '>BB', 0, 2 ** 8), (0xcd, '>BH', 0, 2 ** 16),
+    (0xce, '>BI', 0, 2 ** 32), (0xcf, '>BQ', 0, 2 ** 64),
+    (0xd0, '>Bb', -2 ** 7, 0), (0xd1, '>Bh', -2 ** 15, 0),
+    (0xd2, '>Bi', -2 ** 31, 0), (0xd3, '>Bq', -2 ** 63, 0)
+    )
+
+
+def _pack_msgpack_header(length, fix_type, fix_limit, first_type, parts):
+    """
+    Append the header of a string, binary, array or map of the given length
+    to parts. fix_type is the type byte of the short form for lengths below
+    fix_limit (None if there is none) and first_type is the type byte of the
+    form with the smallest length field; the forms with larger length
+    fields follow it.
+    """
+    if fix_type is not None and length < fix_limit:
+        parts.append(struct.pack('B', fix_type | length))
+        return
+    # Strings and binaries have 8, 16 and 32 bit lengths, arrays and maps
+    # only 16 and 32 bit lengths.
+    formats = ('>BB', '>BH', '>BI') if first_type in (0xc4, 0xd9) else ('>BH', '>BI')
+    for offset, fmt in enumerate(formats):
+        if length < 2 ** (8 * struct.calcsize(fmt[2:])):
+            parts.append(struct.pack(fmt, first_type + offset, length))
+            return
+    raise ValueError('Object of length {} is too large for msgpack.'.format(length))
+
+
+class _MsgpackReader(object):
+    """
+    Decodes a msgpack encoded bytestring.
+    """
+
+    def __init__(self, data):
+        self.data = memoryview(data)
+        self.offset = 0
+
+    def take(self, size):
+        """
+        Consume size bytes and return them.
+        """
+        end = self.offset + size
+        if end > len(self.data):
+            raise ValueError('Truncated msgpack data.')
+        chunk = self.data[self.offset:end]
+        self.offset = end
+        return chunk
+
+    def unpack(self, fmt):
+        """
+        Consume a struct of the given format and return its only value.
+        """
+        return struct.unpack(fmt, self.take(struct.calcsize(fmt)))[0]
+
+    def read(self):
+        """
+        Decode the next object.
+        """
+        type_byte = self.unpack('B')
+        if type_byte < 0x80:
+            return type_byte
+        elif type_byte >= 0xe0:
+            return type_byte - 0x100
+        elif type_byte < 0x90:
+            return self.read_map(type_byte & 0x0f)
+        elif type_byte < 0xa0:
+            return self.read_array(type_byte & 0x0f)
+        elif type_byte < 0xc0:
+            return self.read_str(type_byte & 0x1f)
+        elif type_byte == 0xc0:
+            return None
+        elif type_byte == 0xc2:
+            return False
+        elif type_byte == 0xc3:
+            return True
+        elif type_byte in _MSGPACK_LENGTHS:
+            kind, fmt = _MSGPACK_LENGTHS[type_byte]
+            length = self.unpack(fmt)
+            if kind == 'bin':
+                return bytes(self.take(length))
+            elif kind == 'str':
+                return self.read_str(length)
+            elif kind == 'array':
+                return self.read_array(length)
+            return self.read_map(length)
+        elif type_byte in _MSGPACK_NUMBERS:
+            return self.unpack(_MSGPACK_NUMBERS[type_byte])
+        raise ValueError('Unsupported msgpack type 0x{:02x}.'.format(type_byte))
+
+    def read_str(self, length):
+        return str(self.take(length), 'utf-8')
+
+    def read_array(self, length):
+        return [self.read() for _ in range(length)]
+
+    def read_map(self, length):
+        result = {}
+        for _ in range(length):
+            key = self.read()
+            result[key] = self.read()
+        return result
+
+
+_MSGPACK_LENGTHS = {
+    0xc4: ('bin', '>B'), 0xc5: ('bin', '>H'), 0xc6: ('bin', '>I'),
+    0xd9: ('str', '>B'), 0xda: ('str', '>H'), 0xdb: ('str', '>I'),
+    0xdc: ('array', '>H'), 0xdd: ('array', '>I'),
+    0xde: ('map', '>H'), 0xdf: ('map', '>I')
+    }
+
+_MSGPACK_NUMBERS = {
+    0xca: '>f', 0xcb: '>d',
+    0xcc: '>B', 0xcd: '>H', 0xce: '>I', 0xcf: '>Q',
+    0xd0: '>b', 0xd1: '>h', 0xd2: '>i', 0xd3: '>q'
+    }
+
+
+def pack_msgpack(obj):
+    """
+    Encode a JSON-like object with msgpack (pure-Python implementation).
+    """
+    parts = []
+    _pack_msgpack(obj, parts)
+    return b''.join(parts)
+
+
+def unpack_msgpack(data):
+    """
+    Decode a msgpack encoded bytestring (pure-Python implementation).
+    """
+    reader = _MsgpackReader(data)
+    try:
+        obj = reader.read()
+    except (struct.error, UnicodeDecodeError, TypeError, RecursionError) as e:
+        raise ValueError('Invalid msgpack data.') from e
+    if reader.offset != len(reader.data):
+        raise ValueError('Trailing bytes after msgpack data.')
+    return obj
+
+
+def _encode_json(message):
+    return json.dumps(message).encode()
+
+
+def _decode_json(data):
+    return json.loads(bytes(data).decode())
+
+
+def _decode_cbor(data):
+    try:
+        return cbor2.loads(bytes(data))
+    except cbor2.CBORDecodeError as e:
+        raise ValueError(str(e)) from e
+
+
+def _decode_msgpack(data):
+    try:
+        return msgpack.unpackb(data, raw=False)
+    except (msgpack.UnpackException, ValueError) as e:
+        raise ValueError(str(e)) from e
+
+
+# Supported encodings: name -> (encode function, decode function). Decode
+# functions raise a ValueError for invalid data.
+ENCODINGS = {'json': (_encode_json, _decode_json)}
+if msgpack is not None:
+    ENCODINGS['msgpack'] = (
+        lambda message: msgpack.packb(message, use_bin_type=True),
+        _decode_msgpack)
+else:
+    ENCODINGS['msgpack'] = (pack_msgpack, unpack_msgpack)
+if cbor2 is not None:
+    ENCODINGS['cbor'] = (cbor2.dumps, _decode_cbor)
+
+
+def _zlib_decompress(data, max_size):
+    decompressor = zlib.decompressobj()
+    try:
+        result = decompressor.decompress(data, max_size + 1)
+    except zlib.error as e:
+        raise ValueError('Invalid zlib data. ({})'.format(e)) from e
+    if len(result) > max_size:
+        raise ValueError('Decompressed message exceeds {} bytes.'.format(max_size))
+    return result
+
+
+def _zstd_decompress(data, max_size):
+    reader = zstandard.ZstdDecompressor().stream_reader(bytes(data))
+    try:
+        result = reader.read(max_size + 1)
+    except zstandard.ZstdError as e:
+        raise ValueError('Invalid zstd data. ({})'.format(e)) from e
+    if len(result) > max_size:
+        raise ValueError('Decompressed message exceeds {} bytes.'.format(max_size))
+    return result
+
+
+# Supported compressions: name -> (compress function, decompress function).
+# Decompress functions take the maximal size of the result as second
+# argument and raise a ValueError for invalid or too large data.
+COMPRESSIONS = {'zlib': (zlib.compress, _zlib_decompress)}
+if zstandard is not None:
+    COMPRESSIONS['zstd'] = (
+        lambda data: zstandard.ZstdCompressor().compress(data),
+        _zstd_decompress)
+
+
+def choose(offered, supported):
+    """
+    Return the first name in the list offered that is in supported or None
+    if there is none. Raises a ValueError if offered is not a list of
+    strings.
+    """
+    if (not isinstance(offered, list)
+            or not all(isinstance(name, str) for name in offered)):
+        raise ValueError('Encodings and compressions have to be lists of strings.')
+    for name in offered:
+        if name in supported:
+            return name
+    return None
+
+
+class MessageCodec(object):
+    """
+    Converts messages to bytestrings and back using an encoding and
+    optionally a compression.
+    """
+
+    def __init__(self, encoding='json', compression=None,
+            max_message_size=None):
+        """
+        Initialize a codec for the given encoding and compression (names
+        from ENCODINGS and COMPRESSIONS). Decompressed messages may be at
+        most max_message_size bytes large (None for no limit).
+        """
+        self.encoding = encoding
+        self.compression = compression
+        self.max_message_size = max_message_size
+        self._encode, self._decode = ENCODINGS[encoding]
+        if compression is not None:
+            self._compress, self._decompress = COMPRESSIONS[compression]
+
+    def encode(self, message):
+        """
+        Encode (and compress) a message.
+        """
+        data = self._encode(message)
+        if self.compression is None:
+            return data
+        if len(data) >= COMPRESSION_THRESHOLD:
+            return b'\x01' + self._compress(data)
+        return b'\x00' + data
+
+    def decode(self, data):
+        """
+        Decode a received message. Raises a ValueError if the message
+        cannot be decoded.
+        """
+        if self.compression is not None:
+            if not data:
+                raise ValueError('Empty message.')
+            flag, data = data[0], memoryview(data)[1:]
+            if flag == 1:
+                max_size = self.max_message_size
+                data = self._decompress(data, max_size if max_size else 2 ** 62)
+            elif flag != 0:
+                raise ValueError('Invalid compression flag {}.'.format(flag))
+        return self._decode(data)
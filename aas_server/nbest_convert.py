@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+This module reads the output of the n-best parser of mate-tools
+(is2.parser.ParserNBest, see Parser/Parser). For every sentence, the output
+contains the CoNLL rows of the best tree followed by a line
+
+    ParseNBest <k> [<scores> @@@ -1,<None> <head>,<rel> ...];[...];...
+
+listing the heads and relations of all k candidate trees. The candidates
+only differ in their head and relation columns, so the forest of a sentence
+is built from a TokenTable of the CoNLL rows and one SharedTokenTree per
+candidate. Input is read line by line and may contain any number of
+sentences.
+
+The module can also be run to convert n-best output into CoNLL forests: one
+tree per candidate preceded by a '# score = ...' comment, trees separated by
+an empty line and forests by two empty lines.
+"""
+
+import argparse
+import re
+import sys
+
+from tree import Forest, SharedTokenTree, TokenTable, Tree
+
+NBEST_PREFIX = 'ParseNBest'
+SCORE = re.compile(r'ParseAnnaScore=(\S+)')
+
+
+def parse_candidates(nbest_line, strings=None):
+    """
+    Parse a ParseNBest line into a list of (score, heads, rels) triples,
+    one per candidate tree. The score is None if the line does not contain
+    it. Head and relation values are interned in the dict strings.
+    """
+    if strings is None:
+        strings = dict()
+    try:
+        candidates_part = nbest_line.rstrip('\r\n').split('\t', 2)[2]
+    except IndexError as e:
+        raise ValueError('Invalid n-best line: {}'.format(nbest_line[:50])) from e
+    candidates = []
+    for candidate in candidates_part.split('];['):
+        info, _, edges = candidate.strip('[];').partition('@@@')
+        match = SCORE.search(info)
+        score = float(match.group(1)) if match else None
+        heads, rels = [], []
+        # The first edge belongs to the artificial root (-1,<None>).
+        for edge in edges.split()[1:]:
+            head, _, rel = edge.partition(',')
+            heads.append(strings.setdefault(head, head))
+            rels.append(strings.setdefault(rel, rel))
+        candidates.append((score, tuple(heads), tuple(rels)))
+    return candidates
+
+
+def iter_sentences(lines):
+    """
+    Generate a (token_lines, nbest_line) pair for every sentence in an
+    iterable of lines (str or bytes) of n-best output.
+    """
+    token_lines = []
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode()
+        line = line.rstrip('\r\n')
+        if line.startswith(NBEST_PREFIX):
+            yield token_lines, line
+            token_lines = []
+        elif line.strip() and not line.startswith('#'):
+            token_lines.append(line)
+    if token_lines:
+        raise ValueError('Sentence without {} line.'.format(NBEST_PREFIX))
+
+
+def iter_candidate_trees(token_lines, nbest_line, format_info):
+    """
+    Generate the candidate trees of a sentence. The candidates share the
+    columns of token_lines and only store their head and relation columns.
+    The score of a candidate is kept as the score of its tree.
+    """
+    template = Tree.from_lines(token_lines, format_info=format_info)
+    table = TokenTable(template)
+    for score, heads, rels in parse_candidates(nbest_line, table.strings):
+        if len(heads) != len(table.rows):
+            msg = 'Candidate with {} heads for a sentence of {} tokens.'
+            raise ValueError(msg.format(len(heads), len(table.rows)))
+        tree = SharedTokenTree(table, heads, rels)
+        tree.score = score
+        yield tree
+
+
+def forest_from_sentence(token_lines, nbest_line, format_info,
+        forest_class=Forest, **prune_options):
+    """
+    Create a forest containing all candidate trees of a sentence. For the
+    prune_options deduplicate and max_trees see tree.prune_trees.
+    """
+    return forest_class.from_trees(
+        iter_candidate_trees(token_lines, nbest_line, format_info),
+        **prune_options)
+
+
+def iter_forests(lines, format_info, forest_class=Forest, **prune_options):
+    """
+    Generate the forests of all sentences in an iterable of lines of
+    n-best output. Every forest is created as soon as its sentence has been
+    read.
+    """
+    for token_lines, nbest_line in iter_sentences(lines):
+        yield forest_from_sentence(
+            token_lines, nbest_line, format_info, forest_class,
+            **prune_options)
+
+
+def forest_from_nbest(lines, format_info, forest_class=Forest, **prune_options):
+    """
+    Create the forest of the only sentence in an iterable of lines of
+    n-best output. Raises a ValueError if there is not exactly one sentence.
+    """
+    forests = iter_forests(lines, format_info, forest_class, **prune_options)
+    forest = next(forests, None)
+    if forest is None:
+        raise ValueError('The n-best output does not contain a sentence.')
+    if next(forests, None) is not None:
+        raise ValueError('The n-best output contains more than one sentence.')
+    return forest
+
+
+def split_sentences(lines):
+    """
+    Generate the n-best output of every sentence in an iterable of lines
+    as a separate string.
+    """
+    for token_lines, nbest_line in iter_sentences(lines):
+        yield '\n'.join(token_lines + [nbest_line]) + '\n'
+
+
+def write_forests(lines, output, head, rel):
+    """
+    Convert n-best output into CoNLL forests and write them to the file
+    object output. Only the head and relation columns (head and rel) of
+    the rows are replaced for every candidate.
+    """
+    for token_lines, nbest_line in iter_sentences(lines):
+        rows = [line.split('\t') for line in token_lines]
+        for score, heads, rels in parse_candidates(nbest_line):
+            if score is not None:
+                output.write('# score = {}\n'.format(score))
+            for row, head_value, rel_value in zip(rows, heads, rels):
+                row[head] = head_value
+                row[rel] = rel_value
+                output.write('\t'.join(row))
+                output.write('\n')
+            output.write('\n')
+        output.write('\n')
+
+
+def main():
+    desc = 'Convert the output of the mate-tools n-best parser into CoNLL forests.'
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument(
+        'infile',
+        nargs='?',
+        type=argparse.FileType('r'),
+        default=sys.stdin,
+        help='n-best output (default: stdin).')
+    parser.add_argument(
+        'outfile',
+        nargs='?',
+        type=argparse.FileType('w'),
+        default=sys.stdout,
+        help='File to write the forests to (default: stdout).')
+    parser.add_argument(
+        '--head',
+        required=False,
+        type=int,
+        default=9,
+        help='Column of the heads (default: 9, the PHEAD column of CoNLL09).')
+    parser.add_argument(
+        '--relation',
+        required=False,
+        type=int,
+        default=11,
+        help='Column of the relations (default: 11, the PDEPREL column of CoNLL09).')
+    args = parser.parse_args()
+
+    try:
+        write_forests(args.infile, args.outfile, args.head, args.relation)
+    except ValueError as e:
+        sys.exit(str(e))
+
+if __name__ == '__main__':
+    main()
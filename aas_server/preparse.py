@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+This module pre-parses a corpus into a directory of forests (and optionally
+a forest store, see forest_store), so that annotators do not have to wait
+for the parser.
+
+The corpus is a directory containing one file per sentence; the name of a
+file is the id of its sentence. The files are distributed over several
+worker processes. Every worker processes its sentences one after another
+using the processors of the server config, so daemon processors (see
+daemons) are started once per worker and stay warm. Every forest is
+written atomically to a file of the same name in the forest directory, and
+sentences whose forest file exists already are skipped, so an interrupted
+run can simply be started again.
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import sys
+import tempfile
+import time
+
+from daemons import DaemonManager
+from forest_store import build_store
+from json_interface import get_format_from_config, process
+from nbest_convert import write_forests
+from routing import RoutingTable
+
+
+def count_trees(forest_string):
+    """
+    Return the number of trees in a conll forest string.
+    """
+    trees = 0
+    in_tree = False
+    for line in forest_string.splitlines():
+        if not line.strip():
+            in_tree = False
+        elif not line.startswith('#') and not in_tree:
+            in_tree = True
+            trees += 1
+    return trees
+
+
+def write_atomically(filename, text):
+    """
+    Write text to filename. The file is replaced atomically, so it either
+    contains the whole text or does not exist.
+    """
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, tmp_name = tempfile.mkstemp(dir=directory, prefix='.')
+    try:
+        with os.fdopen(fd, 'w') as forest_file:
+            forest_file.write(text)
+        os.chmod(tmp_name, 0o644)
+        os.replace(tmp_name, filename)
+    except BaseException:
+        os.unlink(tmp_name)
+        raise
+
+
+def pending_sentences(corpus_dir, forest_dir):
+    """
+    Return the sorted names of the sentence files in corpus_dir that do not
+    have a forest file in forest_dir yet.
+    """
+    return sorted(
+        name
+        for name in os.listdir(corpus_dir)
+        if not name.startswith('.')
+        and os.path.isfile(os.path.join(corpus_dir, name))
+        and not os.path.exists(os.path.join(forest_dir, name))
+        )
+
+
+async def preparse_shard(names, corpus_dir, forest_dir, request, config,
+        progress, routing_table=None):
+    """
+    Process the sentence files names one after another and write their
+    forests. For every sentence, a (sentence id, number of trees) pair is
+    put into the queue progress; the number of trees is None if the
+    sentence could not be processed. The processors are looked up in
+    routing_table (see json_interface.process).
+    """
+    info = get_format_from_config(config, request['target_format'])
+    daemons = DaemonManager(config.get('processors', []), interval=0)
+    await daemons.start()
+    try:
+        for name in names:
+            with open(os.path.join(corpus_dir, name)) as sentence_file:
+                sentence = sentence_file.read()
+            try:
+                output = await process(dict(request, process=sentence),
+                    config, daemons, routing_table)
+                if info.get('reader') == 'anna_nbest':
+                    forest = io.StringIO()
+                    write_forests(io.BytesIO(output), forest,
+                        info['head'], info['relation'])
+                    forest_string = forest.getvalue()
+                else:
+                    forest_string = output.decode()
+                trees = count_trees(forest_string)
+                if not trees:
+                    raise ValueError('The processors did not produce any trees.')
+            except (ValueError, OSError, UnicodeDecodeError) as e:
+                logging.warning('Cannot process sentence %s: %s', name, e)
+                progress.put((name, None))
+                continue
+            write_atomically(os.path.join(forest_dir, name), forest_string)
+            progress.put((name, trees))
+    finally:
+        await daemons.stop()
+
+
+def run_worker(names, corpus_dir, forest_dir, request, config, progress):
+    """
+    Entry point of a worker process (see preparse_shard).
+    """
+    logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.WARNING)
+    routing_table = RoutingTable(
+        config.get('processors', []), config.get('format_aliases'))
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        loop.run_until_complete(preparse_shard(
+            names, corpus_dir, forest_dir, request, config, progress,
+            routing_table))
+    finally:
+        loop.close()
+
+
+def preparse(corpus_dir, forest_dir, request, config, workers=1,
+        report_interval=10):
+    """
+    Pre-parse all pending sentences of corpus_dir into forest_dir using the
+    given number of worker processes and log the throughput every
+    report_interval seconds.
+
+    Returns a (sentences, trees, failures) triple.
+    """
+    os.makedirs(forest_dir, exist_ok=True)
+    names = pending_sentences(corpus_dir, forest_dir)
+    logging.info('%d sentences to parse.', len(names))
+    if not names:
+        return 0, 0, 0
+
+    progress = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(
+            target=run_worker,
+            args=(names[i::workers], corpus_dir, forest_dir, request, config,
+                progress))
+        for i in range(min(workers, len(names)))
+        ]
+    for worker in processes:
+        worker.start()
+
+    sentences = trees = failures = 0
+    start = last_report = time.time()
+    try:
+        while sentences + failures < len(names):
+            try:
+                name, tree_count = progress.get(timeout=1)
+            except queue.Empty:
+                if not any(worker.is_alive() for worker in processes):
+                    logging.error('All workers have terminated.')
+                    break
+                continue
+            if tree_count is None:
+                failures += 1
+            else:
+                sentences += 1
+                trees += tree_count
+            now = time.time()
+            if now - last_report >= report_interval:
+                last_report = now
+                log_throughput(sentences, trees, failures, now - start, len(names))
+    finally:
+        for worker in processes:
+            worker.join()
+    log_throughput(sentences, trees, failures, time.time() - start, len(names))
+    return sentences, trees, failures
+
+
+def log_throughput(sentences, trees, failures, seconds, total):
+    """
+    Log the number of parsed sentences and trees per second.
+    """
+    seconds = max(seconds, 1e-9)
+    logging.info(
+        'Parsed %d/%d sentences (%d failures, %d trees) in %.1f s:'
+        ' %.2f sentences/s, %.1f trees/s.',
+        sentences, total, failures, trees, seconds,
+        sentences / seconds, trees / seconds)
+
+
+def main():
+    desc = 'Pre-parse a corpus directory into a directory of forests.'
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument(
+        'corpus_dir',
+        type=str,
+        help='Directory containing one file per sentence.')
+    parser.add_argument(
+        'forest_dir',
+        type=str,
+        help='Directory the forests are written to.')
+    parser.add_argument(
+        '-s',
+        '--source_format',
+        required=False,
+        type=str,
+        default='raw',
+        help='Format of the sentences.')
+    parser.add_argument(
+        '-t',
+        '--target_format',
+        required=False,
+        type=str,
+        help='Format of the forests (default: default_format).')
+    parser.add_argument(
+        '-j',
+        '--jobs',
+        required=False,
+        type=int,
+        default=os.cpu_count(),
+        help='Number of worker processes (default: number of CPUs).')
+    parser.add_argument(
+        '--store',
+        required=False,
+        type=str,
+        help='Forest store to build from the forest directory afterwards.')
+    parser.add_argument(
+        '-c',
+        '--configfile',
+        required=False,
+        type=str,
+        default=os.path.join(os.environ['HOME'], '.aas-server.json'),
+        help='Name of the config file.')
+    args = parser.parse_args()
+
+    config = json.load(open(args.configfile))
+    logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.INFO)
+    target_format = args.target_format or config.get('default_format')
+    try:
+        format_info = get_format_from_config(config, target_format)
+    except (KeyError, ValueError):
+        sys.exit('Format {} not found in {}.'.format(target_format, args.configfile))
+    request = {
+        'type': 'request',
+        'source_format': args.source_format,
+        'target_format': target_format
+        }
+
+    preparse(args.corpus_dir, args.forest_dir, request, config, args.jobs)
+
+    if args.store:
+        count = build_store(args.forest_dir, args.store, format_info)
+        logging.info('Wrote %d forests to %s.', count, args.store)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+This module provides a persistent cache of the outputs of processor
+pipelines, so that a sentence that is processed again (e.g. after an
+annotator restarted the annotation or by several annotators annotating the
+same text) does not have to be parsed again.
+
+The cache is a content-addressed directory: the output of a pipeline is
+stored in a file named after the hash of the input and the pipeline, i.e.
+the commands of its processors and their optional 'version' values.
+Changing a processor's command or version thus invalidates its outputs. The
+least recently used outputs are deleted if the cache exceeds its size.
+
+The cache can be prewarmed by running this module on a corpus file.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+from daemons import DaemonManager
+from json_interface import process
+from routing import RoutingTable
+
+
+def pipeline_key(data, processors):
+    """
+    Return the key under which the output of processing the bytestring data
+    with a sequence of processors is cached.
+    """
+    pipeline = [
+        [processor.get('name'), processor['command'], processor.get('version')]
+        for processor in processors
+        ]
+    digest = hashlib.sha256(json.dumps(pipeline).encode())
+    digest.update(b'\0')
+    digest.update(data)
+    return digest.hexdigest()
+
+
+class ResultCache(object):
+    """
+    A directory of pipeline outputs holding at most max_size bytes.
+    """
+
+    def __init__(self, directory, max_size):
+        """
+        Open the cache in directory, creating the directory if needed, and
+        read the sizes and access times of the cached outputs.
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        # key -> (access time, size)
+        self.entries = dict()
+        os.makedirs(directory, exist_ok=True)
+        for subdirectory in os.scandir(directory):
+            if not subdirectory.is_dir():
+                continue
+            for entry in os.scandir(subdirectory.path):
+                if entry.is_file() and not entry.name.startswith('.'):
+                    stat = entry.stat()
+                    self.entries[entry.name] = (stat.st_mtime, stat.st_size)
+        self.size = sum(size for _, size in self.entries.values())
+
+    def __len__(self):
+        return len(self.entries)
+
+    def key(self, data, processors):
+        """
+        Return the key under which the output of processing data with a
+        sequence of processors is cached (see pipeline_key).
+        """
+        return pipeline_key(data, processors)
+
+    def path(self, key):
+        """
+        Return the name of the file the output cached under key is stored in.
+        """
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key):
+        """
+        Return the output cached under key or None if there is no such
+        output.
+        """
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as output_file:
+                output = output_file.read()
+        except FileNotFoundError:
+            self.entries.pop(key, None)
+            self.misses += 1
+            self.log('miss')
+            return None
+        # The modification time is used as access time, since many file
+        # systems do not update access times.
+        now = time.time()
+        try:
+            os.utime(path, (now, now))
+        except OSError:
+            pass
+        self.entries[key] = (now, len(output))
+        self.hits += 1
+        self.log('hit')
+        return output
+
+    def put(self, key, output):
+        """
+        Cache output under key and delete the least recently used outputs
+        until the cache does not exceed its size any more. The file is
+        written atomically, so concurrent readers never see partial outputs.
+        """
+        if len(output) > self.max_size:
+            return
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.')
+        try:
+            with os.fdopen(fd, 'wb') as output_file:
+                output_file.write(output)
+            os.replace(tmp_name, path)
+        except BaseException:
+            os.unlink(tmp_name)
+            raise
+        if key in self.entries:
+            self.size -= self.entries[key][1]
+        self.entries[key] = (time.time(), len(output))
+        self.size += len(output)
+        self.evict()
+
+    def evict(self):
+        """
+        Delete the least recently used outputs until the cache does not
+        exceed its size.
+        """
+        if self.size <= self.max_size:
+            return
+        for key, (_, size) in sorted(self.entries.items(), key=lambda e: e[1]):
+            if self.size <= self.max_size:
+                break
+            try:
+                os.unlink(self.path(key))
+            except FileNotFoundError:
+                pass
+            del self.entries[key]
+            self.size -= size
+
+    def log(self, event):
+        """
+        Log a cache event together with the cache statistics.
+        """
+        logging.info(
+            'Result cache %s (%d hits, %d misses, %d outputs, %d bytes).',
+            event, self.hits, self.misses, len(self.entries), self.size)
+
+
+async def prewarm(sentences, request, config, result_cache, jobs=1,
+        routing_table=None):
+    """
+    Process every sentence of an iterable of sentences as the given request
+    template would and cache the outputs in result_cache. At most jobs sentences are
+    processed at the same time. The processors are looked up in
+    routing_table (see json_interface.process).
+
+    Returns the number of sentences that could not be processed.
+    """
+    daemons = DaemonManager(config.get('processors', []), interval=0)
+    await daemons.start()
+    semaphore = asyncio.Semaphore(jobs)
+    failures = 0
+
+    async def process_sentence(sentence):
+        nonlocal failures
+        async with semaphore:
+            try:
+                await process(dict(request, process=sentence), config,
+                    daemons, routing_table, result_cache)
+            except ValueError as e:
+                failures += 1
+                logging.warning('Cannot process %r: %s', sentence, e)
+
+    try:
+        await asyncio.gather(*(
+            process_sentence(sentence) for sentence in sentences
+            ))
+    finally:
+        await daemons.stop()
+    return failures
+
+
+def main():
+    desc = 'Fill the processor result cache by processing a corpus.'
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument(
+        'corpus',
+        type=str,
+        help='File containing one sentence per line.')
+    parser.add_argument(
+        '-s',
+        '--source_format',
+        required=False,
+        type=str,
+        default='raw',
+        help='Format of the sentences.')
+    parser.add_argument(
+        '-t',
+        '--target_format',
+        required=False,
+        type=str,
+        help='Format to process the sentences into (default: default_format).')
+    parser.add_argument(
+        '-j',
+        '--jobs',
+        required=False,
+        type=int,
+        default=1,
+        help='Number of sentences processed at the same time.')
+    parser.add_argument(
+        '-c',
+        '--configfile',
+        required=False,
+        type=str,
+        default=os.path.join(os.environ['HOME'], '.aas-server.json'),
+        help='Name of the config file.')
+    args = parser.parse_args()
+
+    config = json.load(open(args.configfile))
+    if not config.get('result_cache_dir') or not config.get('result_cache_size'):
+        sys.exit('No result cache configured in {}.'.format(args.configfile))
+    logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.INFO)
+
+    routing_table = RoutingTable(
+        config.get('processors', []), config.get('format_aliases'))
+    result_cache = ResultCache(
+        config['result_cache_dir'], config['result_cache_size'])
+    request = {'type': 'request', 'source_format': args.source_format}
+    if args.target_format:
+        request['target_format'] = args.target_format
+    with open(args.corpus) as corpus:
+        sentences = [line.strip() for line in corpus if line.strip()]
+
+    loop = asyncio.get_event_loop()
+    failures = loop.run_until_complete(
+        prewarm(sentences, request, config, result_cache, args.jobs,
+            routing_table))
+    loop.close()
+    logging.info('Processed %d sentences (%d failures).',
+        len(sentences), failures)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+"""
+This module finds the processor pipelines the server uses for transforming
+data in one format into another format. The processors of the config are
+compiled into a graph of formats once and the cheapest pipeline for every
+pair of formats is computed in advance, so that finding the pipeline for a
+request is a dict lookup.
+"""
+
+import heapq
+import logging
+
+
+def resolve_format(format_name, format_aliases):
+    """
+    Return the name of the format format_name refers to.
+    """
+    return format_aliases.get(format_name, format_name)
+
+
+class RoutingTable(object):
+    """
+    The cheapest processor pipelines between all formats connected by
+    processors. The cost of a processor is given by its optional 'cost'
+    value (default: 1), so without costs the pipelines with the fewest
+    processors are chosen. Of several equally cheap pipelines, the one
+    whose processors come first in the config is chosen.
+    """
+
+    def __init__(self, processors, format_aliases=None):
+        """
+        Compute the pipelines for a list of processor dicts. Formats are
+        resolved using the dict format_aliases.
+        """
+        self.format_aliases = format_aliases or {}
+        self.edges = dict()
+        for order, processor in enumerate(processors):
+            source = resolve_format(processor['source_format'], self.format_aliases)
+            target = resolve_format(processor['target_format'], self.format_aliases)
+            cost = processor.get('cost', 1)
+            if cost < 0:
+                msg = 'Processor {} has a negative cost.'
+                raise ValueError(msg.format(processor.get('name', order)))
+            self.edges.setdefault(source, []).append((cost, order, target, processor))
+
+        self.routes = dict()
+        for source in self.edges:
+            self.routes.update(self.find_routes(source))
+
+    def find_routes(self, source):
+        """
+        Return a dict mapping (source, target) to the cheapest pipeline from
+        source to target for every target reachable from source (Dijkstra's
+        algorithm).
+        """
+        routes = dict()
+        # Entries are (cost, orders of the processors, target, pipeline), so
+        # that ties are broken by the order of the processors in the config.
+        queue = [(0, (), source, ())]
+        while queue:
+            cost, orders, target, pipeline = heapq.heappop(queue)
+            if (source, target) in routes:
+                continue
+            if pipeline:
+                routes[(source, target)] = pipeline
+            for edge_cost, order, next_target, processor in self.edges.get(target, []):
+                if (source, next_target) not in routes and next_target != source:
+                    heapq.heappush(queue, (
+                        cost + edge_cost,
+                        orders + (order,),
+                        next_target,
+                        pipeline + (processor,)
+                        ))
+        return routes
+
+    def __contains__(self, pair):
+        source, target = pair
+        return self.lookup(source, target) is not None
+
+    def lookup(self, source_format, target_format):
+        """
+        Return a tuple of processors transforming source_format into
+        target_format or None if there is no such pipeline.
+        """
+        return self.routes.get((
+            resolve_format(source_format, self.format_aliases),
+            resolve_format(target_format, self.format_aliases)
+            ))
+
+    def unreachable(self, target_formats):
+        """
+        Return a sorted list of the (source, target) pairs for which there
+        is no pipeline, where source is any format processors accept and
+        target is any of the given formats.
+        """
+        targets = {
+            resolve_format(target, self.format_aliases)
+            for target in target_formats
+            }
+        return sorted(
+            (source, target)
+            for source in self.edges
+            for target in targets
+            if source != target and (source, target) not in self.routes
+            )
+
+    def log(self, target_formats):
+        """
+        Log the number of pipelines and the pairs of formats without a
+        pipeline.
+        """
+        logging.info('Found %d processor pipelines.', len(self.routes))
+        for source, target in self.unreachable(target_formats):
+            logging.warning('No processor pipeline from %s to %s.', source, target)
@@ -8,6 +8,7 @@ module and a client wishing to use the tree module for help with annotating.
 
 import argparse
 import asyncio
+from collections import deque
 import json
 import logging
 import socket
@@ -15,33 +16,42 @@ import os
 
 # aas_server modules
 import tree
+from daemons import DaemonManager
+from forest_cache import ForestCache
+from forest_store import ForestStore
+from framing import (
+    DEFAULT_MAX_MESSAGE_SIZE,
+    FramingError,
+    MessageBuffer,
+    pack_message
+    )
+from message_codec import COMPRESSIONS, ENCODINGS, MessageCodec, choose
+from result_cache import ResultCache
+from routing import RoutingTable
+from speculation import Speculation, SpeculationStats
+from worker_pool import QueueFullError, WorkerPool
 from json_interface import (
+    create_decision_tree,
     create_error,
+    create_handshake,
     create_question_or_solution,
     create_solution,
     create_forest,
+    create_processed_batch,
+    create_processed_forest,
+    create_queued,
+    forest_from_string,
     Recommendation,
     SolutionType
     )
 
-def encode_message(message):
-    """
-    Prepare a message for being sent. This includes converting to json.
-    """
-    return json.dumps(message).encode()
-
-def decode_message(bytestring):
-    """
-    Read a sent bytestring in as a json object.
-    """
-    return json.loads(bytestring.decode())
-
-def pack_message(bytestring):
+def is_valid_request_id(request_id):
     """
-    Prefix a bytestring by its length and a null byte. This prefix is
-    used after sending to extract the message at the receiving side.
+    Check whether a value may be used as the id of a message, i.e. whether
+    it is None (no id), a string or an integer.
     """
-    return str(len(bytestring)).encode() + b'\0' + bytestring
+    return (request_id is None or isinstance(request_id, str)
+        or (isinstance(request_id, int) and not isinstance(request_id, bool)))
 
 class AnnotationHelperProtocol(asyncio.Protocol):
     """
@@ -49,38 +59,42 @@ class AnnotationHelperProtocol(asyncio.Protocol):
     The client will request
     """
 
-    def __init__(self, config, forest=None):
+    def __init__(self, config, forest=None, forest_store=None,
+            forest_cache=None, worker_pool=None, daemons=None,
+            routing_table=None, result_cache=None, speculation_stats=None):
         """
-        Initialize the protocol object with the config dict.
+        Initialize the protocol object with the config dict and optionally
+        a forest_store.ForestStore, a forest_cache.ForestCache, a
+        worker_pool.WorkerPool, a daemons.DaemonManager, a
+        routing.RoutingTable, a result_cache.ResultCache and a
+        speculation.SpeculationStats shared by all connections. Responses
+        to answers are only computed speculatively if speculation_stats is
+        given.
         """
         self.config = config
         self.forest = forest
-        self.message_buffer = b''
-
-    def get_message(self):
-        """
-        Read a complete binary message from a message buffer. The
-        message is stripped of its length indicator and only the 'payload'
-        is returned.
-        """
-        separator_index = self.message_buffer.index(0)
-        message_length_part = self.message_buffer[0:separator_index]
-        try:
-            message_length = int(message_length_part.decode())
-        except ValueError as e:
-            logging.warning('Invalid message length: %s', message_length_part)
-            return None
-
-        if len(self.message_buffer) > message_length + separator_index:
-            # Entire message is in buffer and ready to be read.
-            inclusive_start = separator_index + 1
-            exclusive_end = separator_index + 1 + message_length
-            binary_message = self.message_buffer[inclusive_start:exclusive_end]
-            self.message_buffer = self.message_buffer[exclusive_end:]
-            return binary_message
-        else:
-            # Message is not ready to be read. We cannot return a message.
-            return None
+        self.forest_store = forest_store
+        self.forest_cache = forest_cache
+        self.worker_pool = worker_pool
+        self.daemons = daemons
+        self.routing_table = routing_table
+        self.result_cache = result_cache
+        self.speculation_stats = speculation_stats
+        self.speculation = None
+        self.batch = None
+        self.batch_format = None
+        self.batch_index = 0
+        self.message_buffer = MessageBuffer(
+            config.get('max_message_size', DEFAULT_MAX_MESSAGE_SIZE))
+        self.codec = MessageCodec(
+            max_message_size=config.get('max_message_size', DEFAULT_MAX_MESSAGE_SIZE))
+        # Codec chosen by a handshake; it is used after the response to the
+        # handshake has been sent.
+        self.next_codec = None
+        self.first_message = True
+        self.waiting_messages = deque()
+        self.pending = None
+        self.pending_id = None
 
     def connection_made(self, transport):
         """
@@ -96,15 +110,187 @@ class AnnotationHelperProtocol(asyncio.Protocol):
         Use received data to update the forest object and send a response to
         the client to prompt them for further action.
         """
-        self.message_buffer += data
-        logging.debug('Received %s from %s.', data, self.peername)
-        binary_message = self.get_message()
-        if binary_message:
-            message = decode_message(binary_message)
-            logging.info('Read message %s from %s.', message, self.peername)
-            binary_response = encode_message(self.interpret_message(message))
-            self.transport.write(pack_message(binary_response))
-            logging.debug('Sent %s to %s.', binary_response, self.peername)
+        logging.debug('Received %d bytes from %s.', len(data), self.peername)
+        try:
+            binary_messages = self.message_buffer.feed(data)
+        except FramingError as e:
+            # The following bytes cannot be split into messages any more.
+            logging.warning('Framing error with %s: %s', self.peername, e)
+            self.send_response(create_error(str(e)))
+            self.transport.close()
+            return
+        if binary_messages:
+            self.waiting_messages.extend(binary_messages)
+            self.handle_waiting_messages()
+
+    def handle_waiting_messages(self):
+        """
+        Interpret the received messages in order. If interpreting a message
+        requires waiting (e.g. for processors), the following messages are
+        only interpreted after its response has been sent, so clients may
+        send several messages without waiting for the responses.
+        """
+        while self.waiting_messages and self.pending is None:
+            binary_message = self.waiting_messages.popleft()
+            request_id, response = self.interpret_binary_message(binary_message)
+            if asyncio.iscoroutine(response):
+                self.pending = asyncio.ensure_future(response)
+                self.pending_id = request_id
+                self.pending.add_done_callback(self.finish_pending)
+            else:
+                self.send_response(response, request_id)
+
+    def finish_pending(self, future):
+        """
+        Send the response of a finished coroutine and continue with the
+        waiting messages. If the coroutine failed, the client is sent an
+        error instead.
+        """
+        self.pending = None
+        request_id, self.pending_id = self.pending_id, None
+        if future.cancelled():
+            return
+        exception = future.exception()
+        if exception is not None:
+            logging.error('Request from %s failed.', self.peername,
+                exc_info=exception)
+            response = create_error(
+                'Internal server error. ({!r})'.format(exception))
+        else:
+            response = future.result()
+        self.send_response(response, request_id)
+        self.handle_waiting_messages()
+
+    def send_response(self, response, request_id=None):
+        """
+        Encode a response and send it to the client. If the message the
+        response belongs to had an id, the response is tagged with it.
+        """
+        if self.transport.is_closing():
+            return
+        if request_id is not None:
+            response['id'] = request_id
+        binary_response = self.codec.encode(response)
+        if self.next_codec is not None:
+            self.codec, self.next_codec = self.next_codec, None
+        self.transport.write(pack_message(binary_response))
+        logging.debug('Sent %d bytes to %s.', len(binary_response), self.peername)
+        if (response['type'] == 'question' and not self.waiting_messages
+                and 'decision_tree' not in response):
+            self.start_speculation(response['question'])
+
+    def start_speculation(self, question):
+        """
+        Start computing the responses to both answers to a question about
+        the current forest while the client is busy answering it.
+        """
+        if self.speculation_stats is None:
+            return
+        self.speculation = Speculation(
+            self.forest, question, asyncio.get_event_loop())
+
+    def take_speculation(self, data):
+        """
+        Return the speculatively computed (forest, response) pair for an
+        answer message or None if there is none. Messages other than
+        answers discard the speculation.
+        """
+        speculation, self.speculation = self.speculation, None
+        if speculation is None:
+            return None
+        if data.get('type') != 'answer':
+            speculation.cancel()
+            self.speculation_stats.record('discarded')
+            return None
+        result = speculation.take(data['question'], data['answer'])
+        self.speculation_stats.record('miss' if result is None else 'hit')
+        return result
+
+    def interpret_binary_message(self, binary_message):
+        """
+        Decode a received message and interpret it (see interpret_message).
+        Return a (request id, response) pair, where the request id is None
+        if the message does not have an id. Messages that cannot be decoded
+        are answered by an error.
+        """
+        try:
+            message = self.codec.decode(binary_message)
+        except ValueError as e:
+            logging.info('Undecodable message from %s.', self.peername)
+            return None, create_error('Cannot decode message. ({})'.format(e))
+        if not isinstance(message, dict):
+            return None, create_error('A message has to be a json object.')
+        logging.info('Read message %s from %s.', message, self.peername)
+        first_message, self.first_message = self.first_message, False
+        request_id = message.get('id')
+        if not is_valid_request_id(request_id):
+            logging.info('Invalid-id error with %s.', self.peername)
+            msg = 'A message id has to be a string or an integer.'
+            return None, create_error(msg)
+        if message.get('type') == 'handshake':
+            return request_id, self.handshake(message, first_message)
+        response = self.interpret_message(message)
+        if 'decision_tree' in message:
+            response = self.add_decision_tree(response, message['decision_tree'])
+        return request_id, response
+
+    def handshake(self, message, first_message):
+        """
+        Choose the encoding and compression of the following messages from
+        the ones offered by the client in the pairs 'encodings' and
+        'compressions' of a handshake message (see message_codec) and
+        return the handshake response naming them. The codec is used after
+        the response has been sent. Only the first message of a connection
+        may be a handshake.
+        """
+        if not first_message:
+            logging.info('Late-handshake error with %s.', self.peername)
+            return create_error('A handshake has to be the first message.')
+        try:
+            encoding = choose(message.get('encodings', ['json']), ENCODINGS)
+            compression = choose(message.get('compressions', []), COMPRESSIONS)
+        except ValueError as e:
+            logging.info('Handshake error with %s.', self.peername)
+            return create_error(str(e))
+        self.next_codec = MessageCodec(encoding or 'json', compression,
+            self.config.get('max_message_size', DEFAULT_MAX_MESSAGE_SIZE))
+        logging.info('Using encoding %s and compression %s with %s.',
+            self.next_codec.encoding, compression, self.peername)
+        return create_handshake(self.next_codec.encoding, compression)
+
+    def add_decision_tree(self, response, options):
+        """
+        Add a decision tree compiled from the current forest (see
+        json_interface.create_decision_tree) to a question response. The
+        options object may limit the depth ('max_depth') and the number of
+        nodes ('max_nodes') of the tree; the number of nodes is capped by
+        the 'max_decision_tree_nodes' key of the config.
+        """
+        if asyncio.iscoroutine(response):
+            return self.add_decision_tree_later(response, options)
+        if response['type'] != 'question':
+            return response
+        if not isinstance(options, dict):
+            return create_error('The decision_tree options have to be an object.')
+        max_depth = options.get('max_depth', 8)
+        max_nodes = options.get('max_nodes', 255)
+        if not all(isinstance(value, int) and value >= 0
+                for value in (max_depth, max_nodes)):
+            msg = 'max_depth and max_nodes have to be non-negative integers.'
+            return create_error(msg)
+        max_nodes = min(max_nodes, self.config.get('max_decision_tree_nodes', 1023))
+        response['decision_tree'] = create_decision_tree(
+            self.forest, max_depth, max(max_nodes, 1))
+        logging.info('Sent decision tree with %d nodes to %s.',
+            len(response['decision_tree']['nodes']), self.peername)
+        return response
+
+    async def add_decision_tree_later(self, coroutine, options):
+        """
+        Wait for the response created by a coroutine and add a decision
+        tree to it (see add_decision_tree).
+        """
+        return self.add_decision_tree(await coroutine, options)
 
     def interpret_message(self, data):
         """
@@ -126,14 +312,25 @@ class AnnotationHelperProtocol(asyncio.Protocol):
         """
 
         response = {}
+        speculated = self.take_speculation(data)
         if 'type' not in data:
             response = create_error('No message type') #-> sends response back to client
             logging.info('No-message-type error with %s.', self.peername) #-> logging
 
         #1
+        elif data['type'] == 'request' and 'process' in data:
+            # Processing takes a while, so the response is created by a
+            # coroutine.
+            return self.process_request(data)
+
+        elif data['type'] == 'request' and 'process_batch' in data:
+            return self.process_batch_request(data)
+
         elif data['type'] == 'request':
             try:
-                self.forest = create_forest(data, self.config)
+                self.forest = create_forest(data, self.config,
+                    self.forest_store, self.forest_cache)
+                self.batch = None
             except ValueError as e:
                 msg = 'Cannot create forest. ({})'.format(e)
                 response = create_error(msg)
@@ -154,6 +351,8 @@ class AnnotationHelperProtocol(asyncio.Protocol):
                 error_messsage = 'Create a forest before answering questions.'
                 response = create_error(error_messsage)
                 logging.info('No-forest error with %s.', self.peername)
+            elif speculated is not None:
+                self.forest, response = speculated
             else:
                 self.forest.filter(data['question'], data['answer']) #filter???
                 response = create_question_or_solution(self.forest)    #keep asking questions
@@ -167,6 +366,15 @@ class AnnotationHelperProtocol(asyncio.Protocol):
         elif data['type'] == 'abort':
             response = create_solution(self.forest)
 
+        elif data['type'] == 'next':
+            if self.batch is None:
+                response = create_error('Send a batch request before asking for the next sentence.')
+                logging.info('No-batch error with %s.', self.peername)
+            elif self.batch_index + 1 >= len(self.batch):
+                response = create_error('There are no more sentences in the batch.')
+            else:
+                response = self.open_batch_forest(self.batch_index + 1)
+
         #5
         else:
             response = create_error(
@@ -176,11 +384,95 @@ class AnnotationHelperProtocol(asyncio.Protocol):
 
         return response
 
+    async def process_request(self, data):
+        """
+        Create a forest by processing the sentence in a request and return
+        the response to the request.
+        """
+        try:
+            self.forest = await create_processed_forest(
+                data, self.config, self.worker_pool, self.send_queued,
+                self.daemons, self.routing_table, self.result_cache)
+            self.batch = None
+        except QueueFullError as e:
+            msg = 'Cannot create forest. ({})'.format(e)
+            logging.info('Queue-full error with %s.', self.peername)
+            return create_error(msg, Recommendation.retry)
+        except ValueError as e:
+            msg = 'Cannot create forest. ({})'.format(e)
+            logging.info('Cannot-create-forest error with %s.', self.peername)
+            return create_error(msg)
+        except Exception as e:
+            msg = 'Cannot create forest. ({})'.format(e)
+            response = create_error(msg)
+            msg = 'Unexpected exception: {} with %s'.format(e)
+            logging.error(msg, self.peername)
+            return response
+
+        return create_question_or_solution(self.forest)
+
+    async def process_batch_request(self, data):
+        """
+        Process all sentences of a batch request at once and return the
+        response for the first sentence. The following sentences are
+        requested by next messages.
+        """
+        try:
+            self.batch, self.batch_format = await create_processed_batch(
+                data, self.config, self.worker_pool, self.send_queued,
+                self.daemons, self.routing_table, self.result_cache)
+        except QueueFullError as e:
+            msg = 'Cannot create forest. ({})'.format(e)
+            logging.info('Queue-full error with %s.', self.peername)
+            return create_error(msg, Recommendation.retry)
+        except ValueError as e:
+            msg = 'Cannot create forest. ({})'.format(e)
+            logging.info('Cannot-create-forest error with %s.', self.peername)
+            return create_error(msg)
+        except Exception as e:
+            msg = 'Cannot create forest. ({})'.format(e)
+            response = create_error(msg)
+            msg = 'Unexpected exception: {} with %s'.format(e)
+            logging.error(msg, self.peername)
+            return response
+
+        logging.info('Processed batch of %d sentences for %s.',
+            len(self.batch), self.peername)
+        return self.open_batch_forest(0)
+
+    def open_batch_forest(self, index):
+        """
+        Create the forest of the sentence with the given index in the batch
+        and return the response for it.
+        """
+        self.batch_index = index
+        try:
+            self.forest = forest_from_string(
+                self.batch[index], self.batch_format, self.config)
+        except (ValueError, IndexError, KeyError) as e:
+            msg = 'Cannot create forest for sentence {} of the batch. ({})'
+            logging.info('Cannot-create-forest error with %s.', self.peername)
+            return create_error(msg.format(index + 1, e))
+        response = create_question_or_solution(self.forest)
+        response['batch_index'] = index
+        response['batch_size'] = len(self.batch)
+        return response
+
+    def send_queued(self, position):
+        """
+        Tell the client that its request waits for a free worker.
+        """
+        self.send_response(create_queued(position), self.pending_id)
+
     def connection_lost(self, exc):
         """
         Log when a connection is terminated.
         """
         logging.info('Connection to %s lost.', self.peername)
+        if self.pending is not None:
+            self.pending.cancel()
+        if self.speculation is not None:
+            self.speculation.cancel()
 
 
 def setup_logging(logfile, loglevel):
@@ -279,6 +571,19 @@ def main():
         'loglevel': 'INFO',
         'formats': {},
         'format_aliases': {},
+        'forest_backend': 'plain',
+        'share_tokens': False,
+        'deduplicate_trees': False,
+        'max_trees': 0,
+        'forest_cache_size': 0,
+        'max_processes': 2,
+        'max_queued_processes': 10,
+        'process_timeout': 300,
+        'daemon_check_interval': 60,
+        'result_cache_size': 0,
+        'max_message_size': DEFAULT_MAX_MESSAGE_SIZE,
+        'speculate_answers': False,
+        'max_decision_tree_nodes': 1023,
         'configfile': os.path.join(os.environ['HOME'], '.aas-server.json')
         }
 
@@ -305,9 +610,51 @@ def main():
         logging.debug(
             'Bound incoming tcp socket to %s:%s.', config['host'], config['port'])
 
+    forest_store = None
+    if config.get('forest_store'):
+        forest_store = ForestStore(config['forest_store'])
+        logging.info('Opened forest store %s containing %d forests.',
+            config['forest_store'], len(forest_store))
+
+    forest_cache = None
+    if config['forest_cache_size'] > 0:
+        forest_cache = ForestCache(config['forest_cache_size'])
+
+    routing_table = RoutingTable(
+        config.get('processors', []), config['format_aliases'])
+    routing_table.log(config['formats'])
+
+    result_cache = None
+    if config['result_cache_size'] > 0 and config.get('result_cache_dir'):
+        result_cache = ResultCache(
+            config['result_cache_dir'], config['result_cache_size'])
+        logging.info('Opened result cache %s containing %d outputs.',
+            config['result_cache_dir'], len(result_cache))
+
+    speculation_stats = None
+    if config['speculate_answers']:
+        speculation_stats = SpeculationStats()
+
+    worker_pool = WorkerPool(
+        config['max_processes'],
+        config['max_queued_processes'],
+        config['process_timeout'] or None
+        )
+
     loop = asyncio.get_event_loop()
+    daemons = DaemonManager(
+        config.get('processors', []),
+        config['daemon_check_interval'],
+        config['process_timeout'] or None
+        )
+    loop.run_until_complete(daemons.start())
+
     coro = loop.create_server(
-        lambda : AnnotationHelperProtocol(config),
+        lambda : AnnotationHelperProtocol(config,
+            forest_store=forest_store, forest_cache=forest_cache,
+            worker_pool=worker_pool, daemons=daemons,
+            routing_table=routing_table, result_cache=result_cache,
+            speculation_stats=speculation_stats),
         sock=incoming_socket
         )
     server = loop.run_until_complete(coro)
@@ -324,7 +671,10 @@ def main():
     server.close()
     logging.info('Closed server.')
     loop.run_until_complete(server.wait_closed())
+    loop.run_until_complete(daemons.stop())
     loop.close()
+    if forest_store is not None:
+        forest_store.close()
     logging.debug('Terminating application.')
 
 if __name__ == '__main__':
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+"""
+This module provides the speculative computation of responses: while the
+annotator reads a question, the server filters copies of the forest by
+both possible answers and creates the following question or solution for
+each of them, so the response to the answer can be sent at once.
+
+The computation runs in callbacks on the event loop, one per answer. The
+callbacks are scheduled as timers without delay, which the event loop only
+runs after handling the data received in the meantime, so an answer that
+arrives early waits for at most one of them and messages of other
+connections are interleaved with them.
+"""
+
+import logging
+
+from json_interface import create_question_or_solution
+
+
+def question_tuple(question):
+    """
+    Return the (dependent, head, relation) tuple a question object asks
+    about.
+    """
+    return (question['dependent'], question['head'], question['relation'])
+
+
+class SpeculationStats(object):
+    """
+    Counts how often a speculatively computed response could be used
+    (hits), how often an answer arrived before its response had been
+    computed or did not answer the speculated question (misses) and how
+    often a speculation was discarded because the client sent a message
+    other than an answer.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.discarded = 0
+
+    def record(self, event):
+        """
+        Count an event ('hit', 'miss' or 'discarded') and log it together
+        with the statistics.
+        """
+        if event == 'hit':
+            self.hits += 1
+        elif event == 'miss':
+            self.misses += 1
+        else:
+            self.discarded += 1
+        logging.info(
+            'Speculation %s (%d hits, %d misses, %d discarded).',
+            event, self.hits, self.misses, self.discarded)
+
+
+class Speculation(object):
+    """
+    The responses to both answers to a question, computed in the
+    background.
+    """
+
+    def __init__(self, forest, question, loop):
+        """
+        Schedule the computation of the responses to the answers to
+        question (a question object asked about forest) on the event loop.
+        The forest itself is not changed.
+        """
+        self.question = question
+        self.results = dict()
+        self.loop = loop
+        self.handle = loop.call_later(
+            0, self._compute, forest.copy(), [True, False])
+
+    def _compute(self, forest, answers):
+        """
+        Filter a copy of the forest by the first of the remaining answers,
+        create the response and schedule the next answer.
+        """
+        answer = answers.pop(0)
+        if answers:
+            self.handle = self.loop.call_later(0, self._compute, forest, answers)
+        branch = forest.copy()
+        try:
+            branch.filter(self.question, answer)
+            response = create_question_or_solution(branch)
+        except Exception as e:
+            # The response is created again when the answer arrives.
+            logging.debug('Speculation failed: %s', e)
+            return
+        self.results[answer] = (branch, response)
+
+    def cancel(self):
+        """
+        Stop computing responses that have not been computed yet.
+        """
+        self.handle.cancel()
+
+    def take(self, question, answer):
+        """
+        Return the (forest, response) pair computed for an answer to
+        question or None if it has not been computed. The speculation is
+        cancelled afterwards.
+        """
+        self.cancel()
+        if question_tuple(question) != question_tuple(self.question):
+            return None
+        return self.results.get(answer)
@@ -5,9 +5,28 @@ one parse tree remains.
 '''
 
 from collections import Counter
+import copy
+import heapq
+import io
+import math
 from subprocess import call
 import sys
 import re
+import time
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Comment preceding a tree in a forest file that gives the score the parser
+# assigned to the tree, e.g. '# score = -12.5'.
+SCORE_COMMENT = re.compile(r'^#\s*score\s*=\s*(\S+)\s*$')
+
+# Strategies for choosing questions: 'halve' asks about the triple
+# contained in half of the remaining trees, 'score' asks about the triple
+# contained in trees making up half of the remaining probability mass.
+QUESTION_STRATEGIES = ('halve', 'score')
 
 class Tree(object):
     '''
@@ -15,6 +34,14 @@ class Tree(object):
     to work with it.
     '''
 
+    # The number of trees of the parser output this tree stands for, if
+    # identical trees have been collapsed (see prune_trees).
+    multiplicity = 1
+
+    # The score the parser assigned to the tree (a log-probability up to a
+    # constant) or None if it is unknown.
+    score = None
+
     def __init__(self, format_info=None, id_=0, form=1, head=None, rel=None,
             rel_type=None): #needs to specify the index of fields due to different formats, later in config file
         '''
@@ -62,6 +89,17 @@ class Tree(object):
 
         return tree
 
+    @classmethod
+    def from_lines(cls, lines, **kwargs):
+        '''
+        Initialize a tree object from a list of conll lines that contains
+        neither empty lines nor comments.
+        '''
+        tree = cls(**kwargs)
+        for line in lines:
+            tree.add(line)
+        return tree
+
     def add(self, conll_line):
         '''
         Gets a CONLL-Line, splits it and then converts it into a tuple to
@@ -90,7 +128,7 @@ class Tree(object):
 
     def get(self):
         '''
-        Gets a list of 3-tuples from the list containing the CONLL-tuples.
+        Gets a set of 3-tuples from the list containing the CONLL-tuples.
         '''
         #print(self.dictio)
 
@@ -100,16 +138,23 @@ class Tree(object):
 
         """
         if self.tuples is not None: return self.tuples
+        self.tuples = set(self.get_ordered())
+        return self.tuples
+
+    def get_ordered(self):
+        '''
+        Gets a list of 3-tuples from the list containing the CONLL-tuples in
+        the order of the nodes they belong to.
+        '''
         #TODO: try except KeyError return ErrorMessage: indicated format and file format doesn't match
-        self.tuples={(self.dictio[x[0]]+"-"+x[0], #Look up the index
+        return [(self.dictio[x[0]]+"-"+x[0], #Look up the index
                  #in the dictionary, take the word and add the
                  #the index to the word.
                  self.dictio[x[self.head]]+"-"+x[self.head] if x[self.head] != "0" else "Root-0",
                  #Look up the index of the target word in the dictionary
                  #take the word and add the index to it.
-                 x[self.rel]) for x in self.nodes}
+                 x[self.rel]) for x in self.nodes]
                  #Last element of the tuple is the relation type.
-        return self.tuples
 
     def to_conll(self):
         '''
@@ -147,11 +192,590 @@ class Tree(object):
     def as_dict(self):
         return {'nodes': self.nodes}
 
+class TokenTable(object):
+    '''
+    The columns shared by all trees of an n-best forest. The table is
+    created from the first tree of the forest and is used to create
+    SharedTokenTree objects that store only their head and relation
+    columns.
+    '''
+
+    def __init__(self, template):
+        '''
+        Initialize the table from a complete Tree object.
+        '''
+        self.template = template
+        self.rows = template.nodes
+        self.masked = []
+        for row in self.rows:
+            masked = list(row)
+            masked[template.head] = masked[template.rel] = ''
+            self.masked.append(masked)
+        self.labels = [
+            template.dictio[row[template.id]] + '-' + row[template.id]
+            for row in self.rows
+            ]
+        self.strings = dict()
+
+    def tree_from_lines(self, lines):
+        '''
+        Create a tree from a list of conll lines that contains neither empty
+        lines nor comments. If the tree only differs from the table in its
+        head and relation columns, a SharedTokenTree is returned.
+        Otherwise, a complete Tree is created.
+        '''
+        if len(lines) == len(self.masked):
+            head, rel = self.template.head, self.template.rel
+            heads, rels = [], []
+            for line, masked in zip(lines, self.masked):
+                parts = line.split('\t')
+                if len(parts) != len(masked):
+                    break
+                head_value, rel_value = parts[head], parts[rel]
+                parts[head] = parts[rel] = ''
+                if parts != masked:
+                    break
+                heads.append(self.strings.setdefault(head_value, head_value))
+                rels.append(self.strings.setdefault(rel_value, rel_value))
+            else:
+                return SharedTokenTree(self, tuple(heads), tuple(rels))
+        tree = copy.copy(self.template)
+        tree.nodes = []
+        tree.dictio = dict()
+        tree.tuples = None
+        for line in lines:
+            tree.add(line)
+        return tree
+
+class SharedTokenTree(Tree):
+    '''
+    A tree of an n-best forest that stores only its head and relation
+    columns. All other columns are looked up in a TokenTable shared by
+    the trees of the forest and complete CONLL rows are only created
+    when the nodes are accessed.
+    '''
+
+    def __init__(self, table, heads, rels):
+        '''
+        Initialize the tree from a TokenTable and the values of its head
+        and relation columns.
+        '''
+        template = table.template
+        self.format = template.format
+        self.id = template.id
+        self.form = template.form
+        self.head = template.head
+        self.rel = template.rel
+        self.rel_type = template.rel_type
+        self.dictio = template.dictio
+        self.tuples = None
+        self.table = table
+        self.heads = heads
+        self.rels = rels
+
+    @property
+    def nodes(self):
+        '''
+        The complete CONLL rows of the tree.
+        '''
+        nodes = []
+        for row, head_value, rel_value in zip(
+                self.table.rows, self.heads, self.rels):
+            node = list(row)
+            node[self.head] = head_value
+            node[self.rel] = rel_value
+            nodes.append(tuple(node))
+        return nodes
+
+    def get_ordered(self):
+        '''
+        Gets a list of 3-tuples in the order of the nodes they belong to.
+        '''
+        labels = self.table.labels
+        return [
+            (label,
+             self.dictio[head_value] + '-' + head_value
+             if head_value != '0' else 'Root-0',
+             rel_value)
+            for label, head_value, rel_value
+            in zip(labels, self.heads, self.rels)
+            ]
+
+class ForestReader(object):
+    '''
+    Incremental reader that turns conll lines into trees. Lines are fed one
+    at a time and a tree is returned as soon as the empty line following it
+    has been read, so a forest can be built while it is still being read
+    from a file or a stream.
+    '''
+
+    def __init__(self, share_tokens=False, **tree_kwargs):
+        '''
+        Initialize the reader. If share_tokens is True, the trees following
+        the first tree share its token columns (see TokenTable).
+        '''
+        self.share_tokens = share_tokens
+        self.tree_kwargs = tree_kwargs
+        self.table = None
+        self.block = []
+        self.score = None
+
+    def feed(self, line):
+        '''
+        Feed a line (str or bytes) to the reader. Returns the completed tree
+        if the line ends one and None otherwise.
+        '''
+        if isinstance(line, bytes):
+            line = line.decode()
+        line = line.strip()
+        if not line:
+            return self.close()
+        if not line.startswith('#'):
+            self.block.append(line)
+        else:
+            match = SCORE_COMMENT.match(line)
+            if match:
+                try:
+                    self.score = float(match.group(1))
+                except ValueError as e:
+                    msg = 'Invalid score comment: {}'.format(line)
+                    raise ValueError(msg) from e
+        return None
+
+    def close(self):
+        '''
+        Finish the tree that is currently being read and return it. If no
+        lines have been read since the last tree, None is returned.
+
+        If share_tokens is True, the first tree is returned as a
+        SharedTokenTree of the table created from it as well, so all trees
+        sharing the token columns have the same table.
+        '''
+        if not self.block:
+            return None
+        lines, self.block = self.block, []
+        if self.table is not None:
+            tree = self.table.tree_from_lines(lines)
+        else:
+            tree = Tree.from_lines(lines, **self.tree_kwargs)
+            if self.share_tokens:
+                self.table = TokenTable(tree)
+                tree = self.table.tree_from_lines(lines)
+        if self.score is not None:
+            tree.score = self.score
+            self.score = None
+        return tree
+
+def iter_trees(lines, share_tokens=False, **tree_kwargs):
+    '''
+    Generate the trees contained in an iterable of conll lines, e.g. an
+    open file. Trees are yielded as soon as they have been read.
+    '''
+    reader = ForestReader(share_tokens=share_tokens, **tree_kwargs)
+    for line in lines:
+        tree = reader.feed(line)
+        if tree is not None:
+            yield tree
+    tree = reader.close()
+    if tree is not None:
+        yield tree
+
+def split_forests(lines):
+    '''
+    Generate the forests contained in an iterable of conll lines holding
+    several forests, e.g. the output of parsing a document. Forests are
+    separated by two or more empty lines (trees by a single one). Every
+    forest is yielded as a list of its lines.
+    '''
+    forest = []
+    empty_lines = 0
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode()
+        if line.strip():
+            if empty_lines > 1 and forest:
+                yield forest
+                forest = []
+            empty_lines = 0
+            forest.append(line)
+        else:
+            empty_lines += 1
+            if forest:
+                forest.append(line)
+    if forest:
+        yield forest
+
+def collapse_duplicates(trees):
+    '''
+    Generate the trees of an iterable of trees, collapsing trees that are
+    identical in the edges questions are asked about (dependent, head and
+    relation). Of identical trees, only the first one is generated and its
+    multiplicity is increased for every further one.
+    '''
+    seen = dict()
+    for tree in trees:
+        if _collapse_into(seen, tree):
+            yield tree
+
+def _collapse_into(seen, tree):
+    '''
+    Collapse a tree into the identical tree in the dict seen (see
+    collapse_duplicates). Returns True if there is none, i.e. if the tree
+    is the first of its kind, and adds it to seen in this case.
+    '''
+    key = tuple(tree.get_ordered())
+    first = seen.get(key)
+    if first is None:
+        seen[key] = tree
+        return True
+    first.multiplicity += 1
+    if tree.score is not None and first.score is not None:
+        # The trees are alternatives, so their probabilities add up.
+        high, low = max(first.score, tree.score), min(first.score, tree.score)
+        first.score = high + math.log1p(math.exp(low - high))
+    return False
+
+def prune_trees(trees, deduplicate=False, max_trees=0):
+    '''
+    Generate the trees of an iterable of trees, optionally collapsing
+    duplicates (see collapse_duplicates) and keeping only max_trees trees
+    (0 for no limit).
+
+    If the trees have scores, the max_trees trees with the highest scores
+    are kept. Otherwise, the trees are expected in the order of the
+    parser's ranking and the first max_trees trees are kept. The kept trees
+    are generated in their original order.
+    '''
+    if deduplicate:
+        trees = collapse_duplicates(trees)
+        if max_trees:
+            # Collapsing a later duplicate raises the score of a tree that
+            # has already been generated, so the trees are only selected
+            # once all of them have been collapsed.
+            trees = list(trees)
+    if not max_trees:
+        yield from trees
+        return
+    # A heap of the best trees found so far, the worst one on top. Of trees
+    # with the same score, the earlier one is better.
+    kept = []
+    scored = None
+    for index, tree in enumerate(trees):
+        if scored is None:
+            scored = tree.score is not None
+        score = tree.score if tree.score is not None else -math.inf
+        if len(kept) < max_trees:
+            heapq.heappush(kept, (score, -index, tree))
+        elif (score, -index) > kept[0][:2]:
+            heapq.heapreplace(kept, (score, -index, tree))
+        elif not scored:
+            # No later tree of an unscored forest can be better.
+            break
+    for _, _, tree in sorted(kept, key=lambda entry: -entry[1]):
+        yield tree
+
+# Number of decimal digits to which probabilities relative to the remaining
+# probability mass are compared when choosing questions. The backends sum up
+# the probabilities in different orders, so they only agree on the rounded
+# values.
+MASS_DIGITS = 9
+
+def relative_mass(mass, total):
+    '''
+    Return a probability mass relative to the total mass, rounded to
+    MASS_DIGITS digits.
+    '''
+    return round(mass / total, MASS_DIGITS) if total else 0.0
+
+def tree_weights(trees):
+    '''
+    Return a list of the (unnormalized) probabilities of a sequence of
+    trees. If all trees have scores, the probabilities are obtained by a
+    softmax over the scores (the score of a collapsed tree already includes
+    its duplicates). Otherwise, every tree counts as often as the parser
+    output contained it.
+    '''
+    scores = [tree.score for tree in trees]
+    if not scores or None in scores:
+        return [tree.multiplicity for tree in trees]
+    highest = max(scores)
+    return [math.exp(score - highest) for score in scores]
+
+class _OutOfTime(Exception):
+    '''
+    Raised when the time budget for choosing a question is used up.
+    '''
+
+def _check_deadline(deadline):
+    '''
+    Raise _OutOfTime if the time.perf_counter() value deadline has passed
+    (None for no deadline).
+    '''
+    if deadline is not None and time.perf_counter() > deadline:
+        raise _OutOfTime()
+
+class _BitmapSums(object):
+    '''
+    Sums of the probabilities of the trees indicated by a bitmap and of
+    their products with the binary logarithms of the probabilities. The
+    sums of every byte of a bitmap are precomputed, so a sum takes one
+    table lookup per eight trees.
+    '''
+
+    def __init__(self, weights):
+        '''
+        Initialize the sums for a list of tree probabilities. The tables
+        have to be computed by build before the sums can be used.
+        '''
+        self.weights = weights
+        self.size = (len(weights) + 7) // 8
+        self.mass_tables = []
+        self.entropy_tables = []
+
+    def build(self, deadline=None):
+        '''
+        Compute the tables that have not been computed yet. Raises
+        _OutOfTime if they are not complete at the time.perf_counter()
+        value deadline; the next call continues where this one stopped.
+        '''
+        weights = self.weights
+        for start in range(8 * len(self.mass_tables), len(weights), 8):
+            _check_deadline(deadline)
+            # Doubling the tables for every tree of the byte sets the bit of
+            # the tree in the indices of the new half.
+            masses = [0.0]
+            products = [0.0]
+            for weight in weights[start:start + 8]:
+                product = weight * math.log2(weight) if weight > 0 else 0.0
+                masses += [mass + weight for mass in masses]
+                products += [value + product for value in products]
+            self.mass_tables.append(masses)
+            self.entropy_tables.append(products)
+
+    def mass(self, bitmap):
+        '''
+        Return the sum of the probabilities of the trees in bitmap.
+        '''
+        return sum(table[byte] for table, byte
+            in zip(self.mass_tables, bitmap.to_bytes(self.size, 'little')))
+
+    def entropy(self, bitmap):
+        '''
+        Return the entropy (in bits) of the normalized probabilities of the
+        trees in bitmap.
+        '''
+        data = bitmap.to_bytes(self.size, 'little')
+        mass = sum(table[byte] for table, byte in zip(self.mass_tables, data))
+        if mass <= 0:
+            return 0.0
+        products = sum(table[byte] for table, byte
+            in zip(self.entropy_tables, data))
+        return max(math.log2(mass) - products / mass, 0.0)
+
+class _EdgeIndex(object):
+    '''
+    The index of all trees of a forest a QuestionPlanner works on: a dict
+    mapping every tuple to the bitmap of the trees containing it. Bit i
+    stands for the i-th tree, so the index stays valid while answers rule
+    out trees. It is built tree by tree, so the time budget of a question
+    may interrupt it and the next question continues it.
+    '''
+
+    def __init__(self, trees):
+        '''
+        Initialize the index for a sequence of all trees of a forest.
+        '''
+        self.trees = trees
+        self.edges = dict()
+        self.indexed = 0
+        self.sums = None
+
+    def build(self, deadline=None):
+        '''
+        Index the trees that have not been indexed yet. Raises _OutOfTime
+        if the index is not complete at the time.perf_counter() value
+        deadline.
+        '''
+        trees = self.trees
+        edges = self.edges
+        while self.indexed < len(trees):
+            _check_deadline(deadline)
+            bit = 1 << self.indexed
+            for tup in trees[self.indexed].get_ordered():
+                edges[tup] = edges.get(tup, 0) | bit
+            self.indexed += 1
+
+    def weight_sums(self, deadline=None):
+        '''
+        Return the _BitmapSums of the probabilities of the trees (see
+        tree_weights), computing them if needed. Raises _OutOfTime like
+        build.
+        '''
+        if self.sums is None:
+            self.sums = _BitmapSums(tree_weights(self.trees))
+        self.sums.build(deadline)
+        return self.sums
+
+    def live(self, answers):
+        '''
+        Return the bitmap of the trees agreeing with a list of (tuple,
+        answer) pairs.
+        '''
+        live = (1 << len(self.trees)) - 1
+        for tup, answer in answers:
+            bitmap = self.edges.get(tup, 0)
+            live = live & bitmap if answer else live & ~bitmap
+        return live
+
+class QuestionPlanner(object):
+    '''
+    Chooses questions by looking several questions ahead instead of
+    greedily halving the remaining trees.
+
+    The planner builds the decision tree of the next questions up to a
+    given depth and chooses the question minimizing the expected number of
+    questions needed to find the correct tree. Below that depth, the number
+    of questions still needed is estimated by the entropy of the remaining
+    trees, a lower bound for any strategy, so the expected numbers tend to
+    be optimistic. In every state, only the beam_width tuples that split
+    the remaining trees most evenly are considered. Sets of trees are
+    bitmaps, so a question is answered by a single AND or AND-NOT.
+
+    The depth is increased one question at a time while the time budget
+    lasts and the plan of the deepest completed search is used.
+    '''
+
+    def __init__(self, edges, sums=None, depth=2, beam_width=6, budget=0.02):
+        '''
+        Initialize the planner for a dict mapping tuples to the bitmaps of
+        the trees containing them and the _BitmapSums of the probabilities
+        of the trees (None if all trees are equally likely). The search may
+        take budget seconds from the creation of the planner (None for no
+        limit).
+        '''
+        self.edges = edges
+        self.sums = sums
+        self.depth = depth
+        self.beam_width = beam_width
+        self.deadline = None
+        if budget is not None:
+            self.deadline = time.perf_counter() + budget
+        self.memo = dict()
+
+    def _check_time(self):
+        '''
+        Raise _OutOfTime if the time budget is used up.
+        '''
+        _check_deadline(self.deadline)
+
+    def plan(self, live, greedy_tuple=None):
+        '''
+        Choose the tuple to ask about for the trees in the bitmap live.
+        The greedily chosen tuple greedy_tuple is preferred to equally good
+        tuples and returned if the budget does not suffice for any search.
+
+        Returns a (tuple, expected number of questions) pair. The expected
+        number is None if no search could be completed.
+        '''
+        best = (greedy_tuple, None)
+        candidates = []
+        try:
+            for order, (tup, bitmap) in enumerate(self.edges.items()):
+                if order % 256 == 0:
+                    self._check_time()
+                if bitmap & live and live & ~bitmap:
+                    candidates.append((tup, bitmap))
+        except _OutOfTime:
+            return best
+        for depth in range(1, self.depth + 1):
+            try:
+                cost, tup = self._search(live, depth, candidates, greedy_tuple)
+            except _OutOfTime:
+                break
+            if tup is None:
+                break
+            best = (tup, cost)
+        return best
+
+    def _mass(self, bitmap):
+        '''
+        Return the probability of the trees in bitmap (up to a constant).
+        '''
+        if self.sums is None:
+            return _popcount(bitmap)
+        return self.sums.mass(bitmap)
+
+    def _estimate(self, bitmap):
+        '''
+        Estimate the number of questions needed to find the correct tree
+        among the trees in bitmap.
+        '''
+        if self.sums is None:
+            return math.log2(_popcount(bitmap))
+        return self.sums.entropy(bitmap)
+
+    def _search(self, live, depth, candidates, first=None):
+        '''
+        Return the expected number of questions needed for the trees in
+        live when looking depth questions ahead, together with the tuple
+        to ask about. Only the tuples in candidates, a list of (tuple,
+        bitmap) pairs splitting the trees of an ancestor state, are
+        considered. The tuple first is considered before all others.
+        '''
+        if live & (live - 1) == 0:
+            return 0.0, None
+        if depth == 0:
+            return self._estimate(live), None
+        key = (live, depth)
+        if key in self.memo:
+            return self.memo[key]
+        self._check_time()
+
+        count = _popcount(live)
+        splitting = []
+        for order, (tup, bitmap) in enumerate(candidates):
+            if order % 256 == 255:
+                self._check_time()
+            contained = _popcount(bitmap & live)
+            if 0 < contained < count:
+                splitting.append((
+                    tup != first, abs(2 * contained - count), -contained,
+                    order, tup, bitmap))
+        if not splitting:
+            # The trees cannot be told apart by any tuple.
+            return 0.0, None
+
+        children = [entry[4:] for entry in splitting]
+        total = self._mass(live)
+        result = None
+        for *_, tup, bitmap in heapq.nsmallest(self.beam_width, splitting):
+            yes = live & bitmap
+            no = live & ~bitmap
+            probability = relative_mass(self._mass(yes), total) if total else 0.5
+            cost = 1 + probability * self._search(yes, depth - 1, children)[0]
+            cost += (1 - probability) * self._search(no, depth - 1, children)[0]
+            if result is None or cost < result[0] - 1e-9:
+                result = (cost, tup)
+        self.memo[key] = result
+        return result
+
 class Forest(object):
     '''
     A Forest object is there to deal with multiple tree objects.
     '''
 
+    # One of QUESTION_STRATEGIES.
+    strategy = 'halve'
+
+    # The number of questions a QuestionPlanner looks ahead (0 for choosing
+    # questions greedily) and the time in seconds it may take per question.
+    lookahead_depth = 0
+    lookahead_budget = 0.02
+
+    # The number of questions the planner expected to be needed when the
+    # last question was chosen or None if it was chosen greedily.
+    expected_questions = None
+
     def __init__(self):
         '''
         Forest is there to contain many tree objects.
@@ -159,16 +783,100 @@ class Forest(object):
         self.trees = []
         self.originaltrees = None
         self.answeredtuples=[]
+        self.ranks = None
+        # The _EdgeIndex of all trees and the bitmap of the remaining trees
+        # for a QuestionPlanner, created when the first question is planned.
+        self._planner_index = None
+        self._planner_live = None
 
     @classmethod
-    def from_string(cls, forest_string, **tree_kwargs):
+    def from_string(cls, forest_string, share_tokens=False, deduplicate=False,
+            max_trees=0, **tree_kwargs):
         '''
         Initialize a forest object from a long string formatted like a conll
         file.
+
+        If share_tokens is True, the columns other than head and relation
+        are only stored once for the whole forest (see TokenTable). For
+        deduplicate and max_trees see prune_trees.
+        '''
+        return cls.from_lines(io.StringIO(forest_string),
+            share_tokens=share_tokens, deduplicate=deduplicate,
+            max_trees=max_trees, **tree_kwargs)
+
+    @classmethod
+    def from_buffer(cls, buffer, share_tokens=False, deduplicate=False,
+            max_trees=0, **tree_kwargs):
+        '''
+        Initialize a forest object from a bytes-like object (e.g. a
+        memoryview or an mmap) containing utf-8 encoded conll data.
+        '''
+        return cls.from_lines(io.BytesIO(buffer),
+            share_tokens=share_tokens, deduplicate=deduplicate,
+            max_trees=max_trees, **tree_kwargs)
+
+    @classmethod
+    def from_lines(cls, lines, share_tokens=False, deduplicate=False,
+            max_trees=0, **tree_kwargs):
+        '''
+        Initialize a forest object from an iterable of conll lines, e.g. a
+        file object opened in text or binary mode. The lines are consumed
+        one by one and every tree is added to the forest as soon as it has
+        been read.
+        '''
+        return cls.from_trees(
+            iter_trees(lines, share_tokens=share_tokens, **tree_kwargs),
+            deduplicate=deduplicate,
+            max_trees=max_trees
+            )
+
+    @classmethod
+    def from_trees(cls, trees, deduplicate=False, max_trees=0):
+        '''
+        Initialize a forest object from an iterable of trees. For
+        deduplicate and max_trees see prune_trees.
         '''
         forest = cls()
-        for tree_string in forest_string.strip().split('\n\n'):
-            forest.add(Tree.from_string(tree_string, **tree_kwargs))
+        for tree in prune_trees(trees, deduplicate, max_trees):
+            forest.add(tree)
+        return forest
+
+    @classmethod
+    async def from_stream(cls, stream, share_tokens=False, deduplicate=False,
+            max_trees=0, **tree_kwargs):
+        '''
+        Initialize a forest object from an asyncio.StreamReader, e.g. the
+        stdout of a subprocess. Every tree is parsed and, after collapsing
+        duplicates, added to the forest as soon as it has been read. Only
+        if max_trees is given, the trees are kept until the stream ends,
+        because selecting the best trees requires all of them.
+        '''
+        forest = cls()
+        seen = dict() if deduplicate else None
+        selected = [] if max_trees else None
+
+        def add(tree):
+            if seen is not None and not _collapse_into(seen, tree):
+                return
+            if selected is not None:
+                selected.append(tree)
+            else:
+                forest.add(tree)
+
+        reader = ForestReader(share_tokens=share_tokens, **tree_kwargs)
+        while True:
+            line = await stream.readline()
+            if not line:
+                break
+            tree = reader.feed(line)
+            if tree is not None:
+                add(tree)
+        tree = reader.close()
+        if tree is not None:
+            add(tree)
+        if selected is not None:
+            for tree in prune_trees(selected, max_trees=max_trees):
+                forest.add(tree)
         return forest
 
     def solved(self):
@@ -182,6 +890,9 @@ class Forest(object):
         Adds a filled tree into the parse forest.
         '''
         self.trees.append(finishedtree)
+        self.ranks = None
+        self._planner_index = None
+        self._planner_live = None
 
     def get_dict(self):
         '''
@@ -191,15 +902,128 @@ class Forest(object):
         return Counter([x for tree in self.trees for x \
                            in tree.get()]).most_common()
 
+    def get_ranks(self):
+        '''
+        Returns a dict giving every 3-tuple its rank in the order of first
+        appearance: tuples of earlier trees come first and tuples of the
+        same tree are in the order of their nodes. Ties between equally
+        good questions are broken by this rank, so that all forest backends
+        ask the same questions.
+        '''
+        if self.ranks is None:
+            trees = (self.originaltrees if self.originaltrees is not None
+                else self.trees)
+            self.ranks = dict()
+            for tree in trees:
+                for tup in tree.get_ordered():
+                    self.ranks.setdefault(tup, len(self.ranks))
+        return self.ranks
+
     def get_best_tuple(self):
+        '''
+        Chooses the tuple to ask about next. By default, the tuple is chosen
+        greedily (see get_greedy_tuple). If lookahead_depth is set, a
+        QuestionPlanner looks that many questions ahead and the number of
+        questions it expects to be needed is stored in expected_questions.
+        '''
+        if self.lookahead_depth:
+            return self._plan_tuple()
+        self.expected_questions = None
+        return self.get_greedy_tuple()
+
+    def _plan_tuple(self):
+        '''
+        Chooses the tuple to ask about next using a QuestionPlanner. The
+        greedy tuple, the index of the trees and the search all have to fit
+        into lookahead_budget; the greedy tuple is asked about if the
+        budget does not suffice for the rest. An index that could not be
+        completed in time is completed while choosing the next questions.
+        '''
+        deadline = time.perf_counter() + self.lookahead_budget
+        greedy_tuple = self.get_greedy_tuple()
+        self.expected_questions = None
+        try:
+            _check_deadline(deadline)
+            live, edges, sums = self._edge_index(deadline)
+        except _OutOfTime:
+            return greedy_tuple
+        planner = QuestionPlanner(edges, sums, self.lookahead_depth,
+            budget=deadline - time.perf_counter())
+        tup, self.expected_questions = planner.plan(live, greedy_tuple)
+        return tup
+
+    def _edge_index(self, deadline=None):
+        '''
+        Index the trees for a QuestionPlanner. Returns the bitmap of the
+        remaining trees, a dict mapping every tuple to the bitmap of the
+        trees containing it and the _BitmapSums of the probabilities of
+        the trees (None if all trees are equally likely). Bit i stands for
+        the i-th of all trees of the forest (see _EdgeIndex), so the index
+        is only built once. Raises _OutOfTime if the index is not complete
+        at the time.perf_counter() value deadline.
+        '''
+        index = self._planner_index
+        if index is None:
+            index = self._planner_index = _EdgeIndex(
+                self.originaltrees if self.originaltrees is not None
+                else self.trees)
+        index.build(deadline)
+        sums = None
+        if self.strategy == 'score':
+            sums = index.weight_sums(deadline)
+        if self._planner_live is None:
+            self._planner_live = index.live(self.answeredtuples)
+        return self._planner_live, index.edges, sums
+
+    def get_greedy_tuple(self):
         '''
         Chooses the tuple minimizing the equation:
                       lambda x: abs(x[1]-length/2
         This is the tuple having the best chance to halve
-        the search space.
+        the search space. Of two counts that are equally close, the higher
+        one is preferred and of several tuples with the same count, the one
+        appearing first (see get_ranks).
+
+        With the 'score' strategy, the tuple whose trees have half of the
+        probability of the remaining trees is chosen instead (see
+        tree_weights), which maximizes the expected information of the
+        answer.
         '''
+        if self.strategy == 'score':
+            return self._get_most_probable_half_tuple()
         length = len(self.trees)
-        return min(self.get_dict(), key=lambda x: abs(x[1]-length/2))[0]
+        counts = Counter(x for tree in self.trees for x in tree.get())
+        ranks = self.get_ranks()
+        return min(counts, key=lambda tup: (
+            abs(2 * counts[tup] - length),
+            -counts[tup],
+            ranks[tup]
+            ))
+
+    def _get_most_probable_half_tuple(self):
+        '''
+        Chooses the tuple contained in trees whose probability is closest to
+        half the probability of the remaining trees. Tuples contained in all
+        remaining trees are only chosen if there are no others.
+        '''
+        trees = self.trees
+        counts = Counter()
+        masses = Counter()
+        weights = tree_weights(trees)
+        for tree, weight in zip(trees, weights):
+            for tup in tree.get():
+                counts[tup] += 1
+                masses[tup] += weight
+        if not counts:
+            raise ValueError('This forest contains no trees.')
+        total = sum(weights)
+        ranks = self.get_ranks()
+        return min(masses, key=lambda tup: (
+            counts[tup] == len(trees),
+            abs(relative_mass(2 * masses[tup] - total, total)),
+            -relative_mass(masses[tup], total),
+            ranks[tup]
+            ))
 
     def question(self):
         '''
@@ -224,6 +1048,9 @@ class Forest(object):
             self.originaltrees = self.trees[:]
         self.answeredtuples.append((asked_tuple, boolean))
         self._filter(asked_tuple, boolean)
+        if self._planner_live is not None:
+            bitmap = self._planner_index.edges.get(asked_tuple, 0)
+            self._planner_live &= bitmap if boolean else ~bitmap
 
     def _filter(self, asked_tuple, boolean):
         '''
@@ -246,6 +1073,21 @@ class Forest(object):
             )
         for question, answer in self.answeredtuples:
             self._filter(question, answer)
+        # Recomputed from the remaining answers when it is needed.
+        self._planner_live = None
+
+    def copy(self):
+        '''
+        Return a forest with the same trees and answers whose state can be
+        changed by filter and undo without affecting this forest. The trees
+        themselves are shared.
+        '''
+        forest = copy.copy(self)
+        forest.trees = self.trees[:]
+        if self.originaltrees is not None:
+            forest.originaltrees = self.originaltrees[:]
+        forest.answeredtuples = self.answeredtuples[:]
+        return forest
 
     def get_fixed_edges(self):
         '''
@@ -255,24 +1097,48 @@ class Forest(object):
         length = len(self.trees)
         return [x for x,y in self.get_dict() if y==length]
 
+    def _fixed_columns(self):
+        '''
+        Return two lists telling for every node whether its head and its
+        relation are the same in all remaining trees, or None if the trees
+        may also differ in other columns. If all trees are SharedTokenTree
+        objects of the same table, only their head and relation columns
+        are compared.
+        '''
+        trees = self.trees
+        table = getattr(trees[0], 'table', None)
+        if table is None or not all(
+                isinstance(tree, SharedTokenTree) and tree.table is table
+                for tree in trees):
+            return None
+        heads = zip(*(tree.heads for tree in trees))
+        rels = zip(*(tree.rels for tree in trees))
+        return (
+            [len(set(column)) == 1 for column in heads],
+            [len(set(column)) == 1 for column in rels]
+            )
+
     def get_fixed_nodes(self):
         '''
         Find the nodes that exist in every tree and return them as a list.
         This method assumes that all trees in the forest have the same number
         of nodes.
         '''
-        fixed_nodes = []
-        if len(self.trees) == 0:
-            return fixed_nodes
-
-        for node_index in range(len(self.trees[0].nodes)):
-            for tree in self.trees:
-                if tree.nodes[node_index] != self.trees[0].nodes[node_index]:
-                    break
-            else:
-                fixed_nodes.append(self.trees[0].nodes[node_index])
+        trees = self.trees
+        if len(trees) == 0:
+            return []
+        first = trees[0].nodes
+        columns = self._fixed_columns()
+        if columns is not None:
+            return [node for node, fixed_head, fixed_rel
+                in zip(first, *columns) if fixed_head and fixed_rel]
 
-        return fixed_nodes
+        fixed = [True] * len(first)
+        for tree in trees[1:]:
+            for node_index, node in enumerate(tree.nodes[:len(first)]):
+                if node != first[node_index]:
+                    fixed[node_index] = False
+        return [node for node, is_fixed in zip(first, fixed) if is_fixed]
 
     def get_fixed_fields(self):
         '''
@@ -283,19 +1149,27 @@ class Forest(object):
 
         #compare each field of each node of each tree the first tree in the forest, (because the first one is the best??)
 
-        fixed_fields = []
-        if len(self.trees) == 0:
-            return fixed_fields
-
-        for node_index in range(len(self.trees[0].nodes)):
-            liste=[]
-            for field_index in range(len(self.trees[0].nodes[node_index])):
-                for tree in self.trees:
-                    if tree.nodes[node_index][field_index] != self.trees[0].nodes[node_index][field_index]:
-                        break
-                else:
-                    liste.append(field_index)
-            fixed_fields.append(liste)
+        trees = self.trees
+        if len(trees) == 0:
+            return []
+        first = trees[0].nodes
+        columns = self._fixed_columns()
+        if columns is not None:
+            head, rel = trees[0].head, trees[0].rel
+            return [
+                [i for i in range(len(node))
+                    if (i != head or fixed_head) and (i != rel or fixed_rel)]
+                for node, fixed_head, fixed_rel in zip(first, *columns)
+                ]
+
+        # Every tree's nodes are read once; only the fields of nodes that
+        # differ from the first tree are compared.
+        fixed_fields = [list(range(len(node))) for node in first]
+        for tree in trees[1:]:
+            for fields, node, first_node in zip(fixed_fields, tree.nodes, first):
+                if fields and node != first_node:
+                    fields[:] = [i for i in fields
+                        if i < len(node) and node[i] == first_node[i]]
         return fixed_fields
 
 
@@ -315,12 +1189,858 @@ class Forest(object):
     def get_best_tree(self):
         '''
         Find the best guess for the correct tree. As it stands, we
-        assume that the first tree in the list is the best guess.
+        assume that the first tree in the list is the best guess. With the
+        'score' strategy, the most probable tree is the best guess.
+        '''
+        trees = self.trees
+        if len(trees) > 0:
+            if self.strategy == 'score':
+                weights = tree_weights(trees)
+                return trees[weights.index(max(weights))]
+            return trees[0]
+        else:
+            raise ValueError('This forest contains no trees.')
+
+def _popcount(bitmap):
+    '''
+    Return the number of bits set in a non-negative integer bitmap.
+    '''
+    return bin(bitmap).count('1')
+
+if hasattr(int, 'bit_count'):
+    # Python 3.10 and later count bits natively.
+    _popcount = int.bit_count
+
+def _iter_bits(bitmap):
+    '''
+    Yield the indices of the bits set in a non-negative integer bitmap in
+    ascending order.
+    '''
+    while bitmap:
+        lowest = bitmap & -bitmap
+        yield lowest.bit_length() - 1
+        bitmap ^= lowest
+
+class BitsetForest(Forest):
+    '''
+    A Forest that indexes its trees by the triples they contain.
+
+    Every triple is stored once together with a bitmap (a Python int) of
+    the trees containing it. Bit i of a bitmap stands for the i-th tree
+    added to the forest. The trees that are still possible are recorded
+    in the bitmap self.live, so answering a question is a single AND or
+    AND-NOT and undoing an answer restores a saved bitmap.
+
+    The number of remaining trees containing each triple is kept in
+    self.counts and is only updated for the trees that a filter removes
+    or an undo restores, so choosing a question does not have to look at
+    every tree. The triples are additionally bucketed by their count in
+    self.buckets, so the best question is found by walking outward from
+    half the number of remaining trees. Every triple is given an id in
+    the order it first appears in the forest and ties are broken by that
+    id, which makes the choice of questions reproducible.
+    '''
+
+    def __init__(self):
         '''
-        if len(self.trees) > 0:
-            return self.trees[0]
+        Initialize an empty indexed forest.
+        '''
+        self.alltrees = []
+        self.edges = dict()
+        self.ids = dict()
+        self.counts = dict()
+        self.buckets = dict()
+        self._tuples_by_id = []
+        self.live = 0
+        self.remaining = 0
+        self.history = []
+        self.answeredtuples = []
+        self._trees = []
+        self._trees_bitmap = 0
+        self.table = None
+        self.shared_tokens = True
+        self.head_edges = dict()
+        self.rel_edges = dict()
+        self.weights = None
+        self.masses = None
+        self.live_mass = 0
+        self._weight_sums = None
+
+    @property
+    def trees(self):
+        '''
+        The list of trees that are still possible, in the order they were
+        added to the forest.
+        '''
+        if self._trees_bitmap != self.live:
+            self._trees = [self.alltrees[i] for i in _iter_bits(self.live)]
+            self._trees_bitmap = self.live
+        return self._trees
+
+    @property
+    def originaltrees(self):
+        '''
+        The list of all trees of the forest, including those ruled out by
+        answers.
+        '''
+        return self.alltrees
+
+    def add(self, finishedtree):
+        '''
+        Adds a filled tree into the parse forest and records its triples
+        in the edge index.
+        '''
+        bit = 1 << len(self.alltrees)
+        if not self.alltrees and isinstance(finishedtree, SharedTokenTree):
+            self.table = finishedtree.table
+        elif (not isinstance(finishedtree, SharedTokenTree)
+                or finishedtree.table is not self.table):
+            self.shared_tokens = False
+        self.alltrees.append(finishedtree)
+        for tup in finishedtree.get_ordered():
+            if tup not in self.ids:
+                self.ids[tup] = len(self.ids)
+                self.edges[tup] = 0
+                self.counts[tup] = 0
+                dependent, head, relation = tup
+                self.head_edges.setdefault((dependent, head), []).append(tup)
+                self.rel_edges.setdefault((dependent, relation), []).append(tup)
+        for tup in finishedtree.get():
+            self.edges[tup] |= bit
+            self._change_count(tup, 1)
+        self.live |= bit
+        self.remaining += 1
+        # The probabilities depend on all trees, so they are recomputed.
+        self.masses = None
+        self._weight_sums = None
+
+    def solved(self):
+        '''
+        True if the forest clears and only one tree remains.
+        '''
+        return self.remaining == 1
+
+    def _change_count(self, tup, delta):
+        '''
+        Add delta to the count of a triple and move it to the matching
+        bucket.
+        '''
+        count = self.counts[tup]
+        tup_id = self.ids[tup]
+        if count > 0:
+            bucket = self.buckets[count]
+            bucket.discard(tup_id)
+            if not bucket:
+                del self.buckets[count]
+        count += delta
+        self.counts[tup] = count
+        if count > 0:
+            self.buckets.setdefault(count, set()).add(tup_id)
+
+    def _update_counts(self, bitmap, delta):
+        '''
+        Add delta to the counts of all triples contained in the trees
+        indicated by bitmap.
+        '''
+        # Most triples are contained in many of the trees, so the changes
+        # are summed up before the buckets are updated once per triple.
+        changes = Counter()
+        for index in _iter_bits(bitmap):
+            changes.update(self.alltrees[index].get())
+            self.remaining += delta
+            if self.masses is not None:
+                weight = delta * self.weights[index]
+                for tup in self.alltrees[index].get():
+                    self.masses[tup] += weight
+                self.live_mass += weight
+        for tup, change in changes.items():
+            self._change_count(tup, delta * change)
+
+    def _set_live(self, live):
+        '''
+        Replace the bitmap of remaining trees and update the triple counts
+        for the trees that are removed or restored by it.
+        '''
+        self._update_counts(self.live & ~live, -1)
+        self._update_counts(live & ~self.live, 1)
+        self.live = live
+
+    def get_dict(self):
+        '''
+        Returns a list containing 3-tuples and their counts among the
+        remaining trees, most common first.
+        '''
+        return sorted(
+            ((tup, count) for tup, count in self.counts.items() if count > 0),
+            key=lambda x: x[1],
+            reverse=True
+            )
+
+    def get_greedy_tuple(self):
+        '''
+        Chooses the tuple whose count is closest to half the number of
+        remaining trees. This is the tuple having the best chance to halve
+        the search space. Of two counts that are equally close, the higher
+        one is preferred and of several tuples with the same count, the one
+        with the lowest id is chosen.
+
+        With the 'score' strategy, the tuple whose trees have half of the
+        probability of the remaining trees is chosen instead.
+        '''
+        if self.strategy == 'score':
+            return self._get_most_probable_half_tuple()
+        length = self.remaining
+        lower = length // 2
+        upper = length - lower
+        for distance in range(lower + 1):
+            for count in (upper + distance, lower - distance):
+                if count in self.buckets:
+                    tup_id = min(self.buckets[count])
+                    return self._tuple_by_id(tup_id)
+        raise ValueError('This forest contains no trees.')
+
+    def _get_most_probable_half_tuple(self):
+        '''
+        Chooses the tuple contained in trees whose probability is closest to
+        half the probability of the remaining trees. Tuples contained in all
+        remaining trees are only chosen if there are no others.
+
+        The probability of the remaining trees containing each tuple is
+        computed when the strategy is first used and then kept up to date
+        like the counts.
+        '''
+        if self.masses is None:
+            self._init_masses()
+        candidates = [tup for tup, count in self.counts.items() if count > 0]
+        if not candidates:
+            raise ValueError('This forest contains no trees.')
+        total = self.live_mass
+        return min(candidates, key=lambda tup: (
+            self.counts[tup] == self.remaining,
+            abs(relative_mass(2 * self.masses[tup] - total, total)),
+            -relative_mass(self.masses[tup], total),
+            self.ids[tup]
+            ))
+
+    def _init_masses(self):
+        '''
+        Compute the probabilities of all trees and the probability of the
+        remaining trees containing each tuple.
+        '''
+        self.weights = tree_weights(self.alltrees)
+        self.masses = dict.fromkeys(self.counts, 0.0)
+        self.live_mass = 0.0
+        for index in _iter_bits(self.live):
+            weight = self.weights[index]
+            for tup in self.alltrees[index].get():
+                self.masses[tup] += weight
+            self.live_mass += weight
+
+    def _edge_index(self, deadline=None):
+        '''
+        Return the bitmap of the remaining trees, the edge index and the
+        _BitmapSums of the probabilities of the trees (see
+        Forest._edge_index). The index is maintained anyway, so only
+        computing the sums may raise _OutOfTime.
+        '''
+        sums = None
+        if self.strategy == 'score':
+            if self._weight_sums is None:
+                self._weight_sums = _BitmapSums(tree_weights(self.alltrees))
+            self._weight_sums.build(deadline)
+            sums = self._weight_sums
+        return self.live, self.edges, sums
+
+    def _tuple_by_id(self, tup_id):
+        '''
+        Return the triple that was given the id tup_id.
+        '''
+        if len(self._tuples_by_id) != len(self.ids):
+            self._tuples_by_id = list(self.ids)
+        return self._tuples_by_id[tup_id]
+
+    def get_fixed_edges(self):
+        '''
+        Function that returns the tuples that are fixed (additional
+        answers wont change them).
+        '''
+        return [tup for tup, count in self.counts.items()
+            if count == self.remaining]
+
+    def _count_trees(self, tuples):
+        '''
+        Return the number of remaining trees containing one of the given
+        triples.
+        '''
+        return sum(self.counts[tup] for tup in tuples)
+
+    def _fixed_columns(self):
+        '''
+        Tell from the triple counts which heads and relations are the same
+        in all remaining trees (see Forest._fixed_columns). A node's head
+        is fixed iff the triples with its dependent and head are contained
+        in all remaining trees together, and likewise for its relation.
+        This only works if all trees share their other columns.
+        '''
+        if not self.shared_tokens or not self.live:
+            return None
+        first = self.alltrees[(self.live & -self.live).bit_length() - 1]
+        fixed_heads, fixed_rels = [], []
+        for dependent, head, relation in first.get_ordered():
+            fixed_heads.append(self._count_trees(
+                self.head_edges[dependent, head]) == self.remaining)
+            fixed_rels.append(self._count_trees(
+                self.rel_edges[dependent, relation]) == self.remaining)
+        return fixed_heads, fixed_rels
+
+    def filter(self, asked_dict, boolean):
+        '''
+        Wrapper around the _filter method that saves the current bitmap of
+        remaining trees, so that the undo method can restore it.
+        '''
+        asked_tuple=(asked_dict['dependent'], asked_dict['head'], asked_dict['relation'])
+        self.answeredtuples.append((asked_tuple, boolean))
+        self.history.append(self.live)
+        self._filter(asked_tuple, boolean)
+
+    def _filter(self, asked_tuple, boolean):
+        '''
+        Filters the remaining trees based on a tuple and a boolean value.
+        if True: keeps all the trees where the tuple is contained.
+        if False: keeps all the trees where the tuple isnt.
+        '''
+        bitmap = self.edges.get(asked_tuple, 0)
+        if boolean:
+            self._set_live(self.live & bitmap)
+        else:
+            self._set_live(self.live & ~bitmap)
+
+    def undo(self, n=1):
+        '''
+        Restore the state the forest was in n questions earlier.
+        '''
+        n = min(n, len(self.history))
+        if n <= 0:
+            return
+        self._set_live(self.history[-n])
+        del self.history[-n:]
+        del self.answeredtuples[-n:]
+
+    def copy(self):
+        '''
+        Return a forest sharing the trees and the edge index of this forest
+        but having its own remaining trees, counts and answers.
+        '''
+        forest = copy.copy(self)
+        forest.counts = dict(self.counts)
+        forest.buckets = {
+            count: set(tup_ids) for count, tup_ids in self.buckets.items()
+            }
+        forest.history = self.history[:]
+        forest.answeredtuples = self.answeredtuples[:]
+        forest._trees_bitmap = None
+        if self.masses is not None:
+            forest.masses = dict(self.masses)
+        return forest
+
+def _mask_to_bitmap(mask):
+    '''
+    Convert a boolean array into a bitmap whose bit i is set iff mask[i]
+    is true.
+    '''
+    return int.from_bytes(
+        numpy.packbits(mask, bitorder='little').tobytes(), 'little')
+
+class _ArrayTrees(object):
+    '''
+    Read-only sequence of the remaining trees of an ArrayForest. Tree
+    objects are only created for the trees that are actually accessed.
+    '''
+
+    def __init__(self, forest, indices):
+        self.forest = forest
+        self.indices = indices
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self.forest.make_tree(i) for i in self.indices[key]]
+        return self.forest.make_tree(self.indices[key])
+
+    def __iter__(self):
+        for index in self.indices:
+            yield self.forest.make_tree(index)
+
+class ArrayForest(Forest):
+    '''
+    A Forest storing its trees as two integer matrices of shape
+    (trees x nodes): one containing the head of every node and one
+    containing the id of its relation. All other columns are stored only
+    once, so this representation assumes that the trees of the forest
+    differ in their head and relation columns only, as is the case for
+    the output of an n-best parser.
+
+    Filtering the forest and finding questions and fixed nodes are done
+    by comparing and reducing columns of these matrices. This requires
+    NumPy.
+    '''
+
+    def __init__(self):
+        '''
+        Initialize an empty array forest.
+        '''
+        if numpy is None:
+            raise ValueError('The numpy forest backend requires NumPy.')
+        self.template = None
+        self.table = None
+        self.tokens = []
+        self.positions = dict()
+        self.relations = []
+        self.relation_ids = dict()
+        self.heads = numpy.zeros((0, 0), dtype=numpy.int32)
+        self.rels = numpy.zeros((0, 0), dtype=numpy.int32)
+        self.scores = numpy.zeros(0)
+        self.multiplicities = numpy.zeros(0, dtype=numpy.int32)
+        self.pending = []
+        self.pending_trees = []
+        self.live = numpy.zeros(0, dtype=bool)
+        self.history = []
+        self.answeredtuples = []
+        self.ranks = None
+        # The edge index for a QuestionPlanner (see _edge_index): the
+        # entries of the nodes indexed so far, the complete index and the
+        # sums of the tree probabilities.
+        self._planner_entries = []
+        self._planner_edges = None
+        self._weight_sums = None
+
+    @property
+    def trees(self):
+        '''
+        The remaining trees in the order they were added to the forest.
+        '''
+        self._freeze()
+        return _ArrayTrees(self, numpy.flatnonzero(self.live).tolist())
+
+    @property
+    def originaltrees(self):
+        '''
+        All trees of the forest, including those ruled out by answers.
+        '''
+        self._freeze()
+        return _ArrayTrees(self, list(range(len(self.live))))
+
+    def add(self, finishedtree):
+        '''
+        Adds a filled tree into the parse forest. Only its heads and
+        relations are kept.
+        '''
+        if self.template is None:
+            self.template = finishedtree
+            self.table = (finishedtree.table
+                if isinstance(finishedtree, SharedTokenTree)
+                else TokenTable(finishedtree))
+            self.tokens = self.table.rows
+            self.positions = {
+                node[finishedtree.id]: position
+                for position, node in enumerate(self.tokens)
+                }
+        elif len(finishedtree.nodes) != len(self.tokens):
+            raise ValueError('All trees in a forest need the same nodes.')
+
+        head, rel = self.template.head, self.template.rel
+        heads, rels = [], []
+        if (isinstance(finishedtree, SharedTokenTree)
+                and finishedtree.table is self.table):
+            columns = zip(finishedtree.heads, finishedtree.rels)
         else:
+            columns = []
+            for node, token in zip(finishedtree.nodes, self.tokens):
+                if any(field != token[i] for i, field in enumerate(node)
+                        if i != head and i != rel):
+                    msg = 'Trees may only differ in head and relation columns.'
+                    raise ValueError(msg)
+                columns.append((node[head], node[rel]))
+        for head_value, rel_value in columns:
+            try:
+                heads.append(int(head_value))
+            except ValueError as e:
+                msg = 'Head {} is not a number.'.format(head_value)
+                raise ValueError(msg) from e
+            if rel_value not in self.relation_ids:
+                self.relation_ids[rel_value] = len(self.relations)
+                self.relations.append(rel_value)
+            rels.append(self.relation_ids[rel_value])
+        self.pending.append((heads, rels))
+        # The trees are kept until they are frozen, because their
+        # multiplicities may still grow while the forest is loaded.
+        self.pending_trees.append(finishedtree)
+
+    def _freeze(self):
+        '''
+        Move the heads and relations of recently added trees into the
+        matrices.
+        '''
+        if not self.pending:
+            return
+        heads, rels = zip(*self.pending)
+        width = len(self.tokens)
+        self.heads = numpy.concatenate((
+            self.heads.reshape(-1, width),
+            numpy.array(heads, dtype=numpy.int32).reshape(-1, width)))
+        self.rels = numpy.concatenate((
+            self.rels.reshape(-1, width),
+            numpy.array(rels, dtype=numpy.int32).reshape(-1, width)))
+        self.live = numpy.concatenate(
+            (self.live, numpy.ones(len(self.pending), dtype=bool)))
+        self.scores = numpy.concatenate((self.scores, numpy.array(
+            [numpy.nan if tree.score is None else tree.score
+                for tree in self.pending_trees],
+            dtype=float)))
+        self.multiplicities = numpy.concatenate((self.multiplicities, numpy.array(
+            [tree.multiplicity for tree in self.pending_trees],
+            dtype=numpy.int32)))
+        self.pending = []
+        self.pending_trees = []
+        # New trees may change the encoding of the triples.
+        self.ranks = None
+        self._planner_entries = []
+        self._planner_edges = None
+        self._weight_sums = None
+
+    def make_tree(self, index):
+        '''
+        Create a SharedTokenTree object for the tree with the given index.
+        '''
+        self._freeze()
+        tree = SharedTokenTree(
+            self.table,
+            tuple(str(head_value) for head_value in self.heads[index]),
+            tuple(self.relations[rel_id] for rel_id in self.rels[index])
+            )
+        tree.multiplicity = int(self.multiplicities[index])
+        if not numpy.isnan(self.scores[index]):
+            tree.score = float(self.scores[index])
+        return tree
+
+    def _weights(self):
+        '''
+        Return an array of the probabilities of all trees (see
+        tree_weights).
+        '''
+        self._freeze()
+        if not len(self.scores) or numpy.isnan(self.scores).any():
+            return self.multiplicities.astype(float)
+        return numpy.exp(self.scores - self.scores.max())
+
+    def solved(self):
+        '''
+        True if the forest clears and only one tree remains.
+        '''
+        self._freeze()
+        return numpy.count_nonzero(self.live) == 1
+
+    def _format_node(self, value):
+        '''
+        Format a node as it is used in a triple, e.g. 'Satz-5'.
+        '''
+        if value == 0:
+            return 'Root-0'
+        key = str(value)
+        return self.template.dictio[key] + '-' + key
+
+    def _parse_tuple(self, tup):
+        '''
+        Translate a triple into a column, a head and a relation id. If
+        no tree can contain the triple, None is returned.
+        '''
+        dependent, head, relation = tup
+        dependent_id = dependent.rsplit('-', 1)[-1]
+        head_value = head.rsplit('-', 1)[-1]
+        if dependent_id not in self.positions or relation not in self.relation_ids:
+            return None
+        try:
+            head_value = int(head_value)
+            if (self._format_node(int(dependent_id)) != dependent
+                    or self._format_node(head_value) != head):
+                return None
+        except (ValueError, KeyError):
+            return None
+        return (self.positions[dependent_id], head_value,
+            self.relation_ids[relation])
+
+    def _contains(self, tup):
+        '''
+        Return a boolean array indicating which trees contain the triple.
+        '''
+        self._freeze()
+        parsed = self._parse_tuple(tup)
+        if parsed is None:
+            return numpy.zeros(len(self.live), dtype=bool)
+        column, head_value, rel_id = parsed
+        return ((self.heads[:, column] == head_value)
+            & (self.rels[:, column] == rel_id))
+
+    def _encode_tuples(self, trees=None):
+        '''
+        Encode the triples of the remaining trees (or of the trees selected
+        by the index trees) as integers. Returns the encoded triples of
+        these trees (tree by tree) and the bases needed to decode them.
+        '''
+        self._freeze()
+        if trees is None:
+            trees = self.live
+        heads = self.heads[trees]
+        rels = self.rels[trees]
+        head_base = int(self.heads.max()) + 1 if self.heads.size else 1
+        rel_base = max(len(self.relations), 1)
+        columns = numpy.arange(len(self.tokens), dtype=numpy.int64)
+        keys = ((columns * head_base + heads) * rel_base + rels).ravel()
+        return keys, (head_base, rel_base)
+
+    def _count_tuples(self):
+        '''
+        Count the triples of the remaining trees. Returns three arrays:
+        the encoded triples, their counts and the bases needed to decode
+        them.
+        '''
+        keys, bases = self._encode_tuples()
+        keys, counts = numpy.unique(keys, return_counts=True)
+        return keys, counts, bases
+
+    def _rank_tuples(self, keys):
+        '''
+        Return the ranks of encoded triples in the order of first
+        appearance (see Forest.get_ranks): the position of the first node
+        containing the triple when the nodes of all trees are read tree by
+        tree.
+        '''
+        if self.ranks is None:
+            all_keys, _ = self._encode_tuples(slice(None))
+            self.ranks = numpy.unique(all_keys, return_index=True)
+        unique_keys, first_positions = self.ranks
+        return first_positions[numpy.searchsorted(unique_keys, keys)]
+
+    def _decode(self, key, bases):
+        '''
+        Translate an encoded triple back into a 3-tuple.
+        '''
+        head_base, rel_base = bases
+        key, rel_id = divmod(int(key), rel_base)
+        column, head_value = divmod(key, head_base)
+        token = self.tokens[column]
+        return (
+            self._format_node(int(token[self.template.id])),
+            self._format_node(head_value),
+            self.relations[rel_id]
+            )
+
+    def _edge_index(self, deadline=None):
+        '''
+        Return the bitmap of the remaining trees, the edge index and the
+        _BitmapSums of the probabilities of the trees (see
+        Forest._edge_index). The index is built from the matrices one node
+        at a time, so an interrupted index is continued by the next call,
+        and its tuples are ordered by their first appearance like on the
+        other backends.
+        '''
+        self._freeze()
+        if self._planner_edges is None:
+            keys, bases = self._encode_tuples(slice(None))
+            keys = keys.reshape(len(self.live), len(self.tokens))
+            entries = self._planner_entries
+            while len(entries) < len(self.tokens):
+                _check_deadline(deadline)
+                column = keys[:, len(entries)]
+                values = numpy.unique(column)
+                entries.append(list(zip(
+                    self._rank_tuples(values).tolist(),
+                    [self._decode(value, bases) for value in values],
+                    [_mask_to_bitmap(column == value) for value in values]
+                    )))
+            self._planner_edges = {
+                tup: bitmap
+                for _, tup, bitmap
+                in sorted(entry for node in entries for entry in node)
+                }
+        sums = None
+        if self.strategy == 'score':
+            if self._weight_sums is None:
+                self._weight_sums = _BitmapSums(self._weights().tolist())
+            self._weight_sums.build(deadline)
+            sums = self._weight_sums
+        return _mask_to_bitmap(self.live), self._planner_edges, sums
+
+    def get_dict(self):
+        '''
+        Returns a list containing 3-tuples and their counts, most common
+        first.
+        '''
+        keys, counts, bases = self._count_tuples()
+        order = numpy.argsort(-counts, kind='stable')
+        return [(self._decode(keys[i], bases), int(counts[i])) for i in order]
+
+    def get_greedy_tuple(self):
+        '''
+        Chooses the tuple whose count is closest to half the number of
+        remaining trees. Of two counts that are equally close, the higher
+        one is preferred and of several tuples with the same count, the one
+        appearing first (see Forest.get_ranks).
+
+        With the 'score' strategy, the tuple whose trees have half of the
+        probability of the remaining trees is chosen instead.
+        '''
+        if self.strategy == 'score':
+            return self._get_most_probable_half_tuple()
+        keys, counts, bases = self._count_tuples()
+        if not len(keys):
             raise ValueError('This forest contains no trees.')
+        length = numpy.count_nonzero(self.live)
+        distances = numpy.abs(2 * counts - length)
+        ranks = self._rank_tuples(keys)
+        best = numpy.lexsort((ranks, -counts, distances))[0]
+        return self._decode(keys[best], bases)
+
+    def _get_most_probable_half_tuple(self):
+        '''
+        Chooses the tuple contained in trees whose probability is closest to
+        half the probability of the remaining trees. Tuples contained in all
+        remaining trees are only chosen if there are no others.
+        '''
+        keys, bases = self._encode_tuples()
+        if not len(keys):
+            raise ValueError('This forest contains no trees.')
+        weights = self._weights()[self.live]
+        keys, inverse, counts = numpy.unique(
+            keys, return_inverse=True, return_counts=True)
+        masses = numpy.bincount(
+            inverse.ravel(),
+            weights=numpy.repeat(weights, len(self.tokens)))
+        length = numpy.count_nonzero(self.live)
+        # The same rounded relative masses as relative_mass computes.
+        total = weights.sum()
+        distances = numpy.abs(numpy.round((2 * masses - total) / total, MASS_DIGITS))
+        masses = numpy.round(masses / total, MASS_DIGITS)
+        ranks = self._rank_tuples(keys)
+        best = numpy.lexsort((ranks, -masses, distances, counts == length))[0]
+        return self._decode(keys[best], bases)
+
+    def question(self):
+        '''
+        Find the best question to ask and return it.
+        '''
+        dependent, head, relation = self.get_best_tuple()
+        return {
+            'head': head,
+            'dependent': dependent,
+            'relation': relation,
+            'relation_type': self.template.rel_type
+            }
+
+    def get_best_tree(self):
+        '''
+        Find the best guess for the correct tree: the first remaining tree
+        or, with the 'score' strategy, the most probable one.
+        '''
+        self._freeze()
+        indices = numpy.flatnonzero(self.live)
+        if not len(indices):
+            raise ValueError('This forest contains no trees.')
+        if self.strategy == 'score':
+            return self.make_tree(indices[numpy.argmax(self._weights()[indices])])
+        return self.make_tree(indices[0])
+
+    def filter(self, asked_dict, boolean):
+        '''
+        Wrapper around the _filter method that saves the current mask of
+        remaining trees, so that the undo method can restore it.
+        '''
+        self._freeze()
+        asked_tuple=(asked_dict['dependent'], asked_dict['head'], asked_dict['relation'])
+        self.answeredtuples.append((asked_tuple, boolean))
+        self.history.append(self.live)
+        self._filter(asked_tuple, boolean)
+
+    def _filter(self, asked_tuple, boolean):
+        '''
+        Filters the remaining trees based on a tuple and a boolean value.
+        if True: keeps all the trees where the tuple is contained.
+        if False: keeps all the trees where the tuple isnt.
+        '''
+        contained = self._contains(asked_tuple)
+        self.live = self.live & (contained if boolean else ~contained)
+
+    def undo(self, n=1):
+        '''
+        Restore the state the forest was in n questions earlier.
+        '''
+        n = min(n, len(self.history))
+        if n <= 0:
+            return
+        self.live = self.history[-n]
+        del self.history[-n:]
+        del self.answeredtuples[-n:]
+
+    def copy(self):
+        '''
+        Return a forest sharing the matrices of this forest but having its
+        own remaining trees and answers.
+        '''
+        self._freeze()
+        forest = copy.copy(self)
+        forest.history = self.history[:]
+        forest.answeredtuples = self.answeredtuples[:]
+        return forest
+
+    def get_fixed_edges(self):
+        '''
+        Function that returns the tuples that are fixed (additional
+        answers wont change them).
+        '''
+        keys, counts, bases = self._count_tuples()
+        length = numpy.count_nonzero(self.live)
+        return [self._decode(key, bases) for key in keys[counts == length]]
+
+    def _fixed_columns(self):
+        '''
+        Return a boolean array telling for every node whether its head and
+        relation are the same in all remaining trees.
+        '''
+        self._freeze()
+        heads = self.heads[self.live]
+        rels = self.rels[self.live]
+        return ((heads == heads[0]).all(axis=0), (rels == rels[0]).all(axis=0))
+
+    def get_fixed_nodes(self):
+        '''
+        Find the nodes that exist in every tree and return them as a list.
+        '''
+        self._freeze()
+        if not numpy.count_nonzero(self.live):
+            return []
+        fixed_heads, fixed_rels = self._fixed_columns()
+        best_tree = self.trees[0]
+        return [node for node, fixed_head, fixed_rel
+            in zip(best_tree.nodes, fixed_heads, fixed_rels)
+            if fixed_head and fixed_rel]
+
+    def get_fixed_fields(self):
+        '''
+        Find the fields that exist in every tree and return them as a list.
+        '''
+        self._freeze()
+        if not numpy.count_nonzero(self.live):
+            return []
+        fixed_heads, fixed_rels = self._fixed_columns()
+        head, rel = self.template.head, self.template.rel
+        return [
+            [i for i in range(len(token))
+                if (i != head or fixed_head) and (i != rel or fixed_rel)]
+            for token, fixed_head, fixed_rel
+            in zip(self.tokens, fixed_heads, fixed_rels)
+            ]
 
 if __name__ == "__main__":
     from pprint import pprint
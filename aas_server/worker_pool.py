@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+"""
+This module provides a pool limiting the number of processor pipelines
+running at the same time. Parsers can need a lot of memory, so running a
+pipeline for every request of a burst could exhaust the memory of the host.
+Requests exceeding the limit wait in a queue of limited length and are
+rejected if the queue is full.
+"""
+
+import asyncio
+from collections import deque
+import logging
+
+
+class QueueFullError(Exception):
+    """
+    Raised if a job cannot be queued because the queue is full.
+    """
+
+
+class WorkerPool(object):
+    """
+    Runs at most max_workers jobs at the same time. Further jobs wait in a
+    first-in-first-out queue holding at most max_queue jobs. Every job is
+    cancelled if it runs longer than timeout seconds (None for no limit).
+    """
+
+    def __init__(self, max_workers, max_queue, timeout=None):
+        """
+        Initialize an idle pool.
+        """
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.running = 0
+        self.waiting = deque()
+
+    def __len__(self):
+        return len(self.waiting)
+
+    async def run(self, coro, on_queued=None):
+        """
+        Run the coroutine coro as soon as a worker is free and return its
+        result.
+
+        If the job has to wait, on_queued is called with the (1-based)
+        position of the job in the queue. Raises a QueueFullError if the
+        queue is full and an asyncio.TimeoutError if the job runs too long.
+        In both cases coro is closed or cancelled.
+        """
+        try:
+            await self.acquire(on_queued)
+        except BaseException:
+            coro.close()
+            raise
+        try:
+            return await asyncio.wait_for(coro, self.timeout)
+        finally:
+            self.release()
+
+    async def acquire(self, on_queued=None):
+        """
+        Wait until a worker is free and occupy it.
+        """
+        if self.running < self.max_workers and not self.waiting:
+            self.running += 1
+            return
+        if len(self.waiting) >= self.max_queue:
+            logging.warning(
+                'Rejected job: %d jobs running and %d jobs waiting.',
+                self.running, len(self.waiting))
+            raise QueueFullError(
+                'The server is busy ({} requests waiting).'.format(
+                    len(self.waiting)))
+
+        waiter = asyncio.get_event_loop().create_future()
+        self.waiting.append(waiter)
+        logging.info('Queued job at position %d.', len(self.waiting))
+        if on_queued is not None:
+            on_queued(len(self.waiting))
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter in self.waiting:
+                self.waiting.remove(waiter)
+            elif waiter.done() and not waiter.cancelled():
+                # The worker was handed over just before cancelling.
+                self.release()
+            raise
+
+    def release(self):
+        """
+        Free a worker and hand it over to the next waiting job.
+        """
+        while self.waiting:
+            waiter = self.waiting.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.running -= 1
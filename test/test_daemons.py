@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+"""
+Tests of daemon processors. The daemon used here is a small Python script
+that answers every request with its payload in upper case.
+
+Run from the repository root with: python3 -m unittest discover -s test
+"""
+
+import asyncio
+import os
+import sys
+import unittest
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(TEST_DIR, '..', 'aas_server'))
+
+from daemons import DaemonManager, ProcessorDaemon
+from json_interface import run_pipeline
+
+# Answers b'die' by exiting, b'hang' by not answering and b'garble' by a
+# malformed response.
+DAEMON = r'''
+import sys, time
+stdin, stdout = sys.stdin.buffer, sys.stdout.buffer
+while True:
+    length = b''
+    while not length.endswith(b'\0'):
+        byte = stdin.read(1)
+        if not byte:
+            sys.exit(0)
+        length += byte
+    payload = stdin.read(int(length[:-1]))
+    if payload == b'die':
+        sys.exit(1)
+    if payload == b'hang':
+        time.sleep(30)
+    if payload == b'garble':
+        stdout.write(b'garble\0')
+    else:
+        stdout.write(str(len(payload)).encode() + b'\0' + payload.upper())
+    stdout.flush()
+'''
+
+PROCESSOR = {
+    'name': 'upper', 'daemon': True, 'io': 'pipe',
+    'source_format': 'lower', 'target_format': 'upper',
+    'command': [sys.executable, '-c', DAEMON],
+    }
+
+
+class ProcessorDaemonTest(unittest.TestCase):
+
+    def run_daemon(self, test, timeout=None):
+        async def run():
+            daemon = ProcessorDaemon(PROCESSOR, timeout)
+            try:
+                await test(daemon)
+            finally:
+                daemon.kill()
+                await daemon.stop()
+        asyncio.run(run())
+
+    def test_requests(self):
+        async def test(daemon):
+            self.assertEqual(await daemon.request(b'badet'), b'BADET')
+            pid = daemon.subprocess.pid
+            self.assertEqual(await daemon.request(b'lurch'), b'LURCH')
+            self.assertEqual(await daemon.request(b''), b'')
+            # One process answers all requests.
+            self.assertEqual(daemon.subprocess.pid, pid)
+            self.assertEqual(daemon.restarts, 0)
+        self.run_daemon(test)
+
+    def test_restart_after_failures(self):
+        async def test(daemon):
+            for payload in [b'die', b'garble', b'hang']:
+                with self.assertRaises(ValueError):
+                    await daemon.request(payload)
+                self.assertFalse(daemon.running())
+            with self.assertLogs(level='WARNING'):
+                self.assertEqual(await daemon.request(b'badet'), b'BADET')
+            self.assertEqual(daemon.restarts, 3)
+        with self.assertLogs(level='WARNING'):
+            self.run_daemon(test, timeout=0.5)
+
+    def test_concurrent_requests(self):
+        async def test(daemon):
+            words = [b'badet', b'der', b'lurch'] * 5
+            self.assertEqual(
+                await asyncio.gather(*map(daemon.request, words)),
+                [word.upper() for word in words])
+        self.run_daemon(test)
+
+    def test_cannot_start(self):
+        async def test(daemon):
+            with self.assertRaisesRegex(ValueError, 'Cannot start'):
+                await daemon.request(b'badet')
+        processor = dict(PROCESSOR, command=['/nonexistent/daemon'])
+
+        async def run():
+            await test(ProcessorDaemon(processor))
+        asyncio.run(run())
+
+
+class DaemonManagerTest(unittest.TestCase):
+
+    def test_health_check_restarts_daemons(self):
+        async def run():
+            manager = DaemonManager(
+                [PROCESSOR, dict(PROCESSOR, name='plain', daemon=False)],
+                interval=0.1)
+            self.assertEqual(len(manager), 1)
+            await manager.start()
+            try:
+                daemon = manager['upper']
+                self.assertTrue(await daemon.check_health())
+                daemon.kill()
+                for _ in range(50):
+                    await asyncio.sleep(0.1)
+                    if daemon.running():
+                        break
+                self.assertTrue(daemon.running())
+                self.assertEqual(daemon.restarts, 1)
+                self.assertEqual(
+                    await run_pipeline([PROCESSOR], b'badet', manager),
+                    b'BADET')
+            finally:
+                await manager.stop()
+            self.assertFalse(daemon.running())
+
+        with self.assertLogs(level='WARNING'):
+            asyncio.run(run())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+"""
+Tests of decision trees: a client walking the decision tree sent by the
+server has to see the same questions and solutions as a client asking the
+server after every answer.
+
+Run from the repository root with: python3 -m unittest discover -s test
+"""
+
+import os
+import sys
+import unittest
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, TEST_DIR)
+sys.path.insert(0, os.path.join(TEST_DIR, '..'))
+sys.path.insert(0, os.path.join(TEST_DIR, '..', 'aas_server'))
+
+from aas_client.common import DecisionTreeWalker
+from test_server import LURCH, Connection
+
+REQUEST = {'type': 'request', 'use_forest': LURCH,
+    'forest_format': 'conll09_gold'}
+
+
+def summary(message):
+    """
+    Return the parts of a question or solution message a decision tree
+    reproduces.
+    """
+    tree = message['best_tree' if message['type'] == 'question' else 'tree']
+    return (message['type'], message.get('question'),
+        message['remaining_trees'], tree['tree_format'], tree['nodes'])
+
+
+def answer_paths(walker, path=()):
+    """
+    Generate every sequence of answers leading from the current node of
+    the walker to a node without a question.
+    """
+    if 'question' not in walker.node():
+        yield path
+        return
+    for answer in (True, False):
+        walker.answer(answer)
+        yield from answer_paths(walker, path + (answer,))
+        walker.undo()
+
+
+class DecisionTreeTest(unittest.TestCase):
+
+    def decision_tree_question(self, **options):
+        connection = Connection()
+        connection.send(dict(REQUEST, decision_tree=options))
+        [question] = connection.receive()
+        return question
+
+    def test_walk_matches_server(self):
+        walker = DecisionTreeWalker(self.decision_tree_question())
+        paths = list(answer_paths(walker))
+        self.assertGreater(len(paths), 1)
+        for path in paths:
+            connection = Connection()
+            connection.send(REQUEST)
+            [response] = connection.receive()
+            for answer in path:
+                self.assertEqual(summary(response), summary(walker.message()))
+                walker.answer(answer)
+                connection.send({'type': 'answer',
+                    'question': response['question'], 'answer': answer})
+                [response] = connection.receive()
+            self.assertEqual(summary(response), summary(walker.message()))
+            walker.undo(len(path))
+
+    def test_answer_messages_continue_beyond_the_tree(self):
+        question = self.decision_tree_question(max_depth=1)
+        walker = DecisionTreeWalker(question)
+        walker.answer(False)
+        # The node lies beyond the compiled region.
+        self.assertIsNone(walker.message())
+        connection = Connection()
+        connection.send(REQUEST, *walker.answer_messages())
+        _, response = connection.receive()
+        expected = Connection()
+        expected.send(REQUEST, {'type': 'answer',
+            'question': question['question'], 'answer': False})
+        self.assertEqual(response, expected.receive()[1])
+        self.assertEqual(response['type'], 'question')
+
+    def test_limits(self):
+        question = self.decision_tree_question(max_depth=0)
+        self.assertEqual(len(question['decision_tree']['nodes']), 1)
+        question = self.decision_tree_question(max_nodes=5)
+        self.assertLessEqual(len(question['decision_tree']['nodes']), 5)
+        error = self.decision_tree_question(max_depth=-1)
+        self.assertEqual(error['type'], 'error')
+
+    def test_undo(self):
+        walker = DecisionTreeWalker(self.decision_tree_question())
+        root = walker.message()
+        walker.answer(True)
+        walker.answer(True)
+        self.assertEqual(len(walker.answer_messages()), 2)
+        self.assertEqual(walker.undo(3), 1)
+        self.assertEqual(walker.message(), root)
+        self.assertEqual(walker.answer_messages(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
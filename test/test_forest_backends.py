@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+
+"""
+Tests that the forest backends behave alike: the same simulated annotation
+sessions have to ask the same questions and report the same fixed fields
+on every backend.
+
+Run from the repository root with: python3 -m unittest discover -s test
+"""
+
+import asyncio
+import os
+import random
+import sys
+import time
+import unittest
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(TEST_DIR, '..', 'aas_server'))
+
+from tree import (ArrayForest, BitsetForest, Forest, SharedTokenTree,
+    Tree, iter_trees, numpy, prune_trees)
+
+FORMAT_GOLD = {
+    'name': 'conll09_gold', 'id': 0, 'form': 1, 'label': 4,
+    'label_type': 'pos', 'head': 8, 'relation': 10, 'relation_type': 'deprel'
+    }
+FORMAT_PREDICTED = dict(FORMAT_GOLD,
+    name='conll09_predicted', label=5, head=9, relation=11)
+
+LURCH = os.path.join(TEST_DIR, 'badender_lurch.conll09')
+NBEST = os.path.join(TEST_DIR, '..', 'Parser', 'res', 'output.conll09')
+
+BACKENDS = [Forest, BitsetForest]
+if numpy is not None:
+    BACKENDS.append(ArrayForest)
+
+
+def read_trees(filename, format_info, share_tokens=False):
+    with open(filename) as forest_file:
+        return list(iter_trees(forest_file, share_tokens=share_tokens,
+            format_info=format_info))
+
+
+def question_tuple(question):
+    return (question['dependent'], question['head'], question['relation'])
+
+
+def simulate(forest, target):
+    """
+    Answer the questions of a forest as an annotator looking for the tree
+    target would and return the questions and the remaining tree.
+    """
+    correct = target.get()
+    questions = []
+    while not forest.solved():
+        question = forest.question()
+        questions.append(question_tuple(question))
+        forest.filter(question, question_tuple(question) in correct)
+    return questions, forest.trees[0]
+
+
+class BackendTest(unittest.TestCase):
+
+    def check_sessions(self, trees, targets, strategy='halve'):
+        sessions = dict()
+        for backend in BACKENDS:
+            forest = backend.from_trees(trees)
+            forest.strategy = strategy
+            sessions[backend] = []
+            for target in targets:
+                questions, result = simulate(forest.copy(), target)
+                self.assertEqual(result.get(), target.get())
+                sessions[backend].append(questions)
+        for backend in BACKENDS[1:]:
+            self.assertEqual(sessions[backend], sessions[Forest], backend.__name__)
+
+    def check_fixed_fields(self, trees):
+        forests = [backend.from_trees(trees) for backend in BACKENDS]
+        rng = random.Random(2)
+        for _ in range(100):
+            fixed_fields = forests[0].get_fixed_fields()
+            fixed_nodes = [tuple(node) for node in forests[0].get_fixed_nodes()]
+            for forest in forests[1:]:
+                self.assertEqual(forest.get_fixed_fields(), fixed_fields)
+                self.assertEqual(
+                    [tuple(node) for node in forest.get_fixed_nodes()],
+                    fixed_nodes)
+                self.assertEqual(len(forest.trees), len(forests[0].trees))
+            if forests[0].solved() or rng.random() < 0.2:
+                for forest in forests:
+                    forest.undo()
+                continue
+            question = forests[0].question()
+            answer = rng.random() < 0.5
+            for forest in forests:
+                forest.filter(question, answer)
+
+    def test_same_questions_small(self):
+        trees = read_trees(NBEST, FORMAT_PREDICTED)[:16]
+        self.check_sessions(trees, trees)
+
+    def test_same_questions_nbest(self):
+        trees = read_trees(NBEST, FORMAT_PREDICTED)
+        targets = random.Random(1).sample(trees, 10)
+        self.check_sessions(trees, targets)
+
+    def test_same_questions_scores(self):
+        trees = read_trees(NBEST, FORMAT_PREDICTED)[:16]
+        for score, tree in enumerate(trees):
+            tree.score = -float(score % 3)
+        self.check_sessions(trees, trees, strategy='score')
+
+    def test_same_questions_random_scores(self):
+        rng = random.Random(3)
+        trees = read_trees(NBEST, FORMAT_PREDICTED)
+        for tree in trees:
+            tree.score = rng.uniform(-5, 0)
+        self.check_sessions(trees, rng.sample(trees, 5), strategy='score')
+
+    def test_fixed_fields_and_undo(self):
+        self.check_fixed_fields(read_trees(NBEST, FORMAT_PREDICTED))
+
+    def test_fixed_fields_shared_tokens(self):
+        self.check_fixed_fields(
+            read_trees(NBEST, FORMAT_PREDICTED, share_tokens=True))
+
+    def test_fixed_fields_unshared(self):
+        shared = Forest.from_trees(
+            read_trees(NBEST, FORMAT_PREDICTED, share_tokens=True))
+        unshared = Forest.from_trees(read_trees(NBEST, FORMAT_PREDICTED))
+        self.assertEqual(shared.get_fixed_fields(), unshared.get_fixed_fields())
+        self.assertEqual(shared.get_fixed_nodes(), unshared.get_fixed_nodes())
+
+    def test_shared_table(self):
+        trees = read_trees(NBEST, FORMAT_PREDICTED, share_tokens=True)
+        table = trees[0].table
+        for tree in trees:
+            self.assertIsInstance(tree, SharedTokenTree)
+            self.assertIs(tree.table, table)
+        self.assertTrue(BitsetForest.from_trees(trees).shared_tokens)
+        if numpy is not None:
+            forest = ArrayForest.from_trees(trees)
+            self.assertIs(forest.table, table)
+
+    def test_originaltrees(self):
+        trees = read_trees(NBEST, FORMAT_PREDICTED)[:16]
+        for backend in BACKENDS:
+            forest = backend.from_trees(trees)
+            question = forest.question()
+            forest.filter(question, True)
+            self.assertEqual(len(forest.originaltrees), len(trees))
+
+
+class LookaheadTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = random.Random(4)
+        self.trees = (read_trees(NBEST, FORMAT_PREDICTED)
+            + read_trees(NBEST, FORMAT_PREDICTED))
+        for tree in self.trees:
+            tree.score = rng.uniform(-5, 0)
+        self.targets = rng.sample(self.trees, 3)
+
+    def test_same_plans(self):
+        for strategy in ['halve', 'score']:
+            plans = dict()
+            for backend in BACKENDS:
+                forest = backend.from_trees(self.trees)
+                forest.strategy = strategy
+                forest.lookahead_depth = 2
+                forest.lookahead_budget = 60
+                correct = self.targets[0].get()
+                plans[backend] = []
+                for _ in range(4):
+                    question = forest.question()
+                    plans[backend].append(
+                        (question_tuple(question), forest.expected_questions))
+                    forest.filter(question, question_tuple(question) in correct)
+            for backend in BACKENDS[1:]:
+                self.assertEqual(plans[backend], plans[Forest], backend.__name__)
+
+    def test_budget(self):
+        # Generous, the test machine may be busy.
+        slack = 0.05
+        for backend in BACKENDS:
+            for strategy in ['halve', 'score']:
+                forest = backend.from_trees(self.trees)
+                forest.strategy = strategy
+                forest.lookahead_depth = 3
+                forest.lookahead_budget = 0.01
+                correct = self.targets[1].get()
+                for _ in range(5):
+                    start = time.perf_counter()
+                    forest.get_greedy_tuple()
+                    greedy = time.perf_counter() - start
+                    start = time.perf_counter()
+                    question = forest.question()
+                    elapsed = time.perf_counter() - start
+                    # The greedy tuple is the fallback, so it is always
+                    # computed.
+                    self.assertLess(elapsed, greedy + forest.lookahead_budget
+                        + slack, (backend.__name__, strategy))
+                    forest.filter(question, question_tuple(question) in correct)
+
+
+class PruneTest(unittest.TestCase):
+
+    @staticmethod
+    def tree(relation, score):
+        tree = Tree.from_lines(['1\tA\t_\t0\t' + relation],
+            head=3, rel=4, rel_type='deprel')
+        tree.score = score
+        return tree
+
+    def test_collapsed_scores_are_selected(self):
+        trees = [self.tree('a', -1.0), self.tree('b', -0.9),
+            self.tree('a', -1.0), self.tree('a', -1.0)]
+        kept = list(prune_trees(trees, deduplicate=True, max_trees=1))
+        self.assertEqual(kept[0].nodes, [('1', 'A', '_', '0', 'a')])
+        self.assertEqual(kept[0].multiplicity, 3)
+
+    def test_unscored_keeps_first_trees(self):
+        trees = [self.tree(relation, None) for relation in 'abcab']
+        kept = list(prune_trees(trees, deduplicate=True, max_trees=2))
+        self.assertEqual([tree.nodes[0][4] for tree in kept], ['a', 'b'])
+
+    def test_deduplicated_backends(self):
+        for backend in BACKENDS:
+            trees = (read_trees(NBEST, FORMAT_PREDICTED)
+                + read_trees(NBEST, FORMAT_PREDICTED))
+            forest = backend.from_trees(trees, deduplicate=True)
+            self.assertEqual(len(forest.trees), 501)
+            self.assertEqual({tree.multiplicity for tree in forest.trees}, {2})
+
+
+class ReaderTest(unittest.TestCase):
+
+    def test_stream_equals_string(self):
+        with open(LURCH) as forest_file:
+            data = forest_file.read()
+        from_string = Forest.from_string(data, format_info=FORMAT_GOLD)
+        from_buffer = Forest.from_buffer(data.encode(), share_tokens=True,
+            format_info=FORMAT_GOLD)
+        self.assertEqual(
+            [tree.nodes for tree in from_string.trees],
+            [tree.nodes for tree in from_buffer.trees])
+        self.assertEqual(len(from_string.trees), 8)
+
+    def test_stream_equals_trees(self):
+        with open(NBEST) as forest_file:
+            data = (forest_file.read() * 2).encode()
+
+        async def from_stream(backend, **options):
+            stream = asyncio.StreamReader()
+            stream.feed_data(data)
+            stream.feed_eof()
+            return await backend.from_stream(
+                stream, format_info=FORMAT_PREDICTED, **options)
+
+        for backend in BACKENDS:
+            for options in [{}, {'deduplicate': True},
+                    {'max_trees': 20}, {'deduplicate': True, 'max_trees': 20}]:
+                expected = backend.from_string(data.decode(),
+                    format_info=FORMAT_PREDICTED, **options)
+                forest = asyncio.run(from_stream(backend, **options))
+                self.assertEqual(
+                    [(tree.nodes, tree.multiplicity) for tree in forest.trees],
+                    [(tree.nodes, tree.multiplicity)
+                        for tree in expected.trees])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+"""
+Tests of the cache of parsed forests.
+
+Run from the repository root with: python3 -m unittest discover -s test
+"""
+
+import os
+import sys
+import unittest
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(TEST_DIR, '..', 'aas_server'))
+
+from forest_cache import ForestCache, cache_key
+from json_interface import create_forest
+from tree import Forest
+
+FORMAT = {
+    'name': 'conll09_gold', 'id': 0, 'form': 1, 'label': 4,
+    'label_type': 'pos', 'head': 8, 'relation': 10, 'relation_type': 'deprel'
+    }
+CONFIG = {'formats': {'conll09_gold': FORMAT}, 'format_aliases': {}}
+
+with open(os.path.join(TEST_DIR, 'badender_lurch.conll09')) as forest_file:
+    LURCH = forest_file.read()
+
+
+class ForestCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.forest = Forest.from_string(LURCH, format_info=FORMAT)
+
+    def test_hit_and_miss(self):
+        cache = ForestCache(10 * len(LURCH))
+        key = cache_key(LURCH, 'conll09_gold')
+        self.assertIsNone(cache.get(key))
+        cache.put(key, self.forest, len(LURCH))
+        self.assertEqual(len(cache.get(key).trees), 8)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertNotEqual(key, cache_key(LURCH, 'conll09_predicted'))
+
+    def test_copies_are_independent(self):
+        cache = ForestCache(len(LURCH))
+        cache.put('lurch', self.forest, len(LURCH))
+        forest = cache.get('lurch')
+        forest.filter(forest.question(), True)
+        self.assertLess(len(forest.trees), 8)
+        self.assertEqual(len(cache.get('lurch').trees), 8)
+        # Filtering the original after putting it is not seen either.
+        self.forest.filter(self.forest.question(), False)
+        self.assertEqual(len(cache.get('lurch').trees), 8)
+
+    def test_least_recently_used_are_evicted(self):
+        cache = ForestCache(20)
+        cache.put('a', self.forest, 10)
+        cache.put('b', self.forest, 10)
+        cache.get('a')
+        cache.put('c', self.forest, 10)
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('c'))
+        self.assertEqual(cache.size, 20)
+
+    def test_too_large_forest(self):
+        cache = ForestCache(10)
+        cache.put('a', self.forest, 11)
+        self.assertEqual(len(cache), 0)
+
+    def test_create_forest(self):
+        cache = ForestCache(10 * len(LURCH))
+        request = {'type': 'request', 'use_forest': LURCH,
+            'forest_format': 'conll09_gold'}
+        first = create_forest(request, CONFIG, forest_cache=cache)
+        second = create_forest(request, CONFIG, forest_cache=cache)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertIsNot(first, second)
+        self.assertEqual(first.question(), second.question())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+"""
+Roundtrip tests for the memory-mapped forest store.
+
+Run from the repository root with: python3 -m unittest discover -s test
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(TEST_DIR, '..', 'aas_server'))
+
+from forest_store import ForestStore, StoreBuilder
+from tree import ArrayForest, BitsetForest, Forest, SharedTokenTree, numpy
+
+FORMAT = {
+    'name': 'conll09_predicted', 'id': 0, 'form': 1, 'label': 5,
+    'label_type': 'pos', 'head': 9, 'relation': 11, 'relation_type': 'deprel'
+    }
+
+NBEST = os.path.join(TEST_DIR, '..', 'Parser', 'res', 'output.conll09')
+
+
+class ForestStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        with open(NBEST) as forest_file:
+            self.data = forest_file.read()
+        blocks = self.data.strip().split('\n\n')
+        # A second, smaller forest with scores.
+        self.scored = '\n\n'.join(
+            '# score = -{}.1\n{}'.format(i, block)
+            for i, block in enumerate(blocks[:5]))
+        builder = StoreBuilder(FORMAT)
+        builder.add('nbest', self.data.splitlines())
+        builder.add('scored', self.scored.splitlines())
+        handle, self.filename = tempfile.mkstemp(suffix='.aasf')
+        os.close(handle)
+        builder.write(self.filename)
+        self.store = ForestStore(self.filename)
+
+    def tearDown(self):
+        self.store.close()
+        os.remove(self.filename)
+
+    def test_roundtrip(self):
+        self.assertEqual(len(self.store), 2)
+        self.assertIn('nbest', self.store)
+        expected = Forest.from_string(self.data, format_info=FORMAT)
+        backends = [Forest, BitsetForest]
+        if numpy is not None:
+            backends.append(ArrayForest)
+        for backend in backends:
+            forest = self.store.load('nbest', FORMAT, backend)
+            self.assertEqual(
+                [tree.nodes for tree in forest.trees],
+                [tree.nodes for tree in expected.trees])
+            for tree in forest.trees:
+                self.assertIsInstance(tree, SharedTokenTree)
+
+    def test_scores_and_pruning(self):
+        forest = self.store.load('scored', FORMAT, Forest, max_trees=2)
+        self.assertEqual([tree.score for tree in forest.trees], [-0.1, -1.1])
+
+    def test_ragged_rows(self):
+        lines = self.data.splitlines()
+        lines[0] += '\t_'
+        with self.assertRaisesRegex(ValueError, 'numbers of columns'):
+            StoreBuilder(FORMAT).add('ragged', lines)
+
+    def test_unknown_sentence(self):
+        with self.assertRaises(KeyError):
+            self.store.load('missing', FORMAT)
+
+    def test_wrong_format(self):
+        with self.assertRaises(ValueError):
+            self.store.load('nbest', dict(FORMAT, head=8, relation=10))
+
+
+if __name__ == '__main__':
+    unittest.main()
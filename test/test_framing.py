@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+"""
+Tests for the framing of AaSP messages (MessageBuffer).
+
+Run from the repository root with: python3 -m unittest discover -s test
+"""
+
+import os
+import sys
+import unittest
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(TEST_DIR, '..', 'aas_server'))
+
+from framing import FramingError, MessageBuffer, pack_message
+
+
+class FramingTest(unittest.TestCase):
+
+    def test_byte_by_byte(self):
+        data = b''.join(pack_message(str(i).encode() * i) for i in range(20))
+        buffer = MessageBuffer()
+        received = []
+        for i in range(len(data)):
+            received.extend(buffer.feed(data[i:i + 1]))
+        self.assertEqual(received, [str(i).encode() * i for i in range(20)])
+        self.assertEqual(len(buffer), 0)
+
+    def test_pipelined(self):
+        buffer = MessageBuffer()
+        data = pack_message(b'first') + pack_message(b'') + pack_message(b'third')
+        self.assertEqual(buffer.feed(data[:-2]), [b'first', b''])
+        self.assertEqual(buffer.feed(data[-2:]), [b'third'])
+
+    def test_large_message_in_chunks(self):
+        message = bytes(range(256)) * 4096
+        data = pack_message(message)
+        buffer = MessageBuffer()
+        received = []
+        for start in range(0, len(data), 1000):
+            received.extend(buffer.feed(data[start:start + 1000]))
+        self.assertEqual(received, [message])
+
+    def test_invalid_prefix(self):
+        with self.assertRaises(FramingError):
+            MessageBuffer().feed(b'12a\0message')
+        with self.assertRaises(FramingError):
+            MessageBuffer().feed(b'{"type": "request", "use_forest": ""}')
+
+    def test_too_large(self):
+        buffer = MessageBuffer(max_message_size=10)
+        self.assertEqual(buffer.feed(pack_message(b'0123456789')), [b'0123456789'])
+        with self.assertRaises(FramingError):
+            buffer.feed(b'11\0')
+
+
+if __name__ == '__main__':
+    unittest.main()
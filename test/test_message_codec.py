@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+"""
+Roundtrip tests for the encodings and compressions of AaSP messages
+(MessageCodec, pack_msgpack).
+
+Run from the repository root with: python3 -m unittest discover -s test
+"""
+
+import os
+import sys
+import unittest
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(TEST_DIR, '..', 'aas_server'))
+
+from message_codec import (COMPRESSIONS, COMPRESSION_THRESHOLD, ENCODINGS,
+    MessageCodec, choose, pack_msgpack, unpack_msgpack)
+
+MESSAGES = [
+    {},
+    {'type': 'answer', 'answer': True, 'id': 7},
+    {'type': 'request', 'use_forest': '1\tMit\tmit\t_\n' * 500,
+        'forest_format': 'conll09'},
+    {'nested': [[None, False, 1.5, -1, -33, 255, 65536, 2 ** 40, -2 ** 40],
+        {'ünïcödé': 'ß' * 40}]},
+    ]
+
+
+class MsgpackTest(unittest.TestCase):
+
+    def test_roundtrip(self):
+        for message in MESSAGES:
+            self.assertEqual(unpack_msgpack(pack_msgpack(message)), message)
+
+    def test_reference_encodings(self):
+        # Examples from the msgpack specification.
+        self.assertEqual(pack_msgpack({'compact': True, 'schema': 0}),
+            b'\x82\xa7compact\xc3\xa6schema\x00')
+        self.assertEqual(pack_msgpack(-1), b'\xff')
+        self.assertEqual(pack_msgpack(128), b'\xcc\x80')
+        self.assertEqual(pack_msgpack(-33), b'\xd0\xdf')
+        self.assertEqual(pack_msgpack('a' * 32), b'\xd9\x20' + b'a' * 32)
+        self.assertEqual(pack_msgpack(list(range(16)))[:3], b'\xdc\x00\x10')
+
+    def test_invalid_data(self):
+        for data in (b'', b'\xc1', b'\x92\x01', b'\xa3ab', b'\x01\x02'):
+            with self.assertRaises(ValueError):
+                unpack_msgpack(data)
+
+
+class CodecTest(unittest.TestCase):
+
+    def test_roundtrip(self):
+        for encoding in ENCODINGS:
+            for compression in [None] + list(COMPRESSIONS):
+                codec = MessageCodec(encoding, compression)
+                for message in MESSAGES:
+                    self.assertEqual(
+                        codec.decode(codec.encode(message)), message,
+                        (encoding, compression))
+
+    def test_compression_flag(self):
+        codec = MessageCodec('msgpack', 'zlib')
+        small = codec.encode({'type': 'answer', 'answer': False})
+        self.assertEqual(small[0], 0)
+        large = codec.encode(MESSAGES[2])
+        self.assertEqual(large[0], 1)
+        self.assertLess(len(large), COMPRESSION_THRESHOLD)
+
+    def test_decompression_limit(self):
+        encoder = MessageCodec('json', 'zlib')
+        decoder = MessageCodec('json', 'zlib', max_message_size=1000)
+        with self.assertRaises(ValueError):
+            decoder.decode(encoder.encode(MESSAGES[2]))
+
+    def test_invalid_data(self):
+        for data in (b'', b'\x02abc', b'\x01not zlib'):
+            with self.assertRaises(ValueError):
+                MessageCodec('json', 'zlib').decode(data)
+
+    def test_choose(self):
+        self.assertEqual(choose(['cbor2', 'msgpack', 'json'], ENCODINGS), 'msgpack')
+        self.assertIsNone(choose(['lz4'], COMPRESSIONS))
+        with self.assertRaises(ValueError):
+            choose('msgpack', ENCODINGS)
+
+
+if __name__ == '__main__':
+    unittest.main()
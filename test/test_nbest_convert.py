@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+
+"""
+Tests of reading the output of the mate-tools n-best parser. The n-best
+output is made from the trees of the badender Lurch.
+
+Run from the repository root with: python3 -m unittest discover -s test
+"""
+
+import io
+import os
+import sys
+import unittest
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(TEST_DIR, '..', 'aas_server'))
+
+from json_interface import forest_from_string
+from nbest_convert import (forest_from_nbest, iter_forests, parse_candidates,
+    write_forests)
+from tree import BitsetForest, Forest
+
+FORMAT = {
+    'name': 'conll09_gold', 'id': 0, 'form': 1, 'label': 4,
+    'label_type': 'pos', 'head': 8, 'relation': 10, 'relation_type': 'deprel'
+    }
+
+with open(os.path.join(TEST_DIR, 'badender_lurch.conll09')) as forest_file:
+    LURCH = forest_file.read()
+
+
+def trees(forest_string):
+    """
+    Return the conll strings of the trees of a forest.
+    """
+    return [tree.strip() for tree in forest_string.split('\n\n')
+        if tree.strip()]
+
+
+def nbest_output(forest_string, scores):
+    """
+    Return the n-best output the parser would write for the trees of a
+    forest.
+    """
+    rows = [
+        [line.split('\t') for line in tree.splitlines()]
+        for tree in trees(forest_string)
+        ]
+    candidates = [
+        'ParseAnnaScore={} @@@ -1,<None> '.format(score) + ' '.join(
+            '{},{}'.format(row[8], row[10]) for row in tree)
+        for score, tree in zip(scores, rows)
+        ]
+    candidates[0] = 'GreedyAnna=Y ' + candidates[0]
+    return '\n'.join(['\t'.join(row) for row in rows[0]] + [
+        'ParseNBest\t{}\t[{}]'.format(len(rows), '];['.join(candidates)),
+        ]) + '\n'
+
+
+SCORES = [20.5, 20.25, 20.0, 19.75, 19.5, 19.25, 19.0, 18.75]
+NBEST = nbest_output(LURCH, SCORES)
+
+
+def edges(forest):
+    """
+    Return the heads and relations of the trees of a forest. The trees of
+    the badender Lurch differ in other columns as well, the candidates of
+    n-best output only in these.
+    """
+    return [[(node[0], node[8], node[10]) for node in tree.nodes]
+        for tree in forest.trees]
+
+
+class NBestTest(unittest.TestCase):
+
+    def test_parse_candidates(self):
+        nbest_line = NBEST.splitlines()[-1]
+        candidates = parse_candidates(nbest_line)
+        self.assertEqual(len(candidates), 8)
+        score, heads, rels = candidates[0]
+        self.assertEqual(score, 20.5)
+        self.assertEqual(heads, ('3', '1', '0', '3', '6', '3', '3', '9', '7',
+            '3'))
+        self.assertEqual(rels[:3], ('MO', 'NK', '--'))
+        with self.assertRaises(ValueError):
+            parse_candidates('ParseNBest 8')
+
+    def test_candidate_trees(self):
+        expected = edges(Forest.from_string(LURCH, format_info=FORMAT))
+        questions = []
+        for forest_class in [Forest, BitsetForest]:
+            forest = forest_from_nbest(
+                io.StringIO(NBEST), FORMAT, forest_class)
+            self.assertEqual(edges(forest), expected)
+            self.assertEqual(
+                [tree.score for tree in forest.trees], SCORES)
+            questions.append(forest.question())
+        self.assertEqual(questions[0], questions[1])
+
+    def test_pruning(self):
+        forest = forest_from_nbest(
+            io.StringIO(NBEST), FORMAT, max_trees=3)
+        self.assertEqual([tree.score for tree in forest.trees], SCORES[:3])
+
+    def test_several_sentences(self):
+        first = '\n\n'.join(trees(LURCH)[:2])
+        output = nbest_output(first, SCORES) + NBEST
+        forests = list(iter_forests(output.splitlines(), FORMAT))
+        self.assertEqual([len(forest.trees) for forest in forests], [2, 8])
+        with self.assertRaisesRegex(ValueError, 'more than one'):
+            forest_from_nbest(output.splitlines(), FORMAT)
+
+    def test_write_forests(self):
+        output = io.StringIO()
+        write_forests(io.StringIO(NBEST), output, head=8, rel=10)
+        forest = Forest.from_string(output.getvalue(), format_info=FORMAT)
+        self.assertEqual(edges(forest),
+            edges(Forest.from_string(LURCH, format_info=FORMAT)))
+        self.assertEqual(forest.question(), forest_from_nbest(
+            io.StringIO(NBEST), FORMAT).question())
+        self.assertTrue(output.getvalue().startswith('# score = 20.5\n'))
+
+    def test_reader_option(self):
+        config = {'forest_backend': 'bitset'}
+        forest = forest_from_string(
+            NBEST, dict(FORMAT, reader='anna_nbest'), config)
+        self.assertEqual(len(forest.trees), 8)
+
+    def test_invalid_output(self):
+        with self.assertRaisesRegex(ValueError, 'without ParseNBest'):
+            list(iter_forests(NBEST.splitlines()[:-1], FORMAT))
+        lines = NBEST.splitlines()
+        with self.assertRaisesRegex(ValueError, '9 tokens'):
+            forest_from_nbest(lines[:8] + lines[9:], FORMAT)
+        with self.assertRaisesRegex(ValueError, 'does not contain'):
+            forest_from_nbest([], FORMAT)
+
+
+if __name__ == '__main__':
+    unittest.main()
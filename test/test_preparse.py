@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+"""
+Tests of pre-parsing a corpus directory into a directory of forests.
+
+Run from the repository root with: python3 -m unittest discover -s test
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(TEST_DIR, '..', 'aas_server'))
+
+from preparse import count_trees, pending_sentences, preparse, write_atomically
+
+LURCH_FILE = os.path.join(TEST_DIR, 'badender_lurch.conll09')
+with open(LURCH_FILE) as forest_file:
+    LURCH = forest_file.read()
+
+# Parses a sentence of n words into the first n trees of the badender
+# Lurch and fails on the sentence 'fail'.
+PARSER = r'''
+import sys
+sentence = sys.stdin.read().split()
+if sentence == ['fail']:
+    sys.exit(1)
+trees = open(sys.argv[1]).read().strip().split('\n\n')
+sys.stdout.write('\n\n'.join(trees[:len(sentence)]) + '\n')
+'''
+
+CONFIG = {
+    'formats': {'conll09_gold': {
+        'name': 'conll09_gold', 'id': 0, 'form': 1, 'label': 4,
+        'label_type': 'pos', 'head': 8, 'relation': 10,
+        'relation_type': 'deprel'
+        }},
+    'format_aliases': {},
+    'processors': [{
+        'name': 'parser', 'io': 'pipe',
+        'source_format': 'raw', 'target_format': 'conll09_gold',
+        'command': [sys.executable, '-c', PARSER, LURCH_FILE],
+        }],
+    }
+
+REQUEST = {'type': 'request', 'source_format': 'raw',
+    'target_format': 'conll09_gold'}
+
+
+class PreparseTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.corpus_dir = os.path.join(self.directory.name, 'corpus')
+        self.forest_dir = os.path.join(self.directory.name, 'forests')
+        os.makedirs(self.corpus_dir)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def add_sentences(self, sentences):
+        for name, sentence in sentences.items():
+            with open(os.path.join(self.corpus_dir, name), 'w') as sentence_file:
+                sentence_file.write(sentence)
+
+    def test_count_trees(self):
+        self.assertEqual(count_trees(LURCH), 8)
+        self.assertEqual(count_trees('# score = -1\n' + LURCH), 8)
+        self.assertEqual(count_trees('\n\n'), 0)
+
+    def test_pending_sentences(self):
+        self.add_sentences({'s2': 'b', 's1': 'a', '.s3': 'c', 's4': 'd'})
+        os.makedirs(os.path.join(self.corpus_dir, 'subdirectory'))
+        os.makedirs(self.forest_dir)
+        write_atomically(os.path.join(self.forest_dir, 's4'), LURCH)
+        self.assertEqual(
+            pending_sentences(self.corpus_dir, self.forest_dir), ['s1', 's2'])
+        # Only the forest file is left in the forest directory.
+        self.assertEqual(os.listdir(self.forest_dir), ['s4'])
+
+    def test_preparse(self):
+        self.add_sentences({
+            's1': 'Der Lurch.', 's2': 'Der Lurch badet.', 's3': 'fail'})
+        with self.assertLogs(level='INFO'):
+            result = preparse(self.corpus_dir, self.forest_dir, REQUEST,
+                CONFIG, workers=2)
+        self.assertEqual(result, (2, 5, 1))
+        self.assertEqual(sorted(os.listdir(self.forest_dir)), ['s1', 's2'])
+        with open(os.path.join(self.forest_dir, 's2')) as forest_file:
+            self.assertEqual(count_trees(forest_file.read()), 3)
+        # A second run only retries the failed sentence.
+        with self.assertLogs(level='INFO'):
+            result = preparse(self.corpus_dir, self.forest_dir, REQUEST,
+                CONFIG, workers=2)
+        self.assertEqual(result, (0, 0, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+
+"""
+Tests of running processors as asyncio subprocesses. The processors are
+shell commands, so the tests need a POSIX system.
+
+Run from the repository root with: python3 -m unittest discover -s test
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(TEST_DIR, '..', 'aas_server'))
+
+from json_interface import call_processor, run_pipeline
+
+
+def shell(script, **keys):
+    """
+    Return a processor running a shell script. The script can use the
+    infile and outfile as $1 and $2.
+    """
+    return dict(keys, name='sh',
+        command=['sh', '-c', script, 'sh', '{infile}', '{outfile}'])
+
+
+def is_alive(pid):
+    """
+    Return True if the process pid exists and is not a zombie.
+    """
+    try:
+        with open('/proc/{}/stat'.format(pid)) as stat:
+            return stat.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except FileNotFoundError:
+        return False
+    except OSError:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        return True
+
+
+def wait_until_dead(pids, timeout=5):
+    """
+    Return True if all processes in pids are gone within timeout seconds.
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if not any(is_alive(pid) for pid in pids):
+            return True
+        time.sleep(0.05)
+    return False
+
+
+class CallProcessorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.infile = os.path.join(self.directory.name, 'in')
+        with open(self.infile, 'w') as infile:
+            infile.write('badet\n')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def call(self, *processors):
+        async def call_all():
+            return await asyncio.gather(*(
+                call_processor(processor, self.infile, self.directory.name)
+                for processor in processors))
+        return asyncio.run(call_all())
+
+    def test_outfile(self):
+        [outfile] = self.call(shell('tr a-z A-Z < "$1" > "$2"'))
+        with open(outfile) as output:
+            self.assertEqual(output.read(), 'BADET\n')
+
+    def test_processors_run_at_the_same_time(self):
+        start = time.monotonic()
+        self.call(*[shell('sleep 0.5; cp "$1" "$2"')] * 3)
+        self.assertLess(time.monotonic() - start, 1.4)
+
+    def test_exit_code(self):
+        with self.assertRaisesRegex(ValueError, 'exited with code 3'):
+            self.call(shell('exit 3'))
+
+    def test_cancelling_kills_the_process_group(self):
+        pidfile = os.path.join(self.directory.name, 'pids')
+        # The shell and a program it started.
+        processor = shell('sleep 30 & echo $$ $! > {}; wait'.format(pidfile))
+
+        async def cancel():
+            task = asyncio.ensure_future(
+                call_processor(processor, self.infile, self.directory.name))
+            while not os.path.exists(pidfile) or not os.path.getsize(pidfile):
+                await asyncio.sleep(0.05)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(cancel())
+        with open(pidfile) as pids:
+            self.assertTrue(wait_until_dead(map(int, pids.read().split())))
+
+
+# The same commands as processors reading from stdin and writing to stdout
+# and as processors reading from and writing to files.
+PIPED = [
+    dict(name='tr', io='pipe', command=['tr', 'a-z', 'A-Z']),
+    dict(name='sort', io='pipe', command=['sort']),
+    dict(name='sed', io='pipe', command=['sed', 's/L/l/']),
+    ]
+FILES = [
+    shell('tr a-z A-Z < "$1" > "$2"'),
+    shell('sort < "$1" > "$2"'),
+    shell('sed s/L/l/ < "$1" > "$2"'),
+    ]
+
+
+class RunPipelineTest(unittest.TestCase):
+
+    def run_pipeline(self, processors, data):
+        return asyncio.run(run_pipeline(processors, data))
+
+    def test_pipes_and_files_give_the_same_output(self):
+        # Larger than the buffers of OS pipes.
+        data = ''.join('lurch {}\nbadet {}\n'.format(i, i)
+            for i in range(100000)).encode()
+        expected = self.run_pipeline(FILES, data)
+        self.assertTrue(expected.startswith(b'BADET 0\nBADET 1\n'))
+        self.assertIn(b'lURCH 0\n', expected)
+        for mixed in [PIPED, PIPED[:1] + FILES[1:], FILES[:1] + PIPED[1:],
+                [PIPED[0], FILES[1], PIPED[2]]]:
+            self.assertEqual(self.run_pipeline(mixed, data), expected)
+
+    def test_failing_piped_processor(self):
+        failing = dict(name='false', io='pipe', command=['false'])
+        with self.assertRaisesRegex(ValueError, 'exited with code'):
+            self.run_pipeline([PIPED[0], failing, PIPED[1]], b'badet\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
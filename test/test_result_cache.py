@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+"""
+Tests of the persistent cache of processor outputs.
+
+Run from the repository root with: python3 -m unittest discover -s test
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(TEST_DIR, '..', 'aas_server'))
+
+from json_interface import process
+from result_cache import ResultCache, pipeline_key
+
+TAGGER = {
+    'name': 'tagger', 'io': 'pipe', 'command': ['tr', 'a-z', 'A-Z'],
+    'source_format': 'raw', 'target_format': 'tagged',
+    }
+
+
+class ResultCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = ResultCache(self.directory.name, 100)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_hit_and_miss(self):
+        key = self.cache.key(b'Der Lurch.', [TAGGER])
+        self.assertIsNone(self.cache.get(key))
+        self.cache.put(key, b'DER LURCH.')
+        self.assertEqual(self.cache.get(key), b'DER LURCH.')
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+        # The outputs survive a restart.
+        reopened = ResultCache(self.directory.name, 100)
+        self.assertEqual((len(reopened), reopened.size), (1, 10))
+        self.assertEqual(reopened.get(key), b'DER LURCH.')
+
+    def test_keys(self):
+        key = pipeline_key(b'Der Lurch.', [TAGGER])
+        self.assertEqual(key, pipeline_key(b'Der Lurch.', [dict(TAGGER)]))
+        for data, processors in [
+                (b'Der Lurch badet.', [TAGGER]),
+                (b'Der Lurch.', [TAGGER, TAGGER]),
+                (b'Der Lurch.', [dict(TAGGER, version='2')]),
+                (b'Der Lurch.', [dict(TAGGER, command=['tr', 'a-z', 'b-z'])]),
+                ]:
+            self.assertNotEqual(key, pipeline_key(data, processors))
+
+    def test_least_recently_used_are_evicted(self):
+        for key in ['aa', 'bb', 'cc']:
+            self.cache.put(key, b'x' * 40)
+            # Make the access times distinct.
+            self.cache.entries[key] = (len(self.cache.entries),
+                self.cache.entries[key][1])
+        self.assertIsNone(self.cache.get('aa'))
+        self.assertIsNotNone(self.cache.get('bb'))
+        self.cache.put('dd', b'x' * 40)
+        self.assertIsNone(self.cache.get('cc'))
+        self.assertIsNotNone(self.cache.get('bb'))
+        self.assertEqual(self.cache.size, 80)
+        self.cache.put('ee', b'x' * 101)
+        self.assertIsNone(self.cache.get('ee'))
+
+    def test_atomic_writes(self):
+        self.cache.put('aa', b'old output')
+        with mock.patch('os.replace', side_effect=OSError('disk full')):
+            with self.assertRaises(OSError):
+                self.cache.put('aa', b'new output')
+        # Neither a partial output nor the temporary file is left behind.
+        self.assertEqual(os.listdir(os.path.join(self.directory.name, 'aa')),
+            ['aa'])
+        self.assertEqual(self.cache.get('aa'), b'old output')
+        # Temporary files of writes in progress are not read as outputs.
+        open(os.path.join(self.directory.name, 'aa', '.partial'), 'w').close()
+        self.assertEqual(len(ResultCache(self.directory.name, 100)), 1)
+
+    def test_process(self):
+        config = {'processors': [TAGGER], 'default_format': 'tagged'}
+        request = {'type': 'request', 'process': 'der lurch',
+            'source_format': 'raw'}
+        calls = []
+
+        async def run_pipeline(processors, data, daemons=None):
+            calls.append(data)
+            return data.upper()
+
+        async def process_twice():
+            with mock.patch('json_interface.run_pipeline', run_pipeline):
+                return [await process(request, config,
+                    result_cache=self.cache) for _ in range(2)]
+
+        self.assertEqual(asyncio.run(process_twice()), [b'DER LURCH'] * 2)
+        self.assertEqual(calls, [b'der lurch'])
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+"""
+Tests of the routing table of processor pipelines.
+
+Run from the repository root with: python3 -m unittest discover -s test
+"""
+
+import asyncio
+import os
+import sys
+import unittest
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(TEST_DIR, '..', 'aas_server'))
+
+from json_interface import process
+from routing import RoutingTable
+
+
+def processor(name, source, target, **keys):
+    return dict(keys, name=name, source_format=source, target_format=target)
+
+
+PROCESSORS = [
+    processor('tokenize', 'raw', 'tokens'),
+    processor('tag', 'tokens', 'tagged'),
+    processor('parse', 'tagged', 'parsed'),
+    processor('tag_and_parse', 'tokens', 'parsed'),
+    processor('detokenize', 'tokens', 'raw'),
+    processor('convert', 'parsed', 'conll09'),
+    ]
+
+
+def names(pipeline):
+    return [processor['name'] for processor in pipeline]
+
+
+class RoutingTableTest(unittest.TestCase):
+
+    def test_shortest_pipeline(self):
+        table = RoutingTable(PROCESSORS)
+        self.assertEqual(names(table.lookup('raw', 'parsed')),
+            ['tokenize', 'tag_and_parse'])
+        self.assertEqual(names(table.lookup('raw', 'conll09')),
+            ['tokenize', 'tag_and_parse', 'convert'])
+        self.assertEqual(names(table.lookup('tokens', 'raw')), ['detokenize'])
+
+    def test_costs(self):
+        processors = list(PROCESSORS)
+        processors[3] = dict(processors[3], cost=3)
+        table = RoutingTable(processors)
+        self.assertEqual(names(table.lookup('raw', 'parsed')),
+            ['tokenize', 'tag', 'parse'])
+
+    def test_ties_are_broken_by_the_config_order(self):
+        processors = [
+            processor('second', 'a', 'b'),
+            processor('first', 'a', 'b'),
+            ]
+        self.assertEqual(names(RoutingTable(processors).lookup('a', 'b')),
+            ['second'])
+        self.assertEqual(
+            names(RoutingTable(processors[::-1]).lookup('a', 'b')),
+            ['first'])
+
+    def test_unreachable_formats(self):
+        table = RoutingTable(PROCESSORS)
+        self.assertIsNone(table.lookup('parsed', 'raw'))
+        self.assertIsNone(table.lookup('raw', 'raw'))
+        self.assertIsNone(table.lookup('unknown', 'parsed'))
+        self.assertNotIn(('conll09', 'raw'), table)
+        self.assertIn(('raw', 'conll09'), table)
+        self.assertEqual(table.unreachable(['raw']),
+            [('parsed', 'raw'), ('tagged', 'raw')])
+
+    def test_unreachable_format_in_request(self):
+        request = {'type': 'process', 'process': 'Der Lurch.',
+            'source_format': 'parsed', 'target_format': 'raw'}
+        config = {'processors': PROCESSORS}
+        with self.assertRaisesRegex(ValueError, 'No processors'):
+            asyncio.run(process(request, config, routing_table=RoutingTable(
+                PROCESSORS)))
+
+    def test_aliases(self):
+        table = RoutingTable(PROCESSORS, {'text': 'raw', 'conll': 'conll09'})
+        self.assertEqual(table.lookup('text', 'conll'),
+            table.lookup('raw', 'conll09'))
+
+    def test_negative_cost(self):
+        with self.assertRaisesRegex(ValueError, 'negative cost'):
+            RoutingTable([processor('tag', 'tokens', 'tagged', cost=-1)])
+
+
+if __name__ == '__main__':
+    unittest.main()
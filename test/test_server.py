@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+
+"""
+Tests of the server protocol: the messages a client sends are fed to an
+AnnotationHelperProtocol connected to a fake transport and the responses
+are read back from the bytes it writes.
+
+Run from the repository root with: python3 -m unittest discover -s test
+"""
+
+import asyncio
+import os
+import sys
+import unittest
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(TEST_DIR, '..', 'aas_server'))
+
+from framing import MessageBuffer, pack_message
+from message_codec import MessageCodec
+from server import AnnotationHelperProtocol
+from worker_pool import WorkerPool
+
+FORMAT = {
+    'name': 'conll09_gold', 'id': 0, 'form': 1, 'label': 4,
+    'label_type': 'pos', 'head': 8, 'relation': 10, 'relation_type': 'deprel'
+    }
+CONFIG = {
+    'formats': {'conll09_gold': FORMAT},
+    'format_aliases': {},
+    'default_format': 'conll09_gold',
+    }
+
+LURCH_FILE = os.path.join(TEST_DIR, 'badender_lurch.conll09')
+with open(LURCH_FILE) as forest_file:
+    LURCH = forest_file.read()
+
+# Parses the n-th line of its input into a forest holding the first n
+# trees of the badender Lurch.
+PARSER = r'''
+import sys
+trees = open(sys.argv[1]).read().strip().split('\n\n')
+for n, line in enumerate(sys.stdin, 1):
+    sys.stdout.write('\n\n'.join(trees[:n]) + '\n\n\n')
+'''
+
+PARSER_CONFIG = dict(CONFIG, processors=[{
+    'name': 'parser', 'io': 'pipe',
+    'source_format': 'raw', 'target_format': 'conll09_gold',
+    'command': [sys.executable, '-c', PARSER, LURCH_FILE],
+    }])
+
+
+class FakeTransport(object):
+    """
+    Collects the bytes the protocol writes.
+    """
+
+    def __init__(self):
+        self.data = bytearray()
+        self.closed = False
+
+    def write(self, data):
+        self.data += data
+
+    def is_closing(self):
+        return self.closed
+
+    def close(self):
+        self.closed = True
+
+    def get_extra_info(self, name):
+        return 'test'
+
+
+class Connection(object):
+    """
+    A client's view of a connection to an AnnotationHelperProtocol.
+    """
+
+    def __init__(self, config=CONFIG, **options):
+        self.protocol = AnnotationHelperProtocol(dict(config), **options)
+        self.transport = FakeTransport()
+        self.protocol.connection_made(self.transport)
+        self.codec = MessageCodec()
+        self.buffer = MessageBuffer()
+        self.frames = []
+
+    def send(self, *messages):
+        """
+        Send messages at once. Their frames are kept in self.frames.
+        """
+        self.frames = [pack_message(self.codec.encode(message))
+            for message in messages]
+        self.protocol.data_received(b''.join(self.frames))
+
+    def receive(self):
+        """
+        Return the messages written since the last call.
+        """
+        data = bytes(self.transport.data)
+        self.transport.data.clear()
+        messages = []
+        for binary_message in self.buffer.feed(data):
+            message = self.codec.decode(binary_message)
+            if message.get('type') == 'handshake':
+                self.codec = MessageCodec(
+                    message['encoding'], message['compression'])
+            messages.append(message)
+        return messages
+
+    async def exchange(self, *messages):
+        """
+        Send messages, wait until all of them are answered and return the
+        responses.
+        """
+        self.send(*messages)
+        while self.protocol.pending is not None:
+            await asyncio.wait([self.protocol.pending])
+            # Let the callback sending the response run.
+            await asyncio.sleep(0)
+        return self.receive()
+
+
+class HandshakeTest(unittest.TestCase):
+
+    def test_compressed_upload(self):
+        connection = Connection()
+        connection.send({'type': 'handshake', 'encodings': ['msgpack'],
+            'compressions': ['zlib']})
+        [handshake] = connection.receive()
+        self.assertEqual(handshake, {'type': 'handshake',
+            'encoding': 'msgpack', 'compression': 'zlib'})
+        connection.send({'type': 'request', 'use_forest': LURCH,
+            'forest_format': 'conll09_gold'})
+        # The forest is large enough to be compressed.
+        self.assertEqual(connection.frames[0].split(b'\0', 1)[1][:1], b'\x01')
+        self.assertLess(len(connection.frames[0]), len(LURCH))
+        [question] = connection.receive()
+        self.assertEqual(question['type'], 'question')
+
+    def test_unsupported_offers(self):
+        connection = Connection()
+        connection.send({'type': 'handshake', 'encodings': ['unknown']})
+        [handshake] = connection.receive()
+        self.assertEqual(handshake, {'type': 'handshake',
+            'encoding': 'json', 'compression': None})
+
+    def test_late_handshake(self):
+        connection = Connection()
+        connection.send({'type': 'request', 'use_forest': LURCH,
+            'forest_format': 'conll09_gold'},
+            {'type': 'handshake', 'encodings': ['msgpack']})
+        question, error = connection.receive()
+        self.assertEqual(question['type'], 'question')
+        self.assertEqual(error['type'], 'error')
+
+    def test_invalid_offers(self):
+        connection = Connection()
+        connection.send({'type': 'handshake', 'encodings': 'msgpack'})
+        [error] = connection.receive()
+        self.assertEqual(error['type'], 'error')
+
+
+class BatchTest(unittest.TestCase):
+
+    def test_next_sentences(self):
+        async def annotate():
+            connection = Connection(PARSER_CONFIG)
+            batch = {'type': 'request', 'source_format': 'raw',
+                'process_batch': ['Der Lurch.', 'Der Lurch badet.']}
+            [first] = await connection.exchange(batch)
+            # The first forest holds a single tree.
+            self.assertEqual(first['type'], 'solution')
+            self.assertEqual(
+                (first['batch_index'], first['batch_size']), (0, 2))
+            second, error = await connection.exchange(
+                {'type': 'next'}, {'type': 'next'})
+            self.assertEqual(second['type'], 'question')
+            self.assertEqual(
+                (second['batch_index'], second['batch_size']), (1, 2))
+            self.assertEqual(error['type'], 'error')
+            self.assertIn('no more sentences', error['error_message'])
+        asyncio.run(annotate())
+
+    def test_document(self):
+        async def annotate():
+            connection = Connection(PARSER_CONFIG)
+            [first] = await connection.exchange({'type': 'request',
+                'source_format': 'raw', 'process_batch': 'a\nb\nc\n'})
+            self.assertEqual(first['batch_size'], 3)
+        asyncio.run(annotate())
+
+    def test_next_without_batch(self):
+        async def annotate():
+            connection = Connection(PARSER_CONFIG)
+            [error] = await connection.exchange({'type': 'next'})
+            self.assertEqual(error['type'], 'error')
+            await connection.exchange({'type': 'request',
+                'source_format': 'raw', 'process_batch': ['a', 'b']})
+            # A new forest ends the batch.
+            question, error = await connection.exchange(
+                {'type': 'request', 'use_forest': LURCH,
+                    'forest_format': 'conll09_gold'},
+                {'type': 'next'})
+            self.assertNotIn('batch_index', question)
+            self.assertEqual(error['type'], 'error')
+        asyncio.run(annotate())
+
+
+class PipeliningTest(unittest.TestCase):
+
+    REQUEST = {'type': 'request', 'use_forest': LURCH,
+        'forest_format': 'conll09_gold'}
+
+    def test_ids(self):
+        connection = Connection()
+        connection.send(dict(self.REQUEST, id=1))
+        [question] = connection.receive()
+        self.assertEqual((question['type'], question['id']), ('question', 1))
+        connection.send({'type': 'answer', 'question': question['question'],
+            'answer': True, 'id': 'zwei'}, {'type': 'undo'})
+        answer, undo = connection.receive()
+        self.assertEqual(answer['id'], 'zwei')
+        self.assertNotIn('id', undo)
+        self.assertEqual(undo['question'], question['question'])
+
+    def test_invalid_ids(self):
+        connection = Connection()
+        connection.send(*[dict(self.REQUEST, id=request_id)
+            for request_id in [True, 1.5, [1], 'gut']])
+        *errors, question = connection.receive()
+        for error in errors:
+            self.assertEqual(error['type'], 'error')
+            self.assertNotIn('id', error)
+        self.assertEqual((question['type'], question['id']), ('question', 'gut'))
+
+    def test_messages_wait_for_processing(self):
+        async def annotate():
+            connection = Connection(PARSER_CONFIG)
+            # The second sentence is parsed into a forest of two trees.
+            responses = await connection.exchange(
+                {'type': 'request', 'source_format': 'raw',
+                    'process_batch': ['Der Lurch.', 'Der Lurch badet.'],
+                    'id': 1},
+                {'type': 'next', 'id': 2},
+                {'type': 'abort', 'id': 3})
+            self.assertEqual([(response['type'], response['id'])
+                for response in responses],
+                [('solution', 1), ('question', 2), ('solution', 3)])
+            self.assertEqual(responses[2]['remaining_trees'], 2)
+        asyncio.run(annotate())
+
+    def test_queued_messages_have_the_id(self):
+        async def annotate():
+            pool = WorkerPool(max_workers=1, max_queue=1)
+            await pool.acquire()
+            connection = Connection(PARSER_CONFIG, worker_pool=pool)
+            connection.send({'type': 'request', 'source_format': 'raw',
+                'process': 'Der Lurch.', 'id': 5})
+            await asyncio.sleep(0)
+            [queued] = connection.receive()
+            self.assertEqual(queued, {'type': 'queued', 'position': 1, 'id': 5})
+            pool.release()
+            [solution] = await connection.exchange()
+            self.assertEqual((solution['type'], solution['id']), ('solution', 5))
+        asyncio.run(annotate())
+
+    def test_failing_coroutine(self):
+        async def annotate():
+            connection = Connection(PARSER_CONFIG)
+
+            async def fail(data):
+                raise RuntimeError('kaputt')
+
+            connection.protocol.process_request = fail
+            with self.assertLogs(level='ERROR'):
+                error, question = await connection.exchange(
+                    {'type': 'request', 'source_format': 'raw',
+                        'process': 'Der Lurch.', 'id': 1},
+                    dict(self.REQUEST, id=2))
+            self.assertEqual((error['type'], error['id']), ('error', 1))
+            self.assertIn('kaputt', error['error_message'])
+            self.assertEqual((question['type'], question['id']), ('question', 2))
+        asyncio.run(annotate())
+
+
+if __name__ == '__main__':
+    unittest.main()
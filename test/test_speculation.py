@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+
+"""
+Tests of computing the responses to answers speculatively.
+
+Run from the repository root with: python3 -m unittest discover -s test
+"""
+
+import asyncio
+import os
+import sys
+import unittest
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, TEST_DIR)
+sys.path.insert(0, os.path.join(TEST_DIR, '..', 'aas_server'))
+
+from json_interface import create_question_or_solution
+from speculation import Speculation, SpeculationStats
+from test_server import FORMAT, LURCH, Connection
+from tree import Forest
+
+REQUEST = {'type': 'request', 'use_forest': LURCH,
+    'forest_format': 'conll09_gold'}
+
+
+async def run_callbacks():
+    """
+    Let the event loop run the callbacks scheduled so far and the ones they
+    schedule.
+    """
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def answer(question, value=True):
+    return {'type': 'answer', 'question': question['question'],
+        'answer': value}
+
+
+class SpeculationTest(unittest.TestCase):
+
+    def test_responses(self):
+        async def speculate():
+            forest = Forest.from_string(LURCH, format_info=FORMAT)
+            question = forest.question()
+            speculation = Speculation(
+                forest, question, asyncio.get_event_loop())
+            await run_callbacks()
+            for value in [True, False]:
+                branch, response = speculation.take(question, value)
+                expected = forest.copy()
+                expected.filter(question, value)
+                self.assertEqual(response,
+                    create_question_or_solution(expected))
+                self.assertEqual(len(branch.trees), len(expected.trees))
+            # The forest itself is not filtered.
+            self.assertEqual(len(forest.trees), 8)
+            other = dict(question, relation='OA')
+            self.assertIsNone(speculation.take(other, True))
+        asyncio.run(speculate())
+
+    def test_early_answer(self):
+        async def speculate():
+            forest = Forest.from_string(LURCH, format_info=FORMAT)
+            question = forest.question()
+            speculation = Speculation(
+                forest, question, asyncio.get_event_loop())
+            self.assertIsNone(speculation.take(question, True))
+            # Taking cancels the computation.
+            await run_callbacks()
+            self.assertEqual(speculation.results, {})
+        asyncio.run(speculate())
+
+
+class ServerSpeculationTest(unittest.TestCase):
+
+    def annotate(self, stats, wait):
+        """
+        Answer all questions about the badender Lurch with yes and return
+        the responses. If wait is True, the speculation can finish before
+        every answer.
+        """
+        async def annotate():
+            connection = Connection(speculation_stats=stats)
+            connection.send(REQUEST)
+            [response] = connection.receive()
+            responses = [response]
+            while response['type'] == 'question':
+                if wait:
+                    await run_callbacks()
+                connection.send(answer(response))
+                [response] = connection.receive()
+                responses.append(response)
+            return responses
+        return asyncio.run(annotate())
+
+    def test_hits(self):
+        stats = SpeculationStats()
+        with self.assertLogs(level='INFO'):
+            responses = self.annotate(stats, wait=True)
+        self.assertEqual(responses, self.annotate(None, wait=True))
+        self.assertEqual(
+            (stats.hits, stats.misses, stats.discarded),
+            (len(responses) - 1, 0, 0))
+
+    def test_misses(self):
+        stats = SpeculationStats()
+        with self.assertLogs(level='INFO'):
+            responses = self.annotate(stats, wait=False)
+        self.assertEqual(responses, self.annotate(None, wait=False))
+        self.assertEqual(
+            (stats.hits, stats.misses), (0, len(responses) - 1))
+
+    def test_discarded(self):
+        async def annotate():
+            stats = SpeculationStats()
+            connection = Connection(speculation_stats=stats)
+            connection.send(REQUEST)
+            [question] = connection.receive()
+            await run_callbacks()
+            with self.assertLogs(level='INFO'):
+                connection.send({'type': 'abort'})
+            self.assertEqual(stats.discarded, 1)
+            self.assertIsNone(connection.protocol.speculation)
+        asyncio.run(annotate())
+
+    def test_off_by_default(self):
+        connection = Connection()
+        connection.send(REQUEST)
+        connection.receive()
+        self.assertIsNone(connection.protocol.speculation)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+"""
+Tests of the pool limiting the number of pipelines running at the same
+time.
+
+Run from the repository root with: python3 -m unittest discover -s test
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import unittest
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, TEST_DIR)
+sys.path.insert(0, os.path.join(TEST_DIR, '..', 'aas_server'))
+
+from json_interface import call_processor
+from test_processors import shell, wait_until_dead
+from worker_pool import QueueFullError, WorkerPool
+
+
+class WorkerPoolTest(unittest.TestCase):
+
+    def test_queue(self):
+        async def run_jobs():
+            pool = WorkerPool(max_workers=1, max_queue=2)
+            release = asyncio.get_event_loop().create_future()
+            order = []
+            positions = []
+
+            async def job(name):
+                await release
+                order.append(name)
+
+            jobs = [asyncio.ensure_future(
+                pool.run(job(name), on_queued=positions.append))
+                for name in 'abc']
+            await asyncio.sleep(0)
+            self.assertEqual((pool.running, len(pool)), (1, 2))
+            self.assertEqual(positions, [1, 2])
+
+            rejected = job('d')
+            with self.assertRaises(QueueFullError), \
+                    self.assertLogs(level='WARNING'):
+                await pool.run(rejected)
+            # The rejected coroutine is closed and never runs.
+            self.assertIsNone(rejected.cr_frame)
+
+            release.set_result(None)
+            await asyncio.gather(*jobs)
+            self.assertEqual(order, ['a', 'b', 'c'])
+            self.assertEqual((pool.running, len(pool)), (0, 0))
+
+        asyncio.run(run_jobs())
+
+    def test_cancelled_waiting_job(self):
+        async def run_jobs():
+            pool = WorkerPool(max_workers=1, max_queue=1)
+            release = asyncio.get_event_loop().create_future()
+            running = asyncio.ensure_future(pool.run(release))
+            waiting = asyncio.ensure_future(pool.run(asyncio.sleep(0)))
+            await asyncio.sleep(0)
+            waiting.cancel()
+            await asyncio.sleep(0)
+            self.assertEqual(len(pool), 0)
+            release.set_result('done')
+            self.assertEqual(await running, 'done')
+            self.assertEqual(pool.running, 0)
+
+        asyncio.run(run_jobs())
+
+    def test_timeout_kills_the_process_group(self):
+        with tempfile.TemporaryDirectory() as directory:
+            infile = os.path.join(directory, 'in')
+            open(infile, 'w').close()
+            pidfile = os.path.join(directory, 'pids')
+            processor = shell(
+                'sleep 30 & echo $$ $! > {}; wait'.format(pidfile))
+
+            async def run_job():
+                pool = WorkerPool(max_workers=1, max_queue=0, timeout=0.5)
+                with self.assertRaises(asyncio.TimeoutError):
+                    await pool.run(
+                        call_processor(processor, infile, directory))
+                self.assertEqual(pool.running, 0)
+
+            asyncio.run(run_job())
+            with open(pidfile) as pids:
+                self.assertTrue(
+                    wait_until_dead(map(int, pids.read().split())))
+
+
+if __name__ == '__main__':
+    unittest.main()